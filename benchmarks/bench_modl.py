@@ -0,0 +1,309 @@
+"""Speed benchmarks of modl estimators and Cython kernels on synthetic data.
+
+Usage:
+
+    python benchmarks/bench_modl.py --output bench.json
+    python benchmarks/bench_modl.py --quick --compare bench.json
+
+Results are written as a JSON document holding the environment (versions,
+number of CPUs) and, for each benchmark, its parameters and the best and
+median wall time over the repeats. With --compare, timings are matched
+against a previous result file and the script exits with a non-zero status
+if a benchmark got slower than --tolerance.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+import scipy
+import sklearn
+from sklearn.utils import check_random_state
+
+import modl
+from modl.decomposition.dict_fact import DictFact
+from modl.decomposition.dict_fact_fast import _enet_regression_multi_gram, \
+    _enet_regression_single_gram
+from modl.utils.math.enet import enet_projection, enet_projection_rows
+from modl.utils.randomkit import Sampler
+
+solver_dict = OrderedDict([
+    ('masked', {'Dx_agg': 'masked', 'G_agg': 'masked'}),
+    ('average', {'Dx_agg': 'average', 'G_agg': 'average'}),
+    ('full', {'Dx_agg': 'full', 'G_agg': 'full'}),
+])
+
+sizes = {
+    'default': {'n_samples': 4000, 'n_features': 20000,
+                'n_components': [50, 200], 'reduction': [1, 4, 12],
+                'n_threads': [1, 4], 'dtype': ['float64', 'float32']},
+    'quick': {'n_samples': 500, 'n_features': 2000,
+              'n_components': [20], 'reduction': [1, 4],
+              'n_threads': [1, 2], 'dtype': ['float64']},
+}
+
+
+def generate_synthetic(n_samples, n_features, n_components,
+                       dtype='float64', sparse=False, random_state=0):
+    """Low-rank data X = code.dot(Q) + noise, with sparse non-negative
+    atoms Q if sparse (as the spatial maps of fMRI decompositions)"""
+    rng = check_random_state(random_state)
+    Q = rng.randn(n_components, n_features)
+    if sparse:
+        Q[np.abs(Q) < 1.5] = 0
+        np.abs(Q, out=Q)
+    code = rng.randn(n_samples, n_components)
+    X = code.dot(Q)
+    X += 0.1 * rng.randn(n_samples, n_features)
+    return X.astype(dtype), Q.astype(dtype)
+
+
+def timeit(func, n_repeats, setup=None):
+    """Return the best and median wall time of func() over n_repeats.
+    setup() is called (untimed) before each repeat and its result is
+    passed to func"""
+    times = []
+    for _ in range(n_repeats):
+        args = setup() if setup is not None else ()
+        t0 = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - t0)
+    return {'best': float(np.min(times)), 'median': float(np.median(times)),
+            'n_repeats': n_repeats}
+
+
+def bench_estimator(size, n_repeats, verbose, sparse=False):
+    n_samples, n_features = size['n_samples'], size['n_features']
+    grid = itertools.product(size['dtype'], size['n_components'],
+                             solver_dict, size['reduction'],
+                             size['n_threads'])
+    data = {}
+    for dtype, n_components, solver, reduction, n_threads in grid:
+        if solver == 'full' and reduction != 1:
+            continue
+        if (dtype, n_components) not in data:
+            X, _ = generate_synthetic(n_samples, n_features, n_components,
+                                      dtype=dtype, sparse=sparse)
+            data[dtype, n_components] = X
+        X = data[dtype, n_components]
+        params = OrderedDict([('n_samples', n_samples),
+                              ('n_features', n_features),
+                              ('sparse', sparse),
+                              ('n_components', n_components),
+                              ('dtype', dtype),
+                              ('solver', solver),
+                              ('reduction', reduction),
+                              ('n_threads', n_threads)])
+
+        def make_estimator():
+            return (DictFact(n_components=n_components, code_alpha=1e-2,
+                             code_l1_ratio=0.5, comp_l1_ratio=1,
+                             batch_size=50, n_epochs=1,
+                             reduction=reduction, n_threads=n_threads,
+                             random_state=0, **solver_dict[solver]),)
+
+        def make_fitted():
+            estimator = make_estimator()[0]
+            estimator.prepare(X=X)
+            estimator.partial_fit(X[:n_samples // 10],
+                                  sample_indices=np.arange(n_samples // 10))
+            return (estimator,)
+
+        for method in ['fit', 'partial_fit', 'transform', 'score']:
+            if method == 'fit':
+                func = lambda estimator: estimator.fit(X)
+                setup = make_estimator
+            elif method == 'partial_fit':
+                # Statistics allocation (prepare) is excluded from timing
+                func = lambda estimator: estimator.partial_fit(X)
+                setup = make_fitted
+            else:
+                if reduction != 1 or solver != 'masked':
+                    # transform and score only depend on dtype, threads
+                    continue
+                func = (lambda estimator, method=method:
+                        getattr(estimator, method)(X))
+                setup = make_fitted
+            res = OrderedDict([('name', 'DictFact.%s' % method),
+                               ('params', params)])
+            res.update(timeit(func, n_repeats, setup))
+            if method == 'fit':
+                estimator = make_estimator()[0]
+                estimator.fit(X)
+                res['profile'] = estimator.profile_
+            if verbose:
+                print_result(res)
+            yield res
+
+
+def bench_kernels(size, n_repeats, verbose):
+    n_features = size['n_features']
+    rng = check_random_state(0)
+    batch_size = 50
+    for dtype, n_components in itertools.product(size['dtype'],
+                                                 size['n_components']):
+        dtype = np.dtype(dtype)
+        params = OrderedDict([('n_features', n_features),
+                              ('n_components', n_components),
+                              ('dtype', dtype.name)])
+        V = rng.randn(n_components, n_features).astype(dtype)
+        radius = np.ones(n_components, dtype=dtype)
+
+        def project(V=V):
+            out = np.empty_like(V[0])
+            for k in range(V.shape[0]):
+                enet_projection(V[k], out, 1., 0.5)
+
+        for name, func in [
+            ('enet_projection', project),
+            ('enet_projection_rows',
+             lambda: enet_projection_rows(V, np.empty_like(V), radius,
+                                          dtype.type(0.5))),
+        ]:
+            res = OrderedDict([('name', name), ('params', params)])
+            res.update(timeit(func, n_repeats))
+            if verbose:
+                print_result(res)
+            yield res
+
+        X, Q = generate_synthetic(batch_size, n_features, n_components,
+                                  dtype=dtype)
+        Dx = X.dot(Q.T)
+        G = Q.dot(Q.T)
+        G_multi = np.repeat(G[np.newaxis], batch_size, axis=0)
+        indices = np.arange(batch_size)
+        code = np.ones((batch_size, n_components), dtype=dtype)
+        params = OrderedDict([('batch_size', batch_size),
+                              ('n_components', n_components),
+                              ('dtype', dtype.name)])
+        for name, func in [
+            ('_enet_regression_single_gram',
+             lambda: _enet_regression_single_gram(
+                 G, Dx, X, code, indices, dtype.type(0.5), dtype.type(1e-2),
+                 False, dtype.type(1e-2), 100)),
+            ('_enet_regression_multi_gram',
+             lambda: _enet_regression_multi_gram(
+                 G_multi, Dx, X, code, indices, dtype.type(0.5),
+                 dtype.type(1e-2), False, dtype.type(1e-2), 100)),
+        ]:
+            res = OrderedDict([('name', name), ('params', params)])
+            res.update(timeit(func, n_repeats,
+                              setup=lambda: code.fill(1) or ()))
+            if verbose:
+                print_result(res)
+            yield res
+
+    for rand_size, replacement in itertools.product([True, False],
+                                                    [True, False]):
+        for reduction in size['reduction']:
+            sampler = Sampler(n_features, rand_size, replacement, 0)
+            params = OrderedDict([('n_features', n_features),
+                                  ('reduction', reduction),
+                                  ('rand_size', rand_size),
+                                  ('replacement', replacement),
+                                  ('n_calls', 100)])
+
+            def func(sampler=sampler, reduction=reduction):
+                for _ in range(100):
+                    sampler.yield_subset(reduction)
+
+            res = OrderedDict([('name', 'Sampler.yield_subset'),
+                               ('params', params)])
+            res.update(timeit(func, n_repeats))
+            if verbose:
+                print_result(res)
+            yield res
+
+
+def print_result(res):
+    params = ', '.join('%s=%s' % item for item in res['params'].items())
+    print('%-30s %9.4fs  (%s)' % (res['name'], res['best'], params))
+
+
+def environment():
+    return OrderedDict([
+        ('date', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('modl', getattr(modl, '__version__', None)),
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('scipy', scipy.__version__),
+        ('sklearn', sklearn.__version__),
+        ('platform', platform.platform()),
+        ('cpu_count', os.cpu_count()),
+    ])
+
+
+def key(res):
+    return res['name'], json.dumps(res['params'], sort_keys=True)
+
+
+def compare(results, reference, tolerance):
+    """Print timing ratios to a reference run and return the number of
+    benchmarks slower than (1 + tolerance) times the reference"""
+    reference = {key(res): res for res in reference['results']}
+    n_slower = 0
+    for res in results:
+        ref = reference.get(key(res))
+        if ref is None:
+            continue
+        ratio = res['best'] / ref['best']
+        status = ''
+        if ratio > 1 + tolerance:
+            status = 'SLOWER'
+            n_slower += 1
+        elif ratio < 1 - tolerance:
+            status = 'faster'
+        print('%-30s %6.2fx %s' % (res['name'], ratio, status))
+    return n_slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default='bench_modl.json',
+                        help='JSON file to write results to')
+    parser.add_argument('--quick', action='store_true',
+                        help='Small problem sizes, for smoke testing')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--only', choices=['estimator', 'kernels'],
+                        default=None)
+    parser.add_argument('--compare', default=None,
+                        help='Previous JSON result file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--sparse', action='store_true',
+                        help='Use data generated from sparse non-negative'
+                             ' atoms in estimator benchmarks')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    # Read before results are written, as --output may be the same file
+    reference = None
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            reference = json.load(f)
+
+    size = sizes['quick' if args.quick else 'default']
+    verbose = not args.quiet
+    results = []
+    if args.only in (None, 'kernels'):
+        results.extend(bench_kernels(size, args.repeats, verbose))
+    if args.only in (None, 'estimator'):
+        results.extend(bench_estimator(size, args.repeats, verbose,
+                                       sparse=args.sparse))
+
+    with open(args.output, 'w+') as f:
+        json.dump({'environment': environment(), 'results': results}, f,
+                  indent=2)
+
+    if reference is not None:
+        if compare(results, reference, args.tolerance) > 0:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
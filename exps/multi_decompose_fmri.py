@@ -6,10 +6,9 @@ from os.path import join
 import numpy as np
 from sacred import Experiment
 from sacred.observers import FileStorageObserver
-from sklearn.externals.joblib import Parallel
-from sklearn.externals.joblib import delayed
 from sklearn.utils import check_random_state
 
+from modl.utils.scheduler import Scheduler
 from modl.utils.system import get_output_dir
 
 # Add examples to known modules
@@ -26,7 +25,8 @@ exp.observers.append(FileStorageObserver.create(basedir=basedir))
 
 @exp.config
 def config():
-    n_jobs = 2
+    # Core budget of the sweep
+    n_cores = 2
     n_seeds = 1
     seed = 1
 
@@ -59,7 +59,7 @@ def single_run(config_updates, rundir, _id):
 
 
 @exp.automain
-def run(n_seeds, n_jobs, _run, _seed):
+def run(n_seeds, n_cores, _run, _seed):
     seed_list = check_random_state(_seed).randint(np.iinfo(np.uint32).max,
                                                   size=n_seeds)
     exps = []
@@ -74,6 +74,12 @@ def run(n_seeds, n_jobs, _run, _seed):
     if not os.path.exists(rundir):
         os.makedirs(rundir)
 
-    Parallel(n_jobs=n_jobs,
-             verbose=10)(delayed(single_run)(config_updates, rundir, i)
-                         for i, config_updates in enumerate(exps))
+    # Runs are queued so that their threads fit in the core budget
+    scheduler = Scheduler(n_cores=n_cores, verbose=1)
+    for i, config_updates in enumerate(exps):
+        # Each of the n_jobs threads of a run calls single-threaded BLAS
+        n_jobs = single_exp._create_run(
+            config_updates=config_updates).config['n_jobs']
+        scheduler.submit(single_run, config_updates, rundir, i,
+                         n_cores=n_jobs, blas_threads=1)
+    scheduler.run()
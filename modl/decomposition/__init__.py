@@ -1,4 +1,5 @@
 from .dict_fact import DictFact
 from .fmri import fMRIDictFact
 from .image import ImageDictFact
+from .multi import MultiDictFact
 from .recsys import RecsysDictFact
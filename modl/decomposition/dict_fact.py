@@ -4,21 +4,27 @@ from math import log, ceil
 from tempfile import TemporaryFile
 
 import numpy as np
-import scipy
+import scipy.sparse as sp
 import time
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.utils import check_array, check_random_state, gen_batches
 from sklearn.utils.validation import check_is_fitted
 
 from modl.utils import get_sub_slice
+from modl.utils.profiling import PhaseProfiler
 from modl.utils.randomkit import RandomState
 from modl.utils.randomkit import Sampler
 from .dict_fact_fast import _enet_regression_multi_gram, \
-    _enet_regression_single_gram, _update_G_average, _batch_weight
-from ..utils.math.enet import enet_norm, enet_projection, enet_scale
+    _enet_regression_single_gram, _update_G_average, _batch_weight, \
+    _update_dict_subset
+from ..utils.math.enet import enet_norm_rows, enet_projection_rows, \
+    enet_scale_rows
+from ..utils.math.sketch import NystromSketch
 
 MAX_INT = np.iinfo(np.int64).max
 
+PHASES = ['sampling', 'Dx', 'gram', 'G_average', 'coding', 'stat', 'dict']
+
 
 class CodingMixin(TransformerMixin):
     def _set_coding_params(self,
@@ -29,7 +35,8 @@ class CodingMixin(TransformerMixin):
                            max_iter=100,
                            code_pos=False,
                            random_state=None,
-                           n_threads=1
+                           n_threads=1,
+                           temporal_warm_start=False
                            ):
         self.n_components = n_components
         self.code_l1_ratio = code_l1_ratio
@@ -38,6 +45,7 @@ class CodingMixin(TransformerMixin):
         self.random_state = random_state
         self.tol = tol
         self.max_iter = max_iter
+        self.temporal_warm_start = temporal_warm_start
 
         self.n_threads = n_threads
 
@@ -64,13 +72,12 @@ class CodingMixin(TransformerMixin):
         if X.flags['WRITEABLE'] is False:
             X = X.copy()
         n_samples, n_features = X.shape
-        if not hasattr(self, 'G_agg') or self.G_agg != 'full':
-            G = self.components_.dot(self.components_.T)
-        else:
-            G = self.G_
-        Dx = X.dot(self.components_.T)
+        G = self._get_gram()
+        Dx = self._project(X)
         code = np.ones((n_samples, self.n_components), dtype=dtype)
         sample_indices = np.arange(n_samples)
+        # Threads code contiguous segments of samples, so that warm starts
+        # follow samples in order within each segment
         size_job = ceil(n_samples / self.n_threads)
         batches = list(gen_batches(n_samples, size_job))
 
@@ -78,7 +85,7 @@ class CodingMixin(TransformerMixin):
             G, Dx[batch], X[batch], code,
             get_sub_slice(sample_indices, batch),
             self.code_l1_ratio, self.code_alpha, self.code_pos,
-            self.tol, self.max_iter)
+            self.tol, self.max_iter, self.temporal_warm_start)
         if self.n_threads > 1:
             res = self._pool.map(par_func, batches)
             _ = list(res)
@@ -87,10 +94,19 @@ class CodingMixin(TransformerMixin):
                 G, Dx, X, code,
                 sample_indices,
                 self.code_l1_ratio, self.code_alpha, self.code_pos,
-                self.tol, self.max_iter)
+                self.tol, self.max_iter, self.temporal_warm_start)
 
         return code
 
+    def _get_gram(self):
+        if not hasattr(self, 'G_agg') or self.G_agg != 'full':
+            return self.components_.dot(self.components_.T)
+        return self.G_
+
+    def _project(self, X):
+        """Dx = X.dot(components_.T), C-ordered"""
+        return X.dot(self.components_.T)
+
     def score(self, X):
         """
         Objective function value on test data X
@@ -150,6 +166,9 @@ class DictFact(CodingMixin, BaseEstimator):
                  n_threads=1,
                  rand_size=True,
                  replacement=True,
+                 profile_memory=False,
+                 profile_callback=None,
+                 temporal_warm_start=False,
                  ):
         """
         Estimator to perform matrix factorization by streaming samples and
@@ -189,8 +208,10 @@ class DictFact(CodingMixin, BaseEstimator):
             Penalty applied to the code in the minimization problem
         code_l1_ratio: float in [0, 1]
             Ratio of l1 penalty for the code in the minimization problem
-        dict_init: ndarray, shape = (n_components, n_features)
-            Initial dictionary
+        dict_init: ndarray, shape = (n_components, n_features) or 'svd'
+            Initial dictionary. 'svd' initializes it with the leading
+            principal axes of the data, estimated in a single pass by a
+            randomized sketch (see modl.utils.math.sketch)
         n_epochs: int
             Number of epochs to perform over data
         n_components: int
@@ -219,6 +240,15 @@ class DictFact(CodingMixin, BaseEstimator):
             Whether the masks should have fixed size
         replacement: boolean
             Whether to compute random or cycling masks
+        profile_memory: boolean
+            Record the bytes allocated within each phase of the algorithm
+            (slow, uses tracemalloc)
+        profile_callback: callable,
+            Function called after each batch with the estimator and the
+            per-phase statistics of this batch
+        temporal_warm_start: boolean
+            In transform, code samples in order, starting coordinate descent
+            from the code of the previous sample (see Coder)
 
         Attributes
         ----------
@@ -230,8 +260,6 @@ class DictFact(CodingMixin, BaseEstimator):
             For computing D gradient
         self.B_: ndarray, shape = (n_components, n_features)
             For computing D gradient
-        self.gradient_: ndarray, shape = (n_components, n_features)
-            D gradient, to perform block coordinate descent
         self.G_: ndarray, shape = (n_components, n_components)
             Gram matrix
         self.Dx_average_: ndarray, shape = (n_samples, n_components)
@@ -247,6 +275,11 @@ class DictFact(CodingMixin, BaseEstimator):
             List of verbose iteration
         self.feature_sampler_: Sampler
             Generator of masks
+        self.profile_: OrderedDict
+            Cumulated wall time, number of calls (and allocated bytes if
+            profile_memory) for each phase of the algorithm: 'sampling',
+            'Dx', 'gram', 'G_average', 'coding', 'stat' (C and B update) and
+            'dict' (dictionary update)
         """
 
         self.batch_size = batch_size
@@ -265,7 +298,8 @@ class DictFact(CodingMixin, BaseEstimator):
                                 random_state=random_state,
                                 tol=tol,
                                 max_iter=max_iter,
-                                n_threads=n_threads)
+                                n_threads=n_threads,
+                                temporal_warm_start=temporal_warm_start)
 
         self.comp_l1_ratio = comp_l1_ratio
         self.comp_pos = comp_pos
@@ -283,6 +317,9 @@ class DictFact(CodingMixin, BaseEstimator):
         self.rand_size = rand_size
         self.replacement = replacement
 
+        self.profile_memory = profile_memory
+        self.profile_callback = profile_callback
+
     def fit(self, X):
         """
         Compute the factorisation X ~ code_ x components_, solving for
@@ -297,12 +334,7 @@ class DictFact(CodingMixin, BaseEstimator):
         self
         """
         X = check_array(X, order='C', dtype=[np.float32, np.float64])
-        if self.dict_init is None:
-            dict_init = X
-        else:
-            dict_init = check_array(self.dict_init,
-                                    dtype=X.dtype.type)
-        self.prepare(n_samples=X.shape[0], X=dict_init)
+        self.prepare(n_samples=X.shape[0], X=self._get_dict_init(X))
         # Main loop
         for _ in range(self.n_epochs):
             self.partial_fit(X)
@@ -310,6 +342,19 @@ class DictFact(CodingMixin, BaseEstimator):
             X = X[permutation]
         return self
 
+    def _get_dict_init(self, X):
+        """Array from which prepare draws the initial dictionary, given
+        the data X to fit"""
+        if self.dict_init is None:
+            return X
+        elif _is_svd_init(self.dict_init):
+            dict_init = NystromSketch(
+                X.shape[1], self.n_components,
+                random_state=self.random_state).partial_fit(X).components()[0]
+            return dict_init.astype(X.dtype)
+        else:
+            return check_array(self.dict_init, dtype=X.dtype.type)
+
     def partial_fit(self, X, sample_indices=None):
         """
         Update the factorization using rows from X
@@ -441,8 +486,6 @@ class DictFact(CodingMixin, BaseEstimator):
         # Dictionary statistics
         self.C_ = np.zeros((self.n_components, self.n_components), dtype=dtype)
         self.B_ = np.zeros((self.n_components, n_features), dtype=dtype)
-        self.gradient_ = np.zeros((self.n_components, n_features), dtype=dtype,
-                                  order='F')
 
         self.random_state = check_random_state(self.random_state)
         if X is None:
@@ -459,10 +502,10 @@ class DictFact(CodingMixin, BaseEstimator):
         if self.comp_pos:
             self.components_[self.components_ <= 0] = \
                 - self.components_[self.components_ <= 0]
-        for i in range(self.n_components):
-            enet_scale(self.components_[i],
-                       l1_ratio=self.comp_l1_ratio,
-                       radius=1)
+        enet_scale_rows(self.components_, self.comp_l1_ratio,
+                        np.ones(self.n_components,
+                                dtype=self.components_.dtype),
+                        self.n_threads)
 
         self.code_ = np.ones((n_samples, self.n_components), dtype=dtype)
 
@@ -485,6 +528,8 @@ class DictFact(CodingMixin, BaseEstimator):
                                               base=10) - 1) * self.batch_size
             self.verbose_iter_ = self.verbose_iter_.tolist()
         self.time_ = 0
+        self._profiler = PhaseProfiler(PHASES, memory=self.profile_memory)
+        self.profile_ = self._profiler.stats
         return self
 
     def _callback(self):
@@ -503,16 +548,18 @@ class DictFact(CodingMixin, BaseEstimator):
             X = X.copy()
         t0 = time.perf_counter()
 
-        subset = self.feature_sampler_.yield_subset(self.reduction)
-        batch_size = X.shape[0]
-
-        self.n_iter_ += batch_size
-        self.sample_n_iter_[sample_indices] += 1
-        this_sample_n_iter = self.sample_n_iter_[sample_indices]
-        w_sample = np.power(this_sample_n_iter, -self.sample_learning_rate). \
-            astype(self.components_.dtype)
-        w = _batch_weight(self.n_iter_, batch_size,
-                          self.learning_rate, 0)
+        with self._profiler('sampling'):
+            subset = self.feature_sampler_.yield_subset(self.reduction)
+            batch_size = X.shape[0]
+
+            self.n_iter_ += batch_size
+            self.sample_n_iter_[sample_indices] += 1
+            this_sample_n_iter = self.sample_n_iter_[sample_indices]
+            w_sample = np.power(this_sample_n_iter,
+                                -self.sample_learning_rate). \
+                astype(self.components_.dtype)
+            w = _batch_weight(self.n_iter_, batch_size,
+                              self.learning_rate, 0)
         self._compute_code(X, sample_indices, w_sample, subset)
 
         this_code = self.code_[sample_indices]
@@ -523,46 +570,66 @@ class DictFact(CodingMixin, BaseEstimator):
             self._update_stat_and_dict_parallel(subset, X,
                                                 this_code, w)
         self.time_ += time.perf_counter() - t0
+        batch_profile = self._profiler.new_batch()
+        if self.profile_callback is not None:
+            self.profile_callback(self, batch_profile)
 
     def _update_stat_and_dict(self, subset, X, code, w):
         """For multi-threading"""
-        self._update_C(code, w)
-        self._update_B(X, code, w)
-        self.gradient_[:, subset] = self.B_[:, subset]
-        self._update_dict(subset, w)
+        with self._profiler('stat'):
+            self._update_C(code, w)
+            self._update_B(X, code, w)
+            # Fortran-ordered copy of B_[:, subset], used as gradient workspace
+            gradient_subset = self.B_[:, subset]
+        with self._profiler('dict'):
+            self._update_dict(subset, w, gradient_subset)
 
     def _update_stat_and_dict_parallel(self, subset, X, this_code, w):
         """For multi-threading"""
-        self.gradient_[:, subset] = self.B_[:, subset]
+        # Gather the gradient before B_ is modified by the other thread
+        with self._profiler('stat'):
+            gradient_subset = self.B_[:, subset]
+
+        def update_B():
+            with self._profiler('stat'):
+                self._update_B(X, this_code, w)
+
         dict_thread = self._pool.submit(self._update_stat_partial_and_dict,
-                                        subset, X, this_code, w)
-        B_thread = self._pool.submit(self._update_B, X,
-                                     this_code, w)
+                                        subset, X, this_code, w,
+                                        gradient_subset)
+        B_thread = self._pool.submit(update_B)
         dict_thread.result()
         B_thread.result()
 
-    def _update_stat_partial_and_dict(self, subset, X, code, w):
+    def _update_stat_partial_and_dict(self, subset, X, code, w,
+                                      gradient_subset):
         """For multi-threading"""
-        self._update_C(code, w)
-        # Gradient update
-        batch_size = X.shape[0]
-        X_subset = X[:, subset]
-        if self.optimizer == 'variational':
-            self.gradient_[:, subset] *= 1 - w
-            self.gradient_[:, subset] += w * code.T.dot(X_subset) / batch_size
-        else:
-            self.gradient_[:, subset] = code.T.dot(X_subset) / batch_size
+        with self._profiler('stat'):
+            self._update_C(code, w)
+            # Gradient update
+            batch_size = X.shape[0]
+            X_subset = X[:, subset]
+            if self.optimizer == 'variational':
+                gradient_subset *= 1 - w
+                gradient_subset += w * code.T.dot(X_subset) / batch_size
+            else:
+                gradient_subset[:] = code.T.dot(X_subset) / batch_size
 
-        self._update_dict(subset, w)
+        with self._profiler('dict'):
+            self._update_dict(subset, w, gradient_subset)
 
     def _update_B(self, X, code, w):
         """Update B statistics (for updating D)"""
         batch_size = X.shape[0]
+        # Single full-size temporary, scaled in place
+        B_update = code.T.dot(X)
         if self.optimizer == 'variational':
+            B_update *= w / batch_size
             self.B_ *= 1 - w
-            self.B_ += w * code.T.dot(X) / batch_size
+            self.B_ += B_update
         else:
-            self.B_ = code.T.dot(X) / batch_size
+            B_update /= batch_size
+            self.B_ = B_update
 
     def _update_C(self, this_code, w):
         """Update C statistics (for updating D)"""
@@ -584,69 +651,75 @@ class DictFact(CodingMixin, BaseEstimator):
             size_job = ceil(batch_size / self.n_threads)
             batches = list(gen_batches(batch_size, size_job))
 
-        if self.Dx_agg != 'full' or self.G_agg != 'full':
-            components_subset = self.components_[:, subset]
+        profiler = self._profiler
 
-        if self.Dx_agg == 'full':
-            Dx = X.dot(self.components_.T)
-        else:
-            X_subset = X[:, subset]
-            Dx = X_subset.dot(components_subset.T) * reduction
-            self.Dx_average_[sample_indices] \
-                *= 1 - w_sample[:, np.newaxis]
-            self.Dx_average_[sample_indices] \
-                += Dx * w_sample[:, np.newaxis]
-            if self.Dx_agg == 'average':
-                Dx = self.Dx_average_[sample_indices]
+        with profiler('Dx'):
+            if self.Dx_agg != 'full' or self.G_agg != 'full':
+                components_subset = self.components_[:, subset]
+
+            if self.Dx_agg == 'full':
+                Dx = X.dot(self.components_.T)
+            else:
+                X_subset = X[:, subset]
+                Dx = X_subset.dot(components_subset.T) * reduction
+                self.Dx_average_[sample_indices] \
+                    *= 1 - w_sample[:, np.newaxis]
+                self.Dx_average_[sample_indices] \
+                    += Dx * w_sample[:, np.newaxis]
+                if self.Dx_agg == 'average':
+                    Dx = self.Dx_average_[sample_indices]
 
         if self.G_agg != 'full':
-            G = components_subset.dot(components_subset.T) * reduction
+            with profiler('gram'):
+                G = components_subset.dot(components_subset.T) * reduction
             if self.G_agg == 'average':
-                G_average = np.array(self.G_average_[sample_indices],
-                                     copy=True)
-                if self.n_threads > 1:
-                    par_func = lambda batch: _update_G_average(
-                        G_average[batch],
-                        G,
-                        w_sample[batch],
-                    )
-                    res = self._pool.map(par_func, batches)
-                    _ = list(res)
-                else:
-                    _update_G_average(G_average, G, w_sample)
-                self.G_average_[sample_indices] = G_average
+                with profiler('G_average'):
+                    G_average = np.array(self.G_average_[sample_indices],
+                                         copy=True)
+                    if self.n_threads > 1:
+                        par_func = lambda batch: _update_G_average(
+                            G_average[batch],
+                            G,
+                            w_sample[batch],
+                        )
+                        res = self._pool.map(par_func, batches)
+                        _ = list(res)
+                    else:
+                        _update_G_average(G_average, G, w_sample)
+                    self.G_average_[sample_indices] = G_average
         else:
             G = self.G_
-        if self.n_threads > 1:
-            if self.G_agg == 'average':
-                par_func = lambda batch: _enet_regression_multi_gram(
-                    G_average[batch], Dx[batch], X[batch], self.code_,
-                    get_sub_slice(sample_indices, batch),
-                    self.code_l1_ratio, self.code_alpha, self.code_pos,
-                    self.tol, self.max_iter)
-            else:
-                par_func = lambda batch: _enet_regression_single_gram(
-                    G, Dx[batch], X[batch], self.code_,
-                    get_sub_slice(sample_indices, batch),
-                    self.code_l1_ratio, self.code_alpha, self.code_pos,
-                    self.tol, self.max_iter)
-            res = self._pool.map(par_func, batches)
-            _ = list(res)
-        else:
-            if self.G_agg == 'average':
-                _enet_regression_multi_gram(
-                    G_average, Dx, X, self.code_,
-                    sample_indices,
-                    self.code_l1_ratio, self.code_alpha, self.code_pos,
-                    self.tol, self.max_iter)
+        with profiler('coding'):
+            if self.n_threads > 1:
+                if self.G_agg == 'average':
+                    par_func = lambda batch: _enet_regression_multi_gram(
+                        G_average[batch], Dx[batch], X[batch], self.code_,
+                        get_sub_slice(sample_indices, batch),
+                        self.code_l1_ratio, self.code_alpha, self.code_pos,
+                        self.tol, self.max_iter)
+                else:
+                    par_func = lambda batch: _enet_regression_single_gram(
+                        G, Dx[batch], X[batch], self.code_,
+                        get_sub_slice(sample_indices, batch),
+                        self.code_l1_ratio, self.code_alpha, self.code_pos,
+                        self.tol, self.max_iter)
+                res = self._pool.map(par_func, batches)
+                _ = list(res)
             else:
-                _enet_regression_single_gram(
-                    G, Dx, X, self.code_,
-                    sample_indices,
-                    self.code_l1_ratio, self.code_alpha, self.code_pos,
-                    self.tol, self.max_iter)
+                if self.G_agg == 'average':
+                    _enet_regression_multi_gram(
+                        G_average, Dx, X, self.code_,
+                        sample_indices,
+                        self.code_l1_ratio, self.code_alpha, self.code_pos,
+                        self.tol, self.max_iter)
+                else:
+                    _enet_regression_single_gram(
+                        G, Dx, X, self.code_,
+                        sample_indices,
+                        self.code_l1_ratio, self.code_alpha, self.code_pos,
+                        self.tol, self.max_iter)
 
-    def _update_dict(self, subset, w):
+    def _update_dict(self, subset, w, gradient_subset):
         """Dictionary update part
 
         Parameters
@@ -654,57 +727,39 @@ class DictFact(CodingMixin, BaseEstimator):
         subset: ndarray,
             Subset of features to update.
 
+        w: float,
+            Weight of the current batch
+
+        gradient_subset: ndarray, shape = (n_components, len_subset)
+            Fortran-ordered workspace holding B_[:, subset]. Overwritten.
         """
-        ger, = scipy.linalg.get_blas_funcs(('ger',), (self.C_,
-                                                      self.components_))
         len_subset = subset.shape[0]
         n_components, n_features = self.components_.shape
         components_subset = self.components_[:, subset]
-        atom_temp = np.zeros(len_subset, dtype=self.components_.dtype)
-        gradient_subset = self.gradient_[:, subset]
 
         if self.G_agg == 'full' and len_subset < n_features / 2.:
             self.G_ -= components_subset.dot(components_subset.T)
 
-        gradient_subset -= self.C_.dot(components_subset)
-
         order = self.random_state.permutation(n_components)
 
         if self.optimizer == 'variational':
-            for k in order:
-                subset_norm = enet_norm(components_subset[k],
-                                        self.comp_l1_ratio)
-                self.comp_norm_[k] += subset_norm
-                gradient_subset = ger(1.0, self.C_[k], components_subset[k],
-                                      a=gradient_subset, overwrite_a=True)
-                if self.C_[k, k] > 1e-20:
-                    components_subset[k] = gradient_subset[k] / self.C_[k, k]
-                # Else do not update
-                if self.comp_pos:
-                    components_subset[components_subset < 0] = 0
-                enet_projection(components_subset[k],
-                                atom_temp,
-                                self.comp_norm_[k], self.comp_l1_ratio)
-                components_subset[k] = atom_temp
-                subset_norm = enet_norm(components_subset[k],
-                                        self.comp_l1_ratio)
-                self.comp_norm_[k] -= subset_norm
-                gradient_subset = ger(-1.0, self.C_[k], components_subset[k],
-                                      a=gradient_subset, overwrite_a=True)
+            _update_dict_subset(self.C_, gradient_subset, components_subset,
+                                self.comp_norm_, order,
+                                self.comp_l1_ratio, self.comp_pos)
         else:
-            for k in order:
-                subset_norm = enet_norm(components_subset[k],
-                                        self.comp_l1_ratio)
-                self.comp_norm_[k] += subset_norm
+            subset_norm = np.empty(n_components,
+                                   dtype=self.components_.dtype)
+            gradient_subset -= self.C_.dot(components_subset)
+            enet_norm_rows(components_subset, subset_norm,
+                           self.comp_l1_ratio, self.n_threads)
+            self.comp_norm_ += subset_norm
             components_subset += w * self.step_size * gradient_subset
-            for k in range(self.n_components):
-                enet_projection(components_subset[k],
-                                atom_temp,
-                                self.comp_norm_[k], self.comp_l1_ratio)
-                components_subset[k] = atom_temp
-                subset_norm = enet_norm(components_subset[k],
-                                        self.comp_l1_ratio)
-                self.comp_norm_[k] -= subset_norm
+            enet_projection_rows(components_subset, components_subset,
+                                 self.comp_norm_, self.comp_l1_ratio,
+                                 self.n_threads)
+            enet_norm_rows(components_subset, subset_norm,
+                           self.comp_l1_ratio, self.n_threads)
+            self.comp_norm_ -= subset_norm
         self.components_[:, subset] = components_subset
 
         if self.G_agg == 'full':
@@ -720,7 +775,43 @@ class DictFact(CodingMixin, BaseEstimator):
             self.G_average_mmap_.close()
 
 
+def _is_svd_init(dict_init):
+    return isinstance(dict_init, str) and dict_init == 'svd'
+
+
 class Coder(CodingMixin, BaseEstimator):
+    """
+    Project data onto a fixed dictionary.
+
+    Parameters
+    ----------
+    dictionary: ndarray, shape (n_components, n_features)
+
+    sparse_dictionary: boolean or 'auto'
+        Store the dictionary restricted to its support (the features used by
+        at least one atom), in sparse format, so that projections only read
+        the support of data and cost a sparse-dense product. 'auto' does so
+        if the fraction of non-zero coefficients of the dictionary is lower
+        than SPARSE_DENSITY.
+
+    temporal_warm_start: boolean
+        Code samples in order, starting coordinate descent from the code of
+        the previous sample rather than from ones. This reduces the number
+        of iterations when coding correlated time series (e.g. fMRI frames)
+        with an l1 penalty. Each of the n_threads threads codes a contiguous
+        segment of samples.
+
+    Attributes
+    ----------
+    density_: float
+        Fraction of non-zero coefficients of the dictionary
+
+    gram_: ndarray, shape (n_components, n_components)
+        Precomputed Gram matrix of the dictionary
+    """
+    # Density below which the dictionary is stored as sparse with 'auto'
+    SPARSE_DENSITY = 0.1
+
     def __init__(self, dictionary,
                  code_alpha=1,
                  code_l1_ratio=1,
@@ -728,7 +819,9 @@ class Coder(CodingMixin, BaseEstimator):
                  max_iter=100,
                  code_pos=False,
                  random_state=None,
-                 n_threads=1
+                 n_threads=1,
+                 sparse_dictionary='auto',
+                 temporal_warm_start=False
                  ):
         self._set_coding_params(dictionary.shape[0],
                                 code_l1_ratio=code_l1_ratio,
@@ -737,8 +830,36 @@ class Coder(CodingMixin, BaseEstimator):
                                 random_state=random_state,
                                 tol=tol,
                                 max_iter=max_iter,
-                                n_threads=n_threads)
+                                n_threads=n_threads,
+                                temporal_warm_start=temporal_warm_start)
         self.components_ = dictionary
+        self.sparse_dictionary = sparse_dictionary
 
     def fit(self, X=None):
+        components = self.components_
+        self.density_ = np.count_nonzero(components) / components.size
+        if self.sparse_dictionary == 'auto':
+            sparse = self.density_ < self.SPARSE_DENSITY
+        else:
+            sparse = bool(self.sparse_dictionary)
+        self.gram_ = components.dot(components.T)
+        if sparse:
+            self.support_ = np.flatnonzero(np.any(components != 0, axis=0))
+            self.sparse_components_ = sp.csc_matrix(
+                components[:, self.support_])
+        else:
+            self.support_ = None
+            self.sparse_components_ = None
         return self
+
+    def _get_gram(self):
+        if not hasattr(self, 'gram_'):
+            return CodingMixin._get_gram(self)
+        return self.gram_
+
+    def _project(self, X):
+        if getattr(self, 'sparse_components_', None) is None:
+            return CodingMixin._project(self, X)
+        # Only the support of the dictionary is read from X
+        return np.ascontiguousarray(X[:, self.support_]
+                                    @ self.sparse_components_.T)
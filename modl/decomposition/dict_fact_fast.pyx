@@ -12,8 +12,11 @@ cdef int ONE = 1
 from cython cimport floating
 
 from scipy.linalg.cython_blas cimport saxpy, daxpy, sdot, ddot, sasum, dasum, dgemv, sgemv
+from scipy.linalg.cython_blas cimport sger, dger, sgemm, dgemm, scopy, dcopy
 from scipy.linalg.cython_lapack cimport dposv, sposv
 
+from ..utils.math.enet cimport enet_norm, enet_projection
+
 from libc.math cimport pow, fabs
 
 cimport numpy as np
@@ -29,6 +32,14 @@ ctypedef floating (*DOT)(int* N, floating* X, int* incX, floating* Y,
 ctypedef void (*AXPY)(int* N, floating* alpha, floating* X, int* incX,
                       floating* Y, int* incY) nogil
 ctypedef floating (*ASUM)(int* N, floating* X, int* incX) nogil
+ctypedef void (*GER)(int* M, int* N, floating* alpha, floating* X, int* incX,
+                     floating* Y, int* incY, floating* A, int* LDA) nogil
+ctypedef void (*GEMM)(char* transA, char* transB, int* M, int* N, int* K,
+                      floating* alpha, floating* A, int* LDA,
+                      floating* B, int* LDB, floating* beta,
+                      floating* C, int* LDC) nogil
+ctypedef void (*COPY)(int* N, floating* X, int* incX, floating* Y,
+                      int* incY) nogil
 
 
 def _enet_regression_multi_gram(floating[:, :, ::1] G, floating[:, ::1] Dx,
@@ -130,13 +141,19 @@ def _enet_regression_single_gram(floating[:, ::1] G, floating[:, ::1] Dx,
                                 floating l1_ratio, floating alpha,
                                 bint positive,
                                 floating tol,
-                                int max_iter):
+                                int max_iter,
+                                bint warm_start=False,
+                                int[:] n_iter=None):
     '''
     Perform elastic net regression: for all i in indices,
     find code[i] s.t code[i].dot(G) = Dx[ii], where i = indices[ii].
     G and code are the arrays containing the values for all samples,
     while Dx and X should already be subscripted.
 
+    Coordinate descent starts from code[i], or, if warm_start, from the
+    solution for the previous sample in indices (for the first sample,
+    from code[i]), which is close for samples of correlated time series.
+
     Parameters
     ----------
     G: array, shape (n_samples x n_components x n_components)
@@ -147,9 +164,13 @@ def _enet_regression_single_gram(floating[:, ::1] G, floating[:, ::1] Dx,
     l1_ratio: floating, enet-regression parameter
     alpha: floating, enet-regression paramater
     positive: bint, enet-regression parameter
+    warm_start: bint, start from the code of the previous sample
+    n_iter: array, shape (batch_size), or None. If not None, receives the
+        number of coordinate descent iterations done for each sample
     '''
     cdef int batch_size = indices.shape[0]
-    cdef int i, j, info, ii
+    cdef int i, j, info, ii, prev, this_n_iter
+    cdef bint count_iter = n_iter is not None
     cdef int n_components = G.shape[0]
     cdef int n_features = X.shape[1]
     cdef floating* G_ptr = <floating*> &G[0, 0]
@@ -204,15 +225,21 @@ def _enet_regression_single_gram(floating[:, ::1] G, floating[:, ::1] Dx,
         with nogil:
             for ii in range(batch_size):
                 i = indices[ii]
+                if warm_start and ii > 0:
+                    prev = indices[ii - 1]
+                    for j in range(n_components):
+                        code[i, j] = code[prev, j]
                 this_Dx = Dx[ii, :]
                 this_X = X[ii, :]
                 this_code = code[i, :]
-                enet_coordinate_descent_gram(
+                this_n_iter = enet_coordinate_descent_gram(
                     this_code,
                     alpha * l1_ratio,
                     alpha * (1 - l1_ratio),
                     G, this_Dx, this_X, H, XtA, max_iter, tol,
                     positive)
+                if count_iter:
+                    n_iter[ii] = this_n_iter
     return np.asarray(code)
 
 def _update_G_average(floating[:, :, ::1] G_average,
@@ -229,6 +256,99 @@ def _update_G_average(floating[:, :, ::1] G_average,
     return G_average
 
 
+def _update_dict_subset(floating[:, ::1] C,
+                        floating[::1, :] gradient_subset,
+                        floating[::1, :] components_subset,
+                        floating[:] comp_norm,
+                        long[:] order,
+                        floating l1_ratio,
+                        bint positive):
+    """
+    Randomized block coordinate descent over the atoms of the dictionary,
+    restricted to a subset of features. Update components_subset inplace.
+
+    Parameters
+    ----------
+    C: array, shape (n_components, n_components)
+        Symmetric C statistics
+    gradient_subset: Fortran array, shape (n_components, len_subset)
+        B[:, subset], used as workspace (overwritten)
+    components_subset: Fortran array, shape (n_components, len_subset)
+        D[:, subset], updated inplace
+    comp_norm: array, shape (n_components)
+        Elastic-net norm of each atom outside of the subset, updated inplace
+    order: array, shape (n_components)
+        Order in which to update atoms
+    l1_ratio: floating, elastic-net constraint parameter
+    positive: bint, enforce positive atoms
+    """
+    cdef int n_components = components_subset.shape[0]
+    cdef int len_subset = components_subset.shape[1]
+    cdef int ii, j, k
+    cdef floating* C_ptr = &C[0, 0]
+    cdef floating* G_ptr
+    cdef floating* comp_ptr
+    cdef floating* atom_ptr
+    cdef floating one = 1
+    cdef floating m_one = -1
+    cdef floating inv_C_kk
+    cdef floating[:] atom_temp
+    cdef floating[:] atom
+    cdef str format
+    cdef GER ger
+    cdef GEMM gemm
+    cdef COPY copy
+
+    if len_subset == 0:
+        return
+
+    if floating is float:
+        ger = sger
+        gemm = sgemm
+        copy = scopy
+        format = 'f'
+    else:
+        ger = dger
+        gemm = dgemm
+        copy = dcopy
+        format = 'd'
+
+    atom_temp = view.array((len_subset, ), sizeof(floating),
+                           format=format, mode='c')
+    G_ptr = &gradient_subset[0, 0]
+    comp_ptr = &components_subset[0, 0]
+    atom_ptr = &atom_temp[0]
+
+    with nogil:
+        # gradient_subset -= C.dot(components_subset), C being symmetric
+        gemm(&NTRANS, &NTRANS, &n_components, &len_subset, &n_components,
+             &m_one, C_ptr, &n_components, comp_ptr, &n_components,
+             &one, G_ptr, &n_components)
+        for ii in range(n_components):
+            k = order[ii]
+            atom = components_subset[k, :]
+            comp_norm[k] += enet_norm(atom, l1_ratio)
+            # gradient_subset += C[k] x components_subset[k]
+            ger(&n_components, &len_subset, &one, C_ptr + k * n_components,
+                &ONE, comp_ptr + k, &n_components, G_ptr, &n_components)
+            if C[k, k] > 1e-20:
+                inv_C_kk = 1. / C[k, k]
+                for j in range(len_subset):
+                    components_subset[k, j] = gradient_subset[k, j] * inv_C_kk
+            # Else do not update
+            if positive:
+                for j in range(len_subset):
+                    if components_subset[k, j] < 0:
+                        components_subset[k, j] = 0
+            enet_projection(atom, atom_temp,
+                            comp_norm[k], l1_ratio)
+            copy(&len_subset, atom_ptr, &ONE, comp_ptr + k, &n_components)
+            comp_norm[k] -= enet_norm(atom, l1_ratio)
+            # gradient_subset -= C[k] x components_subset[k]
+            ger(&n_components, &len_subset, &m_one, C_ptr + k * n_components,
+                &ONE, comp_ptr + k, &n_components, G_ptr, &n_components)
+
+
 # Shamelessly copied from sklearn (no .pxd in sources :-( )
 cdef inline floating fmax(floating x, floating y) nogil:
     if x > y:
@@ -268,7 +388,7 @@ cdef floating max(int n, floating* a) nogil:
             m = d
     return m
 
-cdef void enet_coordinate_descent_gram(floating[:] w, floating alpha, floating beta,
+cdef int enet_coordinate_descent_gram(floating[:] w, floating alpha, floating beta,
                                  floating[:, ::1] Q,
                                  floating[::1] q,
                                  floating[:] y,
@@ -285,6 +405,8 @@ cdef void enet_coordinate_descent_gram(floating[:] w, floating alpha, floating b
         which amount to the Elastic-Net problem when:
         Q = X^T X (Gram matrix)
         q = X^T y
+
+        Returns the number of iterations done.
     """
 
     # fused types version of BLAS functions
@@ -425,4 +547,5 @@ cdef void enet_coordinate_descent_gram(floating[:] w, floating alpha, floating b
 
             if gap < tol:
                 # return if we reached desired tolerance
-                break
\ No newline at end of file
+                break
+    return n_iter + 1
@@ -7,25 +7,44 @@ component sparsity
 # License: BSD 3 clause
 from __future__ import division
 
+import atexit
+import functools
 import itertools
+import multiprocessing
+import os
+import shutil
 import time
 import warnings
-from math import log, sqrt
+import weakref
+from copy import deepcopy
+from math import log
+from tempfile import mkdtemp, mkstemp
 
 import numpy as np
-from nibabel.filebasedimages import ImageFileError
 from nilearn._utils import CacheMixin
 from nilearn._utils import check_niimg
 from nilearn.input_data import NiftiMasker
 from sklearn.base import TransformerMixin
-from sklearn.externals.joblib import Memory
-from sklearn.externals.joblib import Parallel
-from sklearn.externals.joblib import delayed
+from sklearn.externals.joblib import Memory, hash as joblib_hash
 from sklearn.utils import check_random_state
 
 from ..input_data.fmri.base import BaseNilearnEstimator
-
-from .dict_fact import DictFact, Coder
+from ..input_data.fmri.cache import check_data_cache, mask_record
+from ..input_data.fmri.clean import needs_cleaning
+from ..input_data.fmri.stream import is_raw_record, draw_block_groups, \
+    load_blocks
+from ..input_data.fmri.manifest import scan_records
+from ..input_data.fmri.quantize import decoded_dtype, is_scaled
+from ..input_data.fmri.reduction import reduce_records
+from ..input_data.fmri.resolution import downsample_mask, pooling_matrix
+from ..input_data.fmri.store import RawRecord
+from ..input_data.fmri.unmask import MultiRawMasker
+from ..utils.prefetch import prefetch
+
+from .dict_fact import DictFact, Coder, _is_svd_init
+from .monitoring import AsyncScorer, score_data
+from .multi import MultiDictFact
+from ..utils.math.sketch import NystromSketch
 
 warnings.filterwarnings('ignore', module='scipy.ndimage.interpolation',
                         category=UserWarning,
@@ -48,7 +67,10 @@ class fMRICoderMixin(BaseNilearnEstimator, CacheMixin, TransformerMixin):
                  mask_strategy='background', mask_args=None,
                  memory=Memory(cachedir=None),
                  memory_level=2,
-                 n_jobs=1, verbose=0, ):
+                 n_jobs=1, verbose=0,
+                 data_cache=None,
+                 transform_l1_ratio=0,
+                 temporal_warm_start=False):
         BaseNilearnEstimator.__init__(self,
                                       mask=mask,
                                       smoothing_fwhm=smoothing_fwhm,
@@ -70,6 +92,9 @@ class fMRICoderMixin(BaseNilearnEstimator, CacheMixin, TransformerMixin):
         self.transform_batch_size = transform_batch_size
         self.dict_init = dict_init
         self.alpha = alpha
+        self.data_cache = data_cache
+        self.transform_l1_ratio = transform_l1_ratio
+        self.temporal_warm_start = temporal_warm_start
 
     def fit(self, imgs=None, y=None, confounds=None):
         if imgs is not None:
@@ -79,16 +104,22 @@ class fMRICoderMixin(BaseNilearnEstimator, CacheMixin, TransformerMixin):
         else:
             BaseNilearnEstimator.fit(self)
 
-        self.components_ = _check_dict_init(self.dict_init,
-                                            mask_img=self.mask_img_,
-                                            n_components=self.n_components)
+        self.components_ = _check_dict_init(
+            self.dict_init, mask_img=self.mask_img_,
+            n_components=self.n_components,
+            voxel_order=getattr(self.masker_, 'voxel_order_', None))
         if self.components_ is not None:
             self.components_img_ = self.masker_.inverse_transform(
                 self.components_)
-            self.coder_ = Coder(dictionary=self.components_,
-                                code_alpha=self.alpha,
-                                code_l1_ratio=0,
-                                n_threads=self.n_jobs).fit()
+            self.coder_ = self._make_coder()
+
+    def _make_coder(self):
+        """Coder projecting masked records onto components_"""
+        return Coder(dictionary=self.components_,
+                     code_alpha=self.alpha,
+                     code_l1_ratio=self.transform_l1_ratio,
+                     temporal_warm_start=self.temporal_warm_start,
+                     n_threads=_effective_n_jobs(self.n_jobs)).fit()
 
     def score(self, imgs, confounds=None):
         """
@@ -116,21 +147,22 @@ class fMRICoderMixin(BaseNilearnEstimator, CacheMixin, TransformerMixin):
             imgs = [imgs]
         if confounds is None:
             confounds = itertools.repeat(None)
-        scores = Parallel(n_jobs=self.n_jobs, verbose=self.verbose)(
-            delayed(self._cache(_score_img, func_memory_level=1))(
-                self.coder_, self.masker_, img, these_confounds)
-            for img, these_confounds in zip(imgs, confounds))
+        if _effective_n_jobs(self.n_jobs) > 1:
+            scores = self._get_coder_pool().score(imgs, confounds)
+        else:
+            data_cache = check_data_cache(self.data_cache)
+            scores = [self._cache(_score_img, func_memory_level=1,
+                                  ignore=['data_cache'])(
+                self.coder_, self.masker_, img, these_confounds,
+                data_cache=data_cache)
+                for img, these_confounds in zip(imgs, confounds)]
         scores = np.array(scores)
-        try:
-            len_imgs = np.array([check_niimg(img).get_shape()[3]
-                                 for img in imgs])
-        except ImageFileError:
-            len_imgs = np.array([np.load(img, mmap_mode='r').shape[0]
-                                 for img in imgs])
+        len_imgs, _ = _lazy_scan(imgs)
+        len_imgs = np.array(len_imgs)
         score = np.sum(scores * len_imgs) / np.sum(len_imgs)
         return score
 
-    def transform(self, imgs, confounds=None):
+    def transform(self, imgs, confounds=None, output=None):
         """Compute the mask and the ICA maps across subjects
 
         Parameters
@@ -145,20 +177,77 @@ class fMRICoderMixin(BaseNilearnEstimator, CacheMixin, TransformerMixin):
             This parameter is passed to nilearn.signal.clean. Please see the
             related documentation for details
 
+        output: str or None
+            Path of a .npy file in which to write the codes of all images,
+            concatenated. If n_jobs > 1, codes are always written in a
+            memory-mapped file, temporary if output is None.
+
         Returns
         -------
         codes, list of ndarray, shape = n_images * (n_samples, n_components)
-            Loadings for each of the images, and each of the time steps
+            Loadings for each of the images, and each of the time steps.
+            Views on the memory-mapped output if output is not None or
+            n_jobs > 1.
         """
         if (isinstance(imgs, str) or not hasattr(imgs, '__iter__')):
             imgs = [imgs]
         if confounds is None:
             confounds = itertools.repeat(None)
-        codes = Parallel(n_jobs=self.n_jobs, verbose=self.verbose)(
-            delayed(self._cache(_transform_img, func_memory_level=1))(
-                self.coder_, self.masker_, img, these_confounds)
-            for img, these_confounds in zip(imgs, confounds))
-        return codes
+        data_cache = check_data_cache(self.data_cache)
+        n_jobs = _effective_n_jobs(self.n_jobs)
+        if n_jobs == 1 and output is None:
+            return [self._cache(_transform_img, func_memory_level=1,
+                                ignore=['data_cache'])(
+                self.coder_, self.masker_, img, these_confounds,
+                data_cache=data_cache)
+                for img, these_confounds in zip(imgs, confounds)]
+
+        n_samples_list, _ = _lazy_scan(imgs)
+        offsets = np.zeros(len(imgs) + 1, dtype='int')
+        offsets[1:] = np.cumsum(n_samples_list)
+        temp_output = output is None
+        if temp_output:
+            fd, output = mkstemp(suffix='.npy',
+                                 dir=self._get_coder_pool().temp_dir)
+            os.close(fd)
+        codes = np.lib.format.open_memmap(
+            output, mode='w+', dtype=self.components_.dtype,
+            shape=(offsets[-1], self.components_.shape[0]))
+        if n_jobs > 1:
+            codes.flush()
+            self._get_coder_pool().transform(imgs, confounds, output,
+                                             offsets[:-1])
+        else:
+            for img, these_confounds, start, stop in zip(
+                    imgs, confounds, offsets[:-1], offsets[1:]):
+                codes[start:stop] = self._cache(
+                    _transform_img, func_memory_level=1,
+                    ignore=['data_cache'])(
+                    self.coder_, self.masker_, img, these_confounds,
+                    data_cache=data_cache)
+            codes.flush()
+        if temp_output:
+            # The file remains mapped in memory
+            os.unlink(output)
+        return [codes[start:stop] for start, stop in zip(offsets[:-1],
+                                                          offsets[1:])]
+
+    def _get_coder_pool(self):
+        """Persistent worker pool, restarted when the dictionary changes"""
+        pool = getattr(self, '_coder_pool', None)
+        if pool is None or pool.coder is not self.coder_:
+            if pool is not None:
+                pool.close()
+            self._coder_pool = _CoderPool(
+                self.masker_, self.coder_,
+                n_jobs=_effective_n_jobs(self.n_jobs),
+                data_cache=check_data_cache(self.data_cache))
+        return self._coder_pool
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_coder_pool', None)
+        return state
 
 
 class fMRIDictFact(fMRICoderMixin):
@@ -177,9 +266,11 @@ class fMRIDictFact(fMRICoderMixin):
         Penalty to apply. The larger, the sparser the pipelining will be in
         space
 
-    dict_init: Niimg-like or None
+    dict_init: Niimg-like, 'svd' or None
         Initial dictionary (e.g, from ICA). If None, a random initialization
-        will be used
+        will be used. 'svd' initializes it with the leading principal axes
+        of the data, estimated by a randomized sketch during a single pass
+        over records (see modl.utils.math.sketch), before learning.
 
     random_state: RandomState or int,
         Control randomness of the algorithm. Different value will lead to different,
@@ -257,6 +348,58 @@ class fMRIDictFact(fMRICoderMixin):
     verbose: integer, optional
         Indicate the level of verbosity. By default, nothing is printed
 
+    n_prefetch: int, optional, default=1
+        Number of records loaded and masked in background while learning
+        from the current one. 0 loads records synchronously.
+
+    prefetch_max_bytes: int or None, optional
+        Upper bound on the memory used by prefetched records
+
+    block_size: int or None, optional
+        If not None and records are raw (.npy files or records of a raw
+        store, see create_raw_rest_data), stream random time-blocks of
+        block_size frames read from memory-mapped records instead of whole
+        records, so that mini-batches mix frames from several subjects.
+
+    n_blocks: int, optional, default=8
+        Number of time-blocks loaded and shuffled together when block_size
+        is not None. Memory usage is bounded by (n_prefetch + 1) * n_blocks
+        blocks.
+
+    data_cache: str, MaskedDataCache or None, optional
+        Cache of masked records, shared by fit, transform and score. If a
+        directory is given, the cache has no byte budget: use a
+        MaskedDataCache (see modl.input_data.fmri.cache) to bound its size.
+
+    resolutions: list of int or None, optional
+        Coarse-to-fine schedule: decreasing downsampling factors of the
+        mask (e.g. [4, 2]). The dictionary is first learned on masked data
+        pooled over cells of factor ** 3 voxels, during
+        resolution_n_epochs epochs per factor, then upsampled to initialize
+        the next level. The last level is learned at native resolution
+        during n_epochs epochs. callback is only called at native
+        resolution.
+
+    resolution_n_epochs: int, optional, default=1
+        Number of epochs of each coarse level
+
+    temporal_reduction: int or None, optional
+        If not None, each record is replaced by the projection of its
+        frames on their temporal_reduction leading temporal singular
+        vectors before learning (see modl.input_data.fmri.reduction), so
+        that every record contributes temporal_reduction samples. Reduced
+        records are computed in n_jobs processes, and cached next to raw
+        records, or in the directory of data_cache for Nifti images.
+
+    transform_l1_ratio: float in [0, 1], optional, default=0
+        Ratio of l1 penalty of the codes computed by transform and score.
+        The dictionary is always learned with a ridge penalty on codes.
+
+    temporal_warm_start: boolean, optional, default=False
+        In transform and score, code the frames of each record in order,
+        starting from the code of the previous frame (see Coder). This
+        reduces the cost of coding with transform_l1_ratio > 0.
+
     """
 
     def __init__(self,
@@ -279,7 +422,17 @@ class fMRIDictFact(fMRICoderMixin):
                  mask_strategy='background', mask_args=None,
                  memory=Memory(cachedir=None), memory_level=0,
                  n_jobs=1, verbose=0,
-                 callback=None):
+                 callback=None,
+                 n_prefetch=1,
+                 prefetch_max_bytes=None,
+                 block_size=None,
+                 n_blocks=8,
+                 data_cache=None,
+                 resolutions=None,
+                 resolution_n_epochs=1,
+                 temporal_reduction=None,
+                 transform_l1_ratio=0,
+                 temporal_warm_start=False):
         fMRICoderMixin.__init__(self, n_components=n_components,
                                 alpha=alpha,
                                 dict_init=dict_init,
@@ -298,7 +451,10 @@ class fMRIDictFact(fMRICoderMixin):
                                 memory=memory,
                                 memory_level=memory_level,
                                 n_jobs=n_jobs,
-                                verbose=verbose)
+                                verbose=verbose,
+                                data_cache=data_cache,
+                                transform_l1_ratio=transform_l1_ratio,
+                                temporal_warm_start=temporal_warm_start)
         self.n_epochs = n_epochs
         self.batch_size = batch_size
         self.reduction = reduction
@@ -308,6 +464,13 @@ class fMRIDictFact(fMRICoderMixin):
         self.learning_rate = learning_rate
         self.random_state = random_state
         self.callback = callback
+        self.n_prefetch = n_prefetch
+        self.prefetch_max_bytes = prefetch_max_bytes
+        self.block_size = block_size
+        self.n_blocks = n_blocks
+        self.resolutions = resolutions
+        self.resolution_n_epochs = resolution_n_epochs
+        self.temporal_reduction = temporal_reduction
 
     def fit(self, imgs=None, y=None, confounds=None):
         """Compute the mask and the dictionary maps across subjects
@@ -327,6 +490,43 @@ class fMRIDictFact(fMRICoderMixin):
         -------
         self
         """
+        resolutions = [] if self.resolutions is None else list(
+            self.resolutions)
+        if (any(factor <= 1 for factor in resolutions) or
+                sorted(resolutions, reverse=True) != resolutions):
+            raise ValueError('resolutions should be decreasing downsampling '
+                             'factors larger than 1, got %r'
+                             % self.resolutions)
+        masker, imgs, confounds, params = self._prepare_fit(imgs, confounds)
+        compute_components = self._cached_compute_components()
+        if _is_svd_init(self.dict_init):
+            components = 'svd'
+        else:
+            components = self.components_
+        for factor in resolutions:
+            if self.verbose:
+                print('Downsampling factor %i' % factor)
+            _, labels = downsample_mask(self.mask_img_, factor)
+            voxel_order = getattr(self.masker_, 'voxel_order_', None)
+            if voxel_order is not None:
+                labels = labels[voxel_order]
+            pooling = pooling_matrix(labels)
+            components = compute_components(
+                masker, imgs, dict_init=components,
+                n_epochs=self.resolution_n_epochs, callback=None,
+                pooling=pooling, **params)
+            # Initialization of the next level
+            components = np.ascontiguousarray(
+                pooling.dot(components.T).T)
+        self._set_components(compute_components(
+            masker, imgs, dict_init=components,
+            n_epochs=self.n_epochs, callback=self.callback, **params))
+        return self
+
+    def _prepare_fit(self, imgs, confounds):
+        """Fit the masker and reduce records if asked, returning the
+        masker, records and confounds to learn from, and the parameters of
+        _compute_components"""
         # Base logic for pipelining estimators
         if imgs is None:
             raise ValueError('imgs is None, use fMRICoder instead')
@@ -334,32 +534,115 @@ class fMRIDictFact(fMRICoderMixin):
         # Fit mask + pipelining
         fMRICoderMixin.fit(self, imgs, confounds=confounds)
 
-        self.components_ = self._cache(_compute_components,
-                                       func_memory_level=1,
-                                       ignore=['n_jobs',
-                                               'verbose'])(
-            self.masker_, imgs,
-            step_size=self.step_size,
-            confounds=confounds,
-            dict_init=self.components_,
-            alpha=self.alpha,
-            reduction=self.reduction,
-            learning_rate=self.learning_rate,
-            n_components=self.n_components,
-            batch_size=self.batch_size,
-            positive=self.positive,
-            n_epochs=self.n_epochs,
-            method=self.method,
-            verbose=self.verbose,
-            random_state=self.random_state,
-            callback=self.callback,
-            n_jobs=self.n_jobs)
+        data_cache = check_data_cache(self.data_cache)
+        masker = self.masker_
+        if self.temporal_reduction is not None:
+            if self.verbose:
+                print('Reducing records')
+            imgs = reduce_records(self.masker_, imgs, confounds=confounds,
+                                  n_components=self.temporal_reduction,
+                                  n_jobs=self.n_jobs, data_cache=data_cache)
+            # Reduced records are masked and cleaned: they are only loaded,
+            # while callbacks still mask test records with self.masker_
+            masker = MultiRawMasker(mask_img=self.mask_img_).fit()
+            confounds = None
+        params = dict(step_size=self.step_size,
+                      confounds=confounds,
+                      alpha=self.alpha,
+                      reduction=self.reduction,
+                      learning_rate=self.learning_rate,
+                      n_components=self.n_components,
+                      batch_size=self.batch_size,
+                      positive=self.positive,
+                      method=self.method,
+                      verbose=self.verbose,
+                      random_state=self.random_state,
+                      n_jobs=_effective_n_jobs(self.n_jobs),
+                      n_prefetch=self.n_prefetch,
+                      prefetch_max_bytes=self.prefetch_max_bytes,
+                      block_size=self.block_size,
+                      n_blocks=self.n_blocks,
+                      data_cache=data_cache,
+                      callback_masker=self.masker_)
+        return masker, imgs, confounds, params
+
+    def _cached_compute_components(self):
+        return self._cache(_compute_components,
+                           func_memory_level=1,
+                           ignore=['n_jobs',
+                                   'verbose',
+                                   'n_prefetch',
+                                   'prefetch_max_bytes',
+                                   'data_cache',
+                                   'callback_masker'])
+
+    def _set_components(self, components):
+        self.components_ = components
         self.components_img_ = self.masker_.inverse_transform(self.components_)
-        self.coder_ = Coder(dictionary=self.components_,
-                            code_alpha=self.alpha,
-                            code_l1_ratio=0,
-                            n_threads=self.n_jobs).fit()
-        return self
+        self.coder_ = self._make_coder()
+
+
+# Parameters of fMRIDictFact that may differ in fit_multiple
+SWEEP_PARAMS = ['step_size', 'alpha', 'positive', 'reduction',
+                'learning_rate', 'method', 'callback']
+
+
+def fit_multiple(estimators, imgs, confounds=None):
+    """
+    Fit several fMRIDictFact in a single pass over records.
+
+    Records are loaded, masked and cleaned once, and each mini-batch is fed
+    to the dictionaries of all estimators, updated in n_jobs threads (see
+    modl.decomposition.multi.MultiDictFact). Hyper-parameter sweeps are
+    then bound by computation instead of I/O.
+
+    Parameters
+    ----------
+    estimators: list of fMRIDictFact
+        Estimators that only differ in SWEEP_PARAMS. Coarse-to-fine
+        learning (resolutions) is not supported.
+
+    imgs: list of Niimg-like objects or raw records
+
+    confounds: list of confounds or None
+
+    Returns
+    -------
+    estimators: list of fMRIDictFact
+        Fitted estimators, sharing their masker
+    """
+    if len(estimators) == 0:
+        raise ValueError('fit_multiple needs at least one estimator')
+    estimator = estimators[0]
+    params = estimator.get_params(deep=False)
+    for other in estimators[1:]:
+        other_params = other.get_params(deep=False)
+        for name, value in params.items():
+            if (name not in SWEEP_PARAMS and
+                    joblib_hash(value) != joblib_hash(other_params[name])):
+                raise ValueError('Estimators of fit_multiple should only '
+                                 'differ in %s, got different %s'
+                                 % (SWEEP_PARAMS, name))
+    if estimator.resolutions:
+        raise ValueError('fit_multiple does not support resolutions')
+    masker, imgs, confounds, params = estimator._prepare_fit(imgs,
+                                                             confounds)
+    if _is_svd_init(estimator.dict_init):
+        dict_init = 'svd'
+    else:
+        dict_init = estimator.components_
+    sweep = [{name: getattr(this_estimator, name)
+              for name in SWEEP_PARAMS}
+             for this_estimator in estimators]
+    compute_components = estimator._cached_compute_components()
+    components_list = compute_components(masker, imgs, dict_init=dict_init,
+                                         n_epochs=estimator.n_epochs,
+                                         sweep=sweep, **params)
+    for this_estimator, components in zip(estimators, components_list):
+        this_estimator.masker_ = estimator.masker_
+        this_estimator.mask_img_ = estimator.mask_img_
+        this_estimator._set_components(components)
+    return estimators
 
 
 class fMRICoder(fMRICoderMixin):
@@ -373,7 +656,10 @@ class fMRICoder(fMRICoderMixin):
                  mask_strategy='background', mask_args=None,
                  memory=Memory(cachedir=None),
                  memory_level=2,
-                 n_jobs=1, verbose=0, ):
+                 n_jobs=1, verbose=0,
+                 data_cache=None,
+                 transform_l1_ratio=0,
+                 temporal_warm_start=False):
         self.dictionary = dictionary
         fMRICoderMixin.__init__(self,
                                 n_components=None,
@@ -394,11 +680,17 @@ class fMRICoder(fMRICoderMixin):
                                 memory=memory,
                                 memory_level=memory_level,
                                 n_jobs=n_jobs,
-                                verbose=verbose)
+                                verbose=verbose,
+                                data_cache=data_cache,
+                                transform_l1_ratio=transform_l1_ratio,
+                                temporal_warm_start=temporal_warm_start)
 
 
-def _check_dict_init(dict_init, mask_img, n_components=None):
-    if dict_init is not None:
+def _check_dict_init(dict_init, mask_img, n_components=None,
+                     voxel_order=None):
+    """Masked initial maps, with voxels ordered by voxel_order if given
+    (see MultiRawMasker). Arrays are returned as is."""
+    if dict_init is not None and not _is_svd_init(dict_init):
         if isinstance(dict_init, np.ndarray):
             assert (dict_init.shape[1] == mask_img.get_data().sum())
             components = dict_init
@@ -406,6 +698,8 @@ def _check_dict_init(dict_init, mask_img, n_components=None):
             masker = NiftiMasker(smoothing_fwhm=0,
                                  mask_img=mask_img).fit()
             components = masker.transform(dict_init)
+            if voxel_order is not None:
+                components = components[:, voxel_order]
         if n_components is not None:
             return components[:n_components]
         else:
@@ -430,31 +724,56 @@ def _compute_components(masker,
                         verbose=0,
                         random_state=None,
                         callback=None,
-                        n_jobs=1):
-    methods = {'masked': {'G_agg': 'masked', 'Dx_agg': 'masked'},
-               'dictionary only': {'G_agg': 'full', 'Dx_agg': 'full'},
-               'gram': {'G_agg': 'masked', 'Dx_agg': 'masked'},
-               # 1st epoch parameters
-               'average': {'G_agg': 'average', 'Dx_agg': 'average'},
-               'reducing ratio': {'G_agg': 'masked', 'Dx_agg': 'masked'}}
+                        n_jobs=1,
+                        n_prefetch=1,
+                        prefetch_max_bytes=None,
+                        block_size=None,
+                        n_blocks=8,
+                        data_cache=None,
+                        pooling=None,
+                        sweep=None,
+                        callback_masker=None):
+    """
+    Learn a dictionary from records, streamed by records or time-blocks.
 
+    Parameters
+    ----------
+    sweep: list of dict or None
+        If not None, learn one dictionary per element of sweep, whose items
+        override step_size, alpha, positive, reduction, learning_rate,
+        method and callback, in a single pass over records (see
+        modl.decomposition.multi.MultiDictFact). A list of dictionaries is
+        then returned.
+
+    pooling: sparse matrix, shape (n_voxels, n_features) or None
+        If not None, masked data X is replaced by X.dot(pooling) (e.g. sums
+        over cells of a coarse grid, see modl.input_data.fmri.resolution)
+        and the dictionary is learned on these n_features features.
+        dict_init is then given on masked voxels and is pooled likewise.
+
+    callback_masker: masker or None
+        Passed to callbacks in place of masker, e.g. the masker of the
+        estimator when masker loads records it has reduced beforehand
+    """
     masker._check_fitted()
+    if callback_masker is None:
+        callback_masker = masker
+    svd_init = _is_svd_init(dict_init)
     dict_init = _check_dict_init(dict_init, mask_img=masker.mask_img_,
-                                 n_components=n_components)
+                                 n_components=n_components,
+                                 voxel_order=getattr(masker, 'voxel_order_',
+                                                     None))
     # dict_init might have fewer components than asked for
     if dict_init is not None:
         n_components = dict_init.shape[0]
+        if pooling is not None:
+            dict_init = np.ascontiguousarray(pooling.T.dot(dict_init.T).T)
     random_state = check_random_state(random_state)
-    if method == 'sgd':
-        optimizer = 'sgd'
-        G_agg = 'full'
-        Dx_agg = 'full'
-        reduction = 1
-    else:
-        method = methods[method]
-        G_agg = method['G_agg']
-        Dx_agg = method['Dx_agg']
-        optimizer = 'variational'
+    defaults = dict(step_size=step_size, alpha=alpha, positive=positive,
+                    reduction=reduction, learning_rate=learning_rate,
+                    method=method, callback=callback)
+    configs = [defaults] if sweep is None else [dict(defaults, **config)
+                                                for config in sweep]
 
     if verbose:
         print("Scanning data")
@@ -467,74 +786,189 @@ def _compute_components(masker,
     indices_list[1:] = np.cumsum(n_samples_list)
     n_samples = indices_list[-1] + 1
     n_voxels = np.sum(check_niimg(masker.mask_img_).get_data() != 0)
+    n_features = n_voxels
+    if pooling is not None:
+        pooling = pooling.astype(dtype if np.dtype(dtype).kind == 'f'
+                                 else np.float64)
+        n_features = pooling.shape[1]
+
+    stream_blocks = block_size is not None
+    if stream_blocks and not (isinstance(masker, MultiRawMasker) and
+                              all(is_raw_record(img) for img in imgs)):
+        warnings.warn('Streaming time-blocks requires raw records '
+                      '(.npy files or arrays) and a MultiRawMasker: '
+                      'streaming whole records instead.')
+        stream_blocks = False
+    if stream_blocks and any(needs_cleaning(masker, these_confounds)
+                             for _, these_confounds in data_list):
+        warnings.warn('Temporal preprocessing of raw records requires '
+                      'whole records: streaming whole records instead.')
+        stream_blocks = False
+    if not stream_blocks:
+        # Whole records are loaded one at a time
+        block_size = max(n_samples_list, default=1)
+        n_blocks = 1
+    itemsize = np.dtype(dtype).itemsize
+
+    def load(group):
+        _, blocks, seed = group
+        if stream_blocks:
+            masked_data, sample_indices = load_blocks(
+                imgs, blocks, indices_list, random_state=seed)
+        else:
+            record = blocks[0, 0]
+            img, these_confounds = data_list[record]
+            masked_data = mask_record(masker, img, these_confounds,
+                                      data_cache=data_cache)
+            # Single shuffling copy of the record
+            masked_data, sample_indices = load_blocks(
+                {record: masked_data}, blocks, indices_list,
+                random_state=seed)
+        if pooling is not None:
+            masked_data = np.ascontiguousarray(
+                pooling.T.dot(masked_data.T).T)
+        return masked_data, sample_indices
+
+    def nbytes(group):
+        _, blocks, _ = group
+        return np.sum(blocks[:, 2] - blocks[:, 1]) * n_voxels * itemsize
+
+    if svd_init and n_records > 0:
+        if verbose:
+            print("Sketching data")
+        # Single pass over records, in any order
+        sketch = NystromSketch(n_features, n_components,
+                               random_state=random_state)
+        sketch_groups = draw_block_groups(n_samples_list, block_size,
+                                          n_blocks, n_epochs=1,
+                                          random_state=random_state)
+        for _, (masked_data, _) in prefetch(load, sketch_groups,
+                                            n_prefetch=n_prefetch,
+                                            max_bytes=prefetch_max_bytes,
+                                            nbytes=nbytes):
+            sketch.partial_fit(masked_data)
+        dict_init, _ = sketch.components()
 
     if verbose:
         print("Learning...")
-    dict_fact = DictFact(n_components=n_components,
-                         code_alpha=alpha,
-                         code_l1_ratio=0,
-                         comp_l1_ratio=1,
-                         comp_pos=positive,
-                         reduction=reduction,
-                         Dx_agg=Dx_agg,
-                         optimizer=optimizer,
-                         step_size=step_size,
-                         G_agg=G_agg,
-                         learning_rate=learning_rate,
-                         batch_size=batch_size,
-                         random_state=random_state,
-                         n_threads=n_jobs,
-                         verbose=0)
-    dict_fact.prepare(n_samples=n_samples, n_features=n_voxels,
+    if sweep is None:
+        dict_fact = _make_dict_fact(configs[0], n_components, batch_size,
+                                    random_state, n_jobs)
+        dict_facts = [dict_fact]
+    else:
+        # Every configuration draws from a copy of the random state of a
+        # single fit: same initialization and feature subsets for all
+        dict_facts = [_make_dict_fact(config, n_components, batch_size,
+                                      deepcopy(random_state), 1)
+                      for config in configs]
+        dict_fact = MultiDictFact(dict_facts, n_threads=n_jobs)
+    dict_fact.prepare(n_samples=n_samples, n_features=n_features,
                       X=dict_init, dtype=dtype)
+    if sweep is not None:
+        # Record orders are drawn after initialization, as in a single fit
+        random_state = dict_facts[0].random_state
     cpu_time = 0
     io_time = 0
     if n_records > 0:
+        # Draw every record order beforehand so that results do not depend
+        # on prefetching
+        groups = draw_block_groups(n_samples_list, block_size, n_blocks,
+                                   n_epochs=n_epochs,
+                                   random_state=random_state)
+        # Other configurations continue from the same state
+        for this_dict_fact in dict_facts[1:]:
+            this_dict_fact.random_state = deepcopy(random_state)
         if verbose:
-            log_lim = log(n_records * n_epochs, 10)
+            log_lim = log(len(groups), 10)
             verbose_iter_ = np.logspace(0, log_lim, verbose,
                                         base=10) - 1
             verbose_iter_ = verbose_iter_.tolist()
         current_n_records = 0
-        for i in range(n_epochs):
-            if verbose:
-                print('Epoch %i' % (i + 1))
-            if method == 'gram' and i == 5:
-                dict_fact.set_params(G_agg='full',
-                                     Dx_agg='average')
-            if method == 'reducing ratio':
-                reduction = 1 + (reduction - 1) / sqrt(i + 1)
-                dict_fact.set_params(reduction=reduction)
-            record_list = random_state.permutation(n_records)
-            for record in record_list:
-                if (verbose and verbose_iter_ and
-                            current_n_records >= verbose_iter_[0]):
-                    print('Record %i' % current_n_records)
-                    if callback is not None:
-                        callback(masker, dict_fact, cpu_time, io_time)
-                    verbose_iter_ = verbose_iter_[1:]
-
-                # IO bounded
-                t0 = time.perf_counter()
-                img, these_confounds = data_list[record]
-                masked_data = masker.transform(img, confounds=these_confounds)
-                io_time += time.perf_counter() - t0
-
-                # CPU bounded
-                t0 = time.perf_counter()
-                permutation = random_state.permutation(
-                    masked_data.shape[0])
-                masked_data = masked_data[permutation]
-                sample_indices = np.arange(
-                    indices_list[record], indices_list[record + 1])
-                sample_indices = sample_indices[permutation]
-                masked_data = masked_data[permutation]
-                dict_fact.partial_fit(masked_data,
-                                      sample_indices=sample_indices)
-                current_n_records += 1
-                cpu_time += time.perf_counter() - t0
-    components = _flip(dict_fact.components_)
-    return components
+        # Records are loaded in background threads while learning
+        records = prefetch(load, groups, n_prefetch=n_prefetch,
+                           max_bytes=prefetch_max_bytes, nbytes=nbytes)
+        current_epoch = -1
+        while True:
+            # IO bounded: time spent waiting for data
+            t0 = time.perf_counter()
+            try:
+                (i, _, _), (masked_data, sample_indices) = next(records)
+            except StopIteration:
+                break
+            io_time += time.perf_counter() - t0
+
+            if i != current_epoch:
+                current_epoch = i
+                if verbose:
+                    print('Epoch %i' % (i + 1))
+            if (verbose and verbose_iter_ and
+                        current_n_records >= verbose_iter_[0]):
+                print('Record %i' % current_n_records)
+                for this_dict_fact, config in zip(dict_facts, configs):
+                    if config['callback'] is not None:
+                        config['callback'](callback_masker, this_dict_fact,
+                                           cpu_time, io_time)
+                verbose_iter_ = verbose_iter_[1:]
+
+            # CPU bounded
+            t0 = time.perf_counter()
+            dict_fact.partial_fit(masked_data,
+                                  sample_indices=sample_indices)
+            current_n_records += 1
+            cpu_time += time.perf_counter() - t0
+    if sweep is None:
+        return _flip(dict_fact.components_)
+    dict_fact.close()
+    return [_flip(this_dict_fact.components_)
+            for this_dict_fact in dict_facts]
+
+
+def _make_dict_fact(config, n_components, batch_size, random_state,
+                    n_threads):
+    """DictFact learning a dictionary of sparse maps, with the learning
+    parameters of config"""
+    methods = {'masked': {'G_agg': 'masked', 'Dx_agg': 'masked'},
+               'dictionary only': {'G_agg': 'full', 'Dx_agg': 'full'},
+               'gram': {'G_agg': 'masked', 'Dx_agg': 'masked'},
+               # 1st epoch parameters
+               'average': {'G_agg': 'average', 'Dx_agg': 'average'},
+               'reducing ratio': {'G_agg': 'masked', 'Dx_agg': 'masked'}}
+    reduction = config['reduction']
+    if config['method'] == 'sgd':
+        optimizer = 'sgd'
+        G_agg = 'full'
+        Dx_agg = 'full'
+        reduction = 1
+    else:
+        method = methods[config['method']]
+        G_agg = method['G_agg']
+        Dx_agg = method['Dx_agg']
+        optimizer = 'variational'
+    return DictFact(n_components=n_components,
+                    code_alpha=config['alpha'],
+                    code_l1_ratio=0,
+                    comp_l1_ratio=1,
+                    comp_pos=config['positive'],
+                    reduction=reduction,
+                    Dx_agg=Dx_agg,
+                    optimizer=optimizer,
+                    step_size=config['step_size'],
+                    G_agg=G_agg,
+                    learning_rate=config['learning_rate'],
+                    batch_size=batch_size,
+                    random_state=random_state,
+                    n_threads=n_threads,
+                    verbose=0)
+
+
+def _effective_n_jobs(n_jobs):
+    """Number of workers for n_jobs, negative values counting down from
+    the number of CPUs as in joblib (-1 uses them all)"""
+    if n_jobs == 0:
+        raise ValueError('n_jobs == 0 has no meaning')
+    if n_jobs < 0:
+        n_jobs = max(multiprocessing.cpu_count() + 1 + n_jobs, 1)
+    return n_jobs
 
 
 def _flip(components):
@@ -549,38 +983,166 @@ def _flip(components):
 
 def _lazy_scan(imgs):
     """Extracts number of samples and dtype
-    from a 4D list of Niilike-image, without loading data"""
+    from a 4D list of Niilike-image, without loading data.
+
+    Record files are looked up in the manifest registry (see
+    modl.input_data.fmri.manifest), and only opened if unknown or modified.
+    """
     n_samples_list = []
     for img in imgs:
-        try:
+        if isinstance(img, str):
+            entry, = scan_records([img])
+            this_n_samples = entry['n_frames']
+            dtype = decoded_dtype(entry['dtype'], scaled=is_scaled(img))
+        elif isinstance(img, np.ndarray):
+            this_n_samples = img.shape[0]
+            dtype = img.dtype
+        elif isinstance(img, RawRecord):
+            this_n_samples = img.n_frames
+            dtype = img.dtype
+        else:
             img = check_niimg(img)
             this_n_samples = img.shape[3]
             dtype = img.get_data_dtype()
-        except ImageFileError:
-            img = np.load(img, mmap_mode='r')
-            this_n_samples = img.shape[0]
-            dtype = img.dtype
         n_samples_list.append(this_n_samples)
     return n_samples_list, dtype
 
 
-def _transform_img(coder, masker, img, confounds):
-    data = masker.transform(img,
-                            confounds=confounds)
+def _transform_img(coder, masker, img, confounds, data_cache=None):
+    data = mask_record(masker, img, confounds, data_cache=data_cache)
     return coder.transform(data)
 
 
-def _score_img(coder, masker, img, confounds):
-    data = masker.transform(img, confounds=confounds)
+def _score_img(coder, masker, img, confounds, data_cache=None):
+    data = mask_record(masker, img, confounds, data_cache=data_cache)
     return coder.score(data)
 
 
+# State of the workers of _CoderPool, set once by _init_coder_worker
+_worker_state = {}
+
+
+def _init_coder_worker(masker, dictionary_file, coder_params,
+                       data_cache=None):
+    dictionary = np.load(dictionary_file, mmap_mode='r')
+    _worker_state['masker'] = masker
+    _worker_state['data_cache'] = data_cache
+    _worker_state['coder'] = Coder(dictionary=dictionary,
+                                   **coder_params).fit()
+
+
+def _transform_worker(img, confounds, output_file, offset):
+    code = _transform_img(_worker_state['coder'], _worker_state['masker'],
+                          img, confounds,
+                          data_cache=_worker_state['data_cache'])
+    codes = np.load(output_file, mmap_mode='r+')
+    codes[offset:offset + code.shape[0]] = code
+    codes.flush()
+    return code.shape[0]
+
+
+def _score_worker(img, confounds):
+    return _score_img(_worker_state['coder'], _worker_state['masker'],
+                      img, confounds, data_cache=_worker_state['data_cache'])
+
+
+# Pools still open, closed at exit. Unreferenced pools are closed when
+# garbage collected.
+_coder_pools = weakref.WeakSet()
+
+
+@atexit.register
+def _close_coder_pools():
+    for pool in list(_coder_pools):
+        pool.close()
+
+
+class _CoderPool(object):
+    """Persistent pool of processes projecting records onto a fixed
+    dictionary.
+
+    The dictionary is written once to a temporary .npy file, that workers
+    map in memory (so that it is shared among them), and the masker is sent
+    once to each worker at startup. Only image paths and confounds are then
+    sent to workers, that write codes directly into a memory-mapped
+    output.
+    """
+
+    def __init__(self, masker, coder, n_jobs=1, data_cache=None):
+        self.coder = coder
+        self.temp_dir = mkdtemp()
+        dictionary_file = os.path.join(self.temp_dir, 'dictionary.npy')
+        np.save(dictionary_file, coder.components_)
+        coder_params = dict(code_alpha=coder.code_alpha,
+                            code_l1_ratio=coder.code_l1_ratio,
+                            tol=coder.tol,
+                            max_iter=coder.max_iter,
+                            code_pos=coder.code_pos,
+                            sparse_dictionary=coder.sparse_dictionary,
+                            temporal_warm_start=coder.temporal_warm_start)
+        self.pool = multiprocessing.Pool(n_jobs,
+                                         initializer=_init_coder_worker,
+                                         initargs=(masker, dictionary_file,
+                                                   coder_params, data_cache))
+        _coder_pools.add(self)
+
+    def __del__(self):
+        self.close()
+
+    def transform(self, imgs, confounds, output_file, offsets):
+        """Write the codes of imgs[i] in output_file[offsets[i]:]"""
+        self.pool.starmap(_transform_worker,
+                          zip(imgs, confounds, itertools.repeat(output_file),
+                              offsets))
+
+    def score(self, imgs, confounds):
+        return self.pool.starmap(_score_worker, zip(imgs, confounds))
+
+    def close(self):
+        if getattr(self, 'pool', None) is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+def _load_test_data(masker, imgs, confounds, data_cache=None):
+    if data_cache is None:
+        return masker.transform(imgs, confounds=confounds)
+    return [mask_record(masker, img, these_confounds, data_cache=data_cache)
+            for img, these_confounds in zip(imgs, confounds)]
+
+
 class rfMRIDictionaryScorer:
-    """Base callback to compute test score"""
+    """Base callback to compute test score
+
+    Parameters
+    ----------
+    test_imgs: list of Niimg-like objects or raw records
+
+    test_confounds: list of confounds or None
+
+    info: dict or None
+        Updated with scores, times and iterations
+
+    data_cache: MaskedDataCache, str or None
+        Cache of masked test records
+
+    asynchronous: boolean
+        Mask test records and score snapshots of the dictionary in the
+        background (see modl.decomposition.monitoring.AsyncScorer), so
+        that training is not stalled. Scores of the last snapshots are
+        recorded by flush.
+
+    backend: 'thread' or 'process'
+        Backend of asynchronous scoring
+    """
 
     def __init__(self, test_imgs, test_confounds=None,
-                 info=None):
+                 info=None, data_cache=None, asynchronous=False,
+                 backend='thread'):
         self.start_time = time.perf_counter()
+        self.start_timestamp = time.time()
         self.test_imgs = test_imgs
         if test_confounds is None:
             test_confounds = itertools.repeat(None)
@@ -592,15 +1154,34 @@ class rfMRIDictionaryScorer:
         self.cpu_time = []
         self.io_time = []
         self.info = info
+        self.data_cache = check_data_cache(data_cache)
+        self.asynchronous = asynchronous
+        self.backend = backend
+        self.scorer_ = None
+        # io_time of the snapshots submitted to scorer_
+        self._io_time = []
 
     def __call__(self, masker, dict_fact, cpu_time, io_time):
+        if self.asynchronous:
+            if self.scorer_ is None:
+                confounds = list(itertools.islice(self.test_confounds,
+                                                  len(self.test_imgs)))
+                self.scorer_ = AsyncScorer(
+                    functools.partial(_load_test_data, masker,
+                                      self.test_imgs, confounds,
+                                      data_cache=self.data_cache),
+                    backend=self.backend)
+            if self.scorer_.submit(dict_fact, dict_fact.n_iter_,
+                                   cpu_time=cpu_time):
+                self._io_time.append(io_time)
+            self._record()
+            return
         test_time = time.perf_counter()
         if not hasattr(self, 'data'):
-            self.data = masker.transform(self.test_imgs,
-                                         confounds=self.test_confounds)
-        scores = np.array([dict_fact.score(data) for data in self.data])
-        len_imgs = np.array([data.shape[0] for data in self.data])
-        score = np.sum(scores * len_imgs) / np.sum(len_imgs)
+            self.data = _load_test_data(masker, self.test_imgs,
+                                        self.test_confounds,
+                                        data_cache=self.data_cache)
+        score = score_data(dict_fact, self.data)
         self.test_time += time.perf_counter() - test_time
         this_time = time.perf_counter() - self.start_time - self.test_time
         self.score.append(score)
@@ -608,6 +1189,25 @@ class rfMRIDictionaryScorer:
         self.cpu_time.append(cpu_time)
         self.io_time.append(io_time)
         self.iter.append(dict_fact.n_iter_)
+        self._update_info()
+
+    def flush(self):
+        """Wait for the scores of pending snapshots and record them"""
+        if self.scorer_ is not None:
+            self.scorer_.close()
+            self._record()
+
+    def _record(self):
+        scorer = self.scorer_
+        for i in range(len(self.score), len(scorer.score)):
+            self.score.append(scorer.score[i])
+            self.time.append(scorer.timestamp[i] - self.start_timestamp)
+            self.cpu_time.append(scorer.cpu_time[i])
+            self.io_time.append(self._io_time[i])
+            self.iter.append(scorer.iter[i])
+        self._update_info()
+
+    def _update_info(self):
         if self.info is not None:
             self.info['time'] = self.cpu_time
             self.info['score'] = self.score
@@ -2,12 +2,16 @@ from math import sqrt
 
 import time
 
+import numpy as np
+
 from modl.feature_extraction.image import LazyCleanPatchExtractor
 from modl.input_data.image import scale_patches
 from sklearn.base import BaseEstimator
 from sklearn.utils import check_random_state, gen_batches
 
 from .dict_fact import DictFact
+from .multi import MultiDictFact
+from .monitoring import AsyncScorer
 
 
 class ImageDictFact(BaseEstimator):
@@ -66,6 +70,47 @@ class ImageDictFact(BaseEstimator):
         self.max_patches = max_patches
 
     def fit(self, image, y=None):
+        self._init_dict_fact()
+        with_std = ImageDictFact.settings[self.setting]['with_std']
+        with_mean = ImageDictFact.settings[self.setting]['with_mean']
+        buffer_size = self._buffer_size()
+
+        if self.verbose:
+            print('Preparing patch extraction')
+        patch_extractor = LazyCleanPatchExtractor(
+            patch_size=self.patch_size, max_patches=self.max_patches,
+            random_state=self.random_state)
+        patch_extractor.fit(image)
+
+        n_patches = patch_extractor.n_patches_
+        self.patch_shape_ = patch_extractor.patch_shape_
+
+        if self.verbose:
+            print('Fitting dictionary')
+        init_patches = patch_extractor.partial_transform(batch=
+                                                         self.n_components)
+        init_patches = _flatten_patches(init_patches, with_std=with_std,
+                                        with_mean=with_mean, copy=False)
+        self.dict_fact_.prepare(n_samples=n_patches, X=init_patches)
+        for i in range(self.n_epochs):
+            if self.verbose:
+                print('Epoch %i' % (i + 1))
+            if i >= 1:
+                if self.verbose:
+                    print('Shuffling dataset')
+                permutation = self.dict_fact_.shuffle()
+                patch_extractor.shuffle(permutation)
+            buffers = gen_batches(n_patches, buffer_size)
+            self._start_epoch(i)
+            for j, buffer in enumerate(buffers):
+                buffer_size = buffer.stop - buffer.start
+                patches = patch_extractor.partial_transform(batch=buffer)
+                patches = _flatten_patches(patches, with_mean=with_mean,
+                                           with_std=with_std, copy=False)
+                self.dict_fact_.partial_fit(patches, buffer)
+        return self
+
+    def _init_dict_fact(self):
         self.random_state = check_random_state(self.random_state)
 
         if self.method != 'sgd':
@@ -85,13 +130,6 @@ class ImageDictFact(BaseEstimator):
         code_l1_ratio = setting['code_l1_ratio']
         comp_pos = setting['comp_pos']
         code_pos = setting['code_pos']
-        with_std = setting['with_std']
-        with_mean = setting['with_mean']
-
-        if self.buffer_size is None:
-            buffer_size = self.batch_size * 10
-        else:
-            buffer_size = self.buffer_size
 
         self.dict_fact_ = DictFact(n_epochs=self.n_epochs,
                                    random_state=self.random_state,
@@ -113,60 +151,31 @@ class ImageDictFact(BaseEstimator):
                                    verbose=self.verbose,
                                    n_threads=self.n_threads)
 
-        if self.verbose:
-            print('Preparing patch extraction')
-        patch_extractor = LazyCleanPatchExtractor(
-            patch_size=self.patch_size, max_patches=self.max_patches,
-            random_state=self.random_state)
-        patch_extractor.fit(image)
-
-        n_patches = patch_extractor.n_patches_
-        self.patch_shape_ = patch_extractor.patch_shape_
+    def _buffer_size(self):
+        if self.buffer_size is None:
+            return self.batch_size * 10
+        return self.buffer_size
 
-        if self.verbose:
-            print('Fitting dictionary')
-        init_patches = patch_extractor.partial_transform(batch=
-                                                         self.n_components)
-        init_patches = _flatten_patches(init_patches, with_std=with_std,
-                                        with_mean=with_mean, copy=False)
-        self.dict_fact_.prepare(n_samples=n_patches, X=init_patches)
-        for i in range(self.n_epochs):
-            if self.verbose:
-                print('Epoch %i' % (i + 1))
-            if i >= 1:
-                if self.verbose:
-                    print('Shuffling dataset')
-                permutation = self.dict_fact_.shuffle()
-                patch_extractor.shuffle(permutation)
-            buffers = gen_batches(n_patches, buffer_size)
-            if self.method == 'gram' and i == 4:
-                self.dict_fact_.set_params(G_agg='full', Dx_agg='average')
-            if self.method == 'reducing ratio':
-                reduction = 1 + (self.reduction - 1) / sqrt(i + 1)
-                self.dict_fact_.set_params(reduction=reduction)
-            for j, buffer in enumerate(buffers):
-                buffer_size = buffer.stop - buffer.start
-                patches = patch_extractor.partial_transform(batch=buffer)
-                patches = _flatten_patches(patches, with_mean=with_mean,
-                                           with_std=with_std, copy=False)
-                self.dict_fact_.partial_fit(patches, buffer)
-        return self
+    def _start_epoch(self, i):
+        """Epoch-wise schedule of methods"""
+        if self.method == 'gram' and i == 4:
+            self.dict_fact_.set_params(G_agg='full', Dx_agg='average')
+        if self.method == 'reducing ratio':
+            reduction = 1 + (self.reduction - 1) / sqrt(i + 1)
+            self.dict_fact_.set_params(reduction=reduction)
 
     def transform(self, patches):
-        with_std = ImageDictFact.settings[self.setting]['with_std']
-        with_mean = ImageDictFact.settings[self.setting]['with_mean']
-
-        patches = _flatten_patches(patches, with_mean=with_mean,
-                                   with_std=with_std, copy=True)
-        return self.dict_fact_.transform(patches)
+        return self.dict_fact_.transform(self._flatten(patches))
 
     def score(self, patches):
+        return self.dict_fact_.score(self._flatten(patches))
+
+    def _flatten(self, patches):
         with_std = ImageDictFact.settings[self.setting]['with_std']
         with_mean = ImageDictFact.settings[self.setting]['with_mean']
 
-        patches = _flatten_patches(patches, with_mean=with_mean,
-                                   with_std=with_std, copy=True)
-        return self.dict_fact_.score(patches)
+        return _flatten_patches(patches, with_mean=with_mean,
+                                with_std=with_std, copy=True)
 
     @property
     def n_iter_(self):
@@ -190,6 +199,89 @@ class ImageDictFact(BaseEstimator):
             self.callback(self)
 
 
+# Parameters of ImageDictFact that may differ in fit_multiple
+SWEEP_PARAMS = ['method', 'step_size', 'alpha', 'learning_rate',
+                'reduction', 'callback']
+
+
+def fit_multiple(estimators, image, n_threads=1):
+    """
+    Fit several ImageDictFact in a single pass over the patches of image.
+
+    Patches are extracted and normalized once, and each mini-batch is fed
+    to the dictionaries of all estimators, updated in n_threads threads (see
+    modl.decomposition.multi.MultiDictFact). Patches are visited in the
+    same order by all estimators.
+
+    Parameters
+    ----------
+    estimators: list of ImageDictFact
+        Estimators that only differ in SWEEP_PARAMS
+
+    image: ndarray, shape (height, width, n_channels)
+
+    n_threads: int
+        Number of estimators updated in parallel
+
+    Returns
+    -------
+    estimators: list of ImageDictFact
+        Fitted estimators
+    """
+    if len(estimators) == 0:
+        raise ValueError('fit_multiple needs at least one estimator')
+    estimator = estimators[0]
+    params = estimator.get_params()
+    for other in estimators[1:]:
+        other_params = other.get_params()
+        for name, value in params.items():
+            if name not in SWEEP_PARAMS and value != other_params[name]:
+                raise ValueError('Estimators of fit_multiple should only '
+                                 'differ in %s, got different %s'
+                                 % (SWEEP_PARAMS, name))
+    # Estimators seeded alike learn from the same initialization and
+    # feature subsets
+    random_state = check_random_state(estimator.random_state)
+    for this_estimator in estimators:
+        this_estimator._init_dict_fact()
+    with_std = ImageDictFact.settings[estimator.setting]['with_std']
+    with_mean = ImageDictFact.settings[estimator.setting]['with_mean']
+
+    patch_extractor = LazyCleanPatchExtractor(
+        patch_size=estimator.patch_size, max_patches=estimator.max_patches,
+        random_state=random_state)
+    patch_extractor.fit(image)
+    n_patches = patch_extractor.n_patches_
+    for this_estimator in estimators:
+        this_estimator.patch_shape_ = patch_extractor.patch_shape_
+
+    init_patches = patch_extractor.partial_transform(
+        batch=estimator.n_components)
+    init_patches = _flatten_patches(init_patches, with_std=with_std,
+                                    with_mean=with_mean, copy=False)
+    multi_dict_fact = MultiDictFact([this_estimator.dict_fact_
+                                     for this_estimator in estimators],
+                                    n_threads=n_threads)
+    multi_dict_fact.prepare(n_samples=n_patches, X=init_patches)
+    # Sample index of the patches of the extractor
+    order = np.arange(n_patches)
+    for i in range(estimator.n_epochs):
+        if i >= 1:
+            permutation = random_state.permutation(n_patches)
+            patch_extractor.shuffle(permutation)
+            order = order[permutation]
+        for this_estimator in estimators:
+            this_estimator._start_epoch(i)
+        for buffer in gen_batches(n_patches, estimator._buffer_size()):
+            patches = patch_extractor.partial_transform(batch=buffer)
+            patches = _flatten_patches(patches, with_mean=with_mean,
+                                       with_std=with_std, copy=False)
+            multi_dict_fact.partial_fit(patches,
+                                        sample_indices=order[buffer])
+    multi_dict_fact.close()
+    return estimators
+
+
 def _flatten_patches(patches, with_mean=True,
                      with_std=True, copy=False):
     n_patches = patches.shape[0]
@@ -200,8 +292,30 @@ def _flatten_patches(patches, with_mean=True,
 
 
 class DictionaryScorer:
-    def __init__(self, test_data, info=None):
-        self.start_time = time.clock()
+    """
+    Callback computing the test score of an ImageDictFact.
+
+    Parameters
+    ----------
+    test_data: ndarray, shape (n_patches, ...)
+        Test patches
+
+    info: dict or None
+        Updated with scores, times and iterations
+
+    asynchronous: boolean
+        Score snapshots of the dictionary in the background (see
+        modl.decomposition.monitoring.AsyncScorer), so that training is not
+        stalled. Scores of the last snapshots are recorded by flush.
+
+    backend: 'thread' or 'process'
+        Backend of asynchronous scoring
+    """
+
+    def __init__(self, test_data, info=None, asynchronous=False,
+                 backend='thread'):
+        self.start_time = time.perf_counter()
+        self.start_timestamp = time.time()
         self.test_data = test_data
         self.test_time = 0
         self.time = []
@@ -209,17 +323,47 @@ class DictionaryScorer:
         self.score = []
         self.iter = []
         self.info = info
+        self.asynchronous = asynchronous
+        self.backend = backend
+        self.scorer_ = None
 
     def __call__(self, dict_fact):
-        test_time = time.clock()
+        if self.asynchronous:
+            if self.scorer_ is None:
+                self.scorer_ = AsyncScorer(
+                    [dict_fact._flatten(self.test_data)],
+                    backend=self.backend)
+            self.scorer_.submit(dict_fact.dict_fact_, dict_fact.n_iter_,
+                                cpu_time=dict_fact.time_)
+            self._record()
+            return
+        test_time = time.perf_counter()
         score = dict_fact.score(self.test_data)
-        self.test_time += time.clock() - test_time
-        this_time = time.clock() - self.start_time - self.test_time
+        self.test_time += time.perf_counter() - test_time
+        this_time = time.perf_counter() - self.start_time - self.test_time
         self.time.append(this_time)
         self.score.append(score)
         self.iter.append(dict_fact.n_iter_)
         self.cpu_time.append(dict_fact.time_)
+        self._update_info()
+
+    def flush(self):
+        """Wait for the scores of pending snapshots and record them"""
+        if self.scorer_ is not None:
+            self.scorer_.close()
+            self._record()
+
+    def _record(self):
+        scorer = self.scorer_
+        for i in range(len(self.score), len(scorer.score)):
+            self.time.append(scorer.timestamp[i] - self.start_timestamp)
+            self.score.append(scorer.score[i])
+            self.iter.append(scorer.iter[i])
+            self.cpu_time.append(scorer.cpu_time[i])
+        self._update_info()
+
+    def _update_info(self):
         if self.info is not None:
             self.info['time'] = self.cpu_time
             self.info['score'] = self.score
-            self.info['iter'] = self.iter
\ No newline at end of file
+            self.info['iter'] = self.iter
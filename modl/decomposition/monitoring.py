@@ -0,0 +1,218 @@
+"""
+Asynchronous evaluation of dictionaries during training.
+
+Scoring a dictionary on test data costs a full coding pass, that would stall
+training if run inside its callbacks. An AsyncScorer instead takes a
+snapshot of the dictionary (a copy of components_ wrapped in a Coder with
+the coding parameters of the estimator) and scores it on cached test data
+in a background thread or process, while training goes on. Results are
+recorded along with the training iteration and time of their snapshot.
+"""
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .dict_fact import Coder
+
+
+def snapshot_coder(dict_fact):
+    """
+    Coder holding a copy of the current dictionary of dict_fact.
+
+    Parameters
+    ----------
+    dict_fact: DictFact or Coder
+        Estimator being trained
+
+    Returns
+    -------
+    coder: Coder, fitted
+        Single-threaded coder, unaffected by further updates of
+        dict_fact.components_
+    """
+    return Coder(np.array(dict_fact.components_, copy=True),
+                 code_alpha=dict_fact.code_alpha,
+                 code_l1_ratio=dict_fact.code_l1_ratio,
+                 tol=dict_fact.tol,
+                 max_iter=dict_fact.max_iter,
+                 code_pos=dict_fact.code_pos,
+                 temporal_warm_start=dict_fact.temporal_warm_start,
+                 sparse_dictionary=False).fit()
+
+
+def score_data(coder, data):
+    """Score of coder on a list of arrays, averaged over samples"""
+    scores = np.array([coder.score(this_data) for this_data in data])
+    len_data = np.array([this_data.shape[0] for this_data in data])
+    return np.sum(scores * len_data) / np.sum(len_data)
+
+
+# Test data of the worker of a process-based AsyncScorer
+_worker_state = {}
+
+
+def _init_score_worker(data):
+    if callable(data):
+        data = data()
+    _worker_state['data'] = data
+
+
+def _score_worker(coder):
+    return score_data(coder, _worker_state['data'])
+
+
+def _done(future):
+    """Whether a Future or an AsyncResult is done"""
+    if hasattr(future, 'done'):
+        return future.done()
+    return future.ready()
+
+
+def _result(future):
+    if hasattr(future, 'result'):
+        return future.result()
+    return future.get()
+
+
+class AsyncScorer(object):
+    """
+    Score snapshots of a dictionary on test data in the background.
+
+    Snapshots are scored one at a time, in the order of their submission.
+
+    Parameters
+    ----------
+    data: list of ndarray, shape (n_samples, n_features), or callable
+        Test data, sent once to the background worker, or picklable function
+        returning it, called once by the worker so that loading test data
+        does not stall training either
+
+    backend: 'thread' or 'process'
+        Scoring is done in a thread (sharing data with the caller) or in a
+        process (avoiding any contention on the GIL)
+
+    max_pending: int or None
+        Maximum number of snapshots waiting to be scored. Further snapshots
+        are skipped, so that frequent monitoring neither slows training nor
+        accumulates dictionary copies.
+
+    Attributes
+    ----------
+    score: list of float
+        Scores of the snapshots scored so far
+
+    iter: list of int
+        Training iteration of the snapshots
+
+    cpu_time: list of float
+        Training time of the snapshots, as given to submit
+
+    time: list of float
+        Wall-clock time of the snapshots since the creation of the scorer
+
+    timestamp: list of float
+        Wall-clock time (time.time()) at which snapshots were taken
+
+    n_skipped: int
+        Number of snapshots skipped because max_pending were pending
+    """
+
+    def __init__(self, data, backend='thread', max_pending=2):
+        self.start_time = time.time()
+        if backend == 'thread':
+            self.executor = ThreadPoolExecutor(1)
+            if callable(data):
+                # First job of the worker thread
+                data = self.executor.submit(data)
+            self.data = data
+        elif backend == 'process':
+            self.data = None
+            # multiprocessing.Pool, as ProcessPoolExecutor only takes an
+            # initializer from Python 3.7
+            self.executor = multiprocessing.Pool(
+                1, initializer=_init_score_worker, initargs=(data,))
+        else:
+            raise ValueError("backend should be 'thread' or 'process', "
+                             "got %r" % backend)
+        self.backend = backend
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.score = []
+        self.iter = []
+        self.cpu_time = []
+        self.time = []
+        self.timestamp = []
+        self.n_skipped = 0
+
+    def submit(self, dict_fact, n_iter, cpu_time=None):
+        """
+        Snapshot the dictionary of dict_fact and schedule its scoring.
+
+        Returns
+        -------
+        submitted: boolean
+            False if the snapshot was skipped
+        """
+        self.collect()
+        if (self.max_pending is not None and
+                len(self.pending) >= self.max_pending):
+            self.n_skipped += 1
+            return False
+        coder = snapshot_coder(dict_fact)
+        if self.backend == 'thread':
+            future = self.executor.submit(self._score, coder)
+        else:
+            future = self.executor.apply_async(_score_worker, (coder,))
+        self.pending.append((future, n_iter, cpu_time, time.time()))
+        return True
+
+    def collect(self, wait=False):
+        """
+        Record the scores of finished snapshots, in submission order.
+
+        Parameters
+        ----------
+        wait: boolean
+            Wait for all pending snapshots to be scored
+
+        Returns
+        -------
+        n_collected: int
+            Number of scores recorded by this call
+        """
+        n_collected = 0
+        while self.pending and (wait or _done(self.pending[0][0])):
+            future, n_iter, cpu_time, timestamp = self.pending.popleft()
+            self.score.append(_result(future))
+            self.iter.append(n_iter)
+            self.cpu_time.append(cpu_time)
+            self.time.append(timestamp - self.start_time)
+            self.timestamp.append(timestamp)
+            n_collected += 1
+        return n_collected
+
+    def _score(self, coder):
+        data = self.data
+        if hasattr(data, 'result'):
+            data = data.result()
+        return score_data(coder, data)
+
+    def close(self):
+        """Record pending scores and stop the worker"""
+        if self.executor is not None:
+            self.collect(wait=True)
+            if self.backend == 'thread':
+                self.executor.shutdown(wait=True)
+            else:
+                self.executor.close()
+                self.executor.join()
+            self.executor = None
+
+    def __getstate__(self):
+        # Scores only, for scorers stored along their estimator
+        state = dict(self.__dict__)
+        state.update(data=None, executor=None, pending=deque())
+        return state
@@ -0,0 +1,213 @@
+"""
+Training of several dictionary learning estimators in a single pass.
+
+Hyper-parameter sweeps (over reduction, code_alpha, learning_rate, optimizer,
+etc.) train every configuration on the same stream of samples. A
+MultiDictFact loads, validates and batches each chunk of samples once, and
+feeds every mini-batch to all its estimators, updated in parallel threads.
+Estimators with the same subsampling ratio also share the subsets of
+features drawn for each mini-batch, so that their comparison is paired.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sklearn.utils import check_array, check_random_state, gen_batches
+
+from modl.utils import get_sub_slice
+
+
+class _SharedSampler(object):
+    """
+    Feature sampler of the estimators of a MultiDictFact.
+
+    Estimators of a MultiDictFact with the same sampling scheme and
+    reduction share the sampler of the first of them. Subsets of features
+    are drawn by new_batch, for every reduction used by these estimators at
+    this mini-batch (reductions may change during training), and estimators
+    with the same reduction are given the same subset.
+    """
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+        self.subsets = {}
+
+    def new_batch(self, reductions):
+        # Drawn in a fixed order, for reproducibility
+        self.subsets = {reduction:
+                        np.array(self.sampler.yield_subset(reduction))
+                        for reduction in sorted(set(reductions))}
+
+    def yield_subset(self, reduction):
+        return self.subsets[reduction]
+
+
+class MultiDictFact(object):
+    """
+    Train several DictFact estimators on the same samples, in a single
+    pass over data.
+
+    Parameters
+    ----------
+    estimators: list of DictFact
+        Estimators to train. They should share n_components and
+        batch_size, and may differ in any other parameter (reduction,
+        code_alpha, learning_rate, optimizer, G_agg, Dx_agg, ...).
+
+    n_epochs: int
+        Number of epochs of fit
+
+    random_state: int or RandomState
+        Seeds the order of samples in fit
+
+    n_threads: int
+        Number of estimators updated in parallel
+
+    Attributes
+    ----------
+    estimators: list of DictFact
+        Trained estimators
+    """
+
+    def __init__(self, estimators, n_epochs=1, random_state=None,
+                 n_threads=1):
+        self.estimators = estimators
+        self.n_epochs = n_epochs
+        self.random_state = random_state
+        self.n_threads = n_threads
+
+    def _check_estimators(self):
+        if len(self.estimators) == 0:
+            raise ValueError('MultiDictFact needs at least one estimator')
+        for param in ['n_components', 'batch_size']:
+            values = set(getattr(estimator, param)
+                         for estimator in self.estimators)
+            if len(values) > 1:
+                raise ValueError('Estimators of a MultiDictFact should share'
+                                 ' %s, got %s' % (param, sorted(values)))
+
+    def prepare(self, n_samples=None, n_features=None, dtype=None, X=None,
+                dict_inits=None):
+        """
+        Init estimators, then share their feature samplers.
+
+        Parameters
+        ----------
+        n_samples, n_features, dtype, X:
+            See DictFact.prepare
+
+        dict_inits: list of ndarray or None
+            Per-estimator array to use in place of X
+
+        Returns
+        -------
+        self
+        """
+        self._check_estimators()
+        if dict_inits is None:
+            dict_inits = [X] * len(self.estimators)
+        for estimator, this_X in zip(self.estimators, dict_inits):
+            estimator.prepare(n_samples=n_samples, n_features=n_features,
+                              dtype=dtype, X=this_X)
+        # One sampler per sampling scheme and reduction
+        self.samplers_ = {}
+        for estimator in self.estimators:
+            key = (estimator.rand_size, estimator.replacement,
+                   estimator.reduction)
+            if key not in self.samplers_:
+                self.samplers_[key] = _SharedSampler(
+                    estimator.feature_sampler_)
+            estimator.feature_sampler_ = self.samplers_[key]
+        self.random_state_ = check_random_state(self.random_state)
+        return self
+
+    def fit(self, X):
+        """
+        Fit every estimator on X, visiting samples in the same order for
+        all of them.
+
+        Parameters
+        ----------
+        X: ndarray, shape (n_samples, n_features)
+
+        Returns
+        -------
+        self
+        """
+        self._check_estimators()
+        X = check_array(X, order='C', dtype=[np.float32, np.float64])
+        n_samples = X.shape[0]
+        self.prepare(n_samples=n_samples,
+                     dict_inits=[estimator._get_dict_init(X)
+                                 for estimator in self.estimators])
+        for i in range(self.n_epochs):
+            if i == 0:
+                self.partial_fit(X)
+            else:
+                permutation = self.random_state_.permutation(n_samples)
+                self.partial_fit(X[permutation], sample_indices=permutation)
+        self.close()
+        return self
+
+    def partial_fit(self, X, sample_indices=None):
+        """
+        Update every estimator using rows from X, validated and split in
+        mini-batches once.
+
+        Parameters
+        ----------
+        X: ndarray, shape (n_samples, n_features)
+
+        sample_indices: ndarray, shape (n_samples) or None
+            See DictFact.partial_fit
+
+        Returns
+        -------
+        self
+        """
+        X = check_array(X, dtype=[np.float32, np.float64], order='C')
+        if X.flags['WRITEABLE'] is False:
+            X = X.copy()
+        n_samples = X.shape[0]
+        batch_size = self.estimators[0].batch_size
+        for batch in gen_batches(n_samples, batch_size):
+            this_X = X[batch]
+            these_sample_indices = get_sub_slice(sample_indices, batch)
+            for sampler in self.samplers_.values():
+                sampler.new_batch(
+                    [estimator.reduction for estimator in self.estimators
+                     if estimator.feature_sampler_ is sampler])
+
+            def fit_batch(estimator):
+                estimator._single_batch_fit(this_X, these_sample_indices)
+
+            if self.n_threads > 1:
+                list(self._get_pool().map(fit_batch, self.estimators))
+            else:
+                for estimator in self.estimators:
+                    fit_batch(estimator)
+        return self
+
+    def set_params(self, **params):
+        """Set parameters of every estimator"""
+        for estimator in self.estimators:
+            estimator.set_params(**params)
+        return self
+
+    def _get_pool(self):
+        """Threads updating estimators, started on first use"""
+        if getattr(self, '_pool', None) is None:
+            self._pool = ThreadPoolExecutor(self.n_threads)
+        return self._pool
+
+    def close(self):
+        """Stop the threads updating estimators. They are started again by
+        further calls to partial_fit."""
+        pool = getattr(self, '_pool', None)
+        if pool is not None:
+            pool.shutdown(wait=True)
+            self._pool = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_pool', None)
+        return state
@@ -1,5 +1,4 @@
 import numpy as np
-import scipy
 import scipy.sparse as sp
 from numpy import linalg
 from sklearn.base import BaseEstimator
@@ -8,9 +7,9 @@ from sklearn.utils import check_random_state
 from sklearn.utils import gen_batches
 
 from .recsys_fast import _predict
-from .dict_fact_fast import _batch_weight
+from .dict_fact_fast import _batch_weight, _update_dict_subset
 
-from math import log, sqrt, ceil
+from math import log, ceil
 
 
 class RecsysDictFact(BaseEstimator):
@@ -185,31 +184,14 @@ class RecsysDictFact(BaseEstimator):
             self.B_[:, subset] += np.outer(code, X_subset * w_B)
 
     def _update_dict(self, subset):
-        ger, = scipy.linalg.get_blas_funcs(('ger',), (self.C_,
-                                                      self.components_))
-
         n_components, n_features = self.components_.shape
         components_subset = self.components_[:, subset]
         gradient_subset = self.B_[:, subset]
-        gradient_subset -= self.C_.dot(components_subset)
 
         order = self.random_state.permutation(n_components)
-        subset_norm = np.sum(components_subset ** 2, axis=1)
-        self.comp_norm_ += subset_norm
-        for k in order:
-            gradient_subset = ger(1.0, self.C_[k], components_subset[k],
-                                  a=gradient_subset, overwrite_a=True)
-            if self.C_[k, k] > 1e-20:
-                components_subset[k] = gradient_subset[k] / self.C_[k, k]
-            # Else do not update
-            norm = sqrt(np.sum(components_subset[k] ** 2))
-            lim_norm = sqrt(self.comp_norm_[k])
-            if norm > lim_norm:
-                components_subset[k] /= norm / lim_norm
-            gradient_subset = ger(-1.0, self.C_[k], components_subset[k],
-                                  a=gradient_subset, overwrite_a=True)
-        subset_norm = np.sum(components_subset ** 2, axis=1)
-        self.comp_norm_ -= subset_norm
+        # l2 constraint: comp_norm_ holds squared norms
+        _update_dict_subset(self.C_, gradient_subset, components_subset,
+                            self.comp_norm_, order, 0, False)
         self.components_[:, subset] = components_subset
 
     def predict(self, X):
@@ -2,9 +2,12 @@
 
 import numpy as np
 import pytest
-from modl.decomposition.dict_fact import DictFact
+from modl.decomposition.dict_fact import Coder, DictFact
+from modl.decomposition.dict_fact_fast import _update_dict_subset, \
+    _enet_regression_single_gram
+from modl.utils.math.enet import enet_norm, enet_projection
 from numpy import linalg
-from numpy.testing import assert_array_equal
+from numpy.testing import assert_array_equal, assert_array_almost_equal
 from sklearn.linear_model import cd_fast
 from sklearn.utils import check_random_state
 
@@ -112,6 +115,49 @@ def test_dict_mf_reconstruction_reproductible(solver):
     assert_array_equal(P1, P2)
 
 
+@pytest.mark.parametrize("solver", solvers)
+def test_dict_mf_parallel(solver):
+    X, Q = generate_synthetic(n_features=20,
+                              n_samples=400,
+                              dictionary_rank=4)
+    components = []
+    for n_threads in [1, 2]:
+        dict_mf = DictFact(n_components=4,
+                           code_alpha=1e-4,
+                           n_epochs=2,
+                           comp_l1_ratio=0,
+                           G_agg=solver_dict[solver]['G_agg'],
+                           Dx_agg=solver_dict[solver]['Dx_agg'],
+                           random_state=0, reduction=2,
+                           n_threads=n_threads)
+        dict_mf.fit(X)
+        components.append(dict_mf.components_)
+    assert_array_almost_equal(components[0], components[1])
+    assert not hasattr(dict_mf, 'gradient_')
+
+
+@pytest.mark.parametrize("n_threads", [1, 2])
+def test_dict_mf_profile(n_threads):
+    X, Q = generate_synthetic(n_features=20,
+                              n_samples=40,
+                              dictionary_rank=4)
+    batch_profiles = []
+    dict_mf = DictFact(n_components=4, G_agg='average', Dx_agg='average',
+                       reduction=2, batch_size=10, random_state=0,
+                       n_threads=n_threads, profile_memory=True,
+                       profile_callback=lambda estimator, profile:
+                       batch_profiles.append(profile))
+    dict_mf.fit(X)
+    assert len(batch_profiles) == 4
+    for phase, stats in dict_mf.profile_.items():
+        assert stats['calls'] >= 4
+        assert stats['time'] >= 0
+        assert stats['bytes'] >= 0
+        assert_array_almost_equal(stats['time'],
+                                  sum(profile[phase]['time']
+                                      for profile in batch_profiles))
+
+
 @pytest.mark.parametrize("solver", solvers)
 def test_dict_mf_reconstruction_reduction_batch(solver):
     X, Q = generate_synthetic(n_features=20,
@@ -154,6 +200,115 @@ def test_dict_mf_reconstruction_sparse_dict(solver):
     assert (recovered_maps >= 4)
 
 
+def test_dict_mf_svd_init():
+    X, Q = generate_synthetic(n_features=50, n_components=4)
+    dict_mf = DictFact(n_components=4, code_alpha=1e-4, n_epochs=1,
+                       comp_l1_ratio=0, dict_init='svd',
+                       random_state=rng_global)
+    dict_mf.fit(X)
+    # The learned dictionary spans the same subspace as Q
+    Q_rec = dict_mf.components_
+    proj = np.linalg.lstsq(Q_rec.T, Q.T, rcond=None)[0].T.dot(Q_rec)
+    assert_array_almost_equal(proj, Q, decimal=2)
+
+
+@pytest.mark.parametrize("code_l1_ratio", [0, 1])
+def test_coder_sparse_dictionary(code_l1_ratio):
+    X, Q = generate_sparse_synthetic(100, 8)
+    # Atoms only supported on the upper half of the image
+    Q = np.hstack([Q[:, :32], np.zeros((4, 64 * 2))])
+    X = np.hstack([X[:, :32], np.ones((100, 64 * 2))])
+    sparse_coder = Coder(Q, code_alpha=1e-2,
+                         code_l1_ratio=code_l1_ratio).fit()
+    dense_coder = Coder(Q, code_alpha=1e-2, code_l1_ratio=code_l1_ratio,
+                        sparse_dictionary=False).fit()
+    assert sparse_coder.density_ < Coder.SPARSE_DENSITY
+    assert sparse_coder.sparse_components_ is not None
+    assert dense_coder.sparse_components_ is None
+    assert_array_equal(sparse_coder.support_,
+                       np.flatnonzero(np.any(Q != 0, axis=0)))
+    assert_array_almost_equal(sparse_coder.transform(X),
+                              dense_coder.transform(X))
+    assert_array_almost_equal(sparse_coder.score(X), dense_coder.score(X))
+
+
+@pytest.mark.parametrize("n_threads", [1, 2])
+def test_coder_temporal_warm_start(n_threads):
+    rng = check_random_state(0)
+    _, Q = generate_synthetic(n_features=30, n_components=4)
+    # Slowly varying codes
+    code = np.cumsum(0.1 * rng.randn(100, 4), axis=0)
+    X = code.dot(Q) + 0.01 * rng.randn(100, 30)
+    codes = []
+    for warm_start in [False, True]:
+        coder = Coder(Q, code_alpha=1e-1, code_l1_ratio=1, tol=1e-8,
+                      max_iter=1000, n_threads=n_threads,
+                      temporal_warm_start=warm_start).fit()
+        codes.append(coder.transform(X))
+    assert_array_almost_equal(*codes, decimal=5)
+    # DictFact forwards the parameter to transform
+    dict_fact = DictFact(n_components=4, code_alpha=1e-1, tol=1e-8,
+                         max_iter=1000, n_threads=n_threads,
+                         temporal_warm_start=True)
+    dict_fact.components_ = Q
+    assert_array_almost_equal(dict_fact.transform(X), codes[1], decimal=5)
+
+
+def test_temporal_warm_start_n_iter():
+    rng = check_random_state(0)
+    _, Q = generate_synthetic(n_features=30, n_components=4)
+    code = np.cumsum(0.1 * rng.randn(100, 4), axis=0)
+    X = code.dot(Q) + 0.01 * rng.randn(100, 30)
+    G = Q.dot(Q.T)
+    Dx = X.dot(Q.T)
+    n_iters = []
+    for warm_start in [False, True]:
+        n_iter = np.zeros(100, dtype=np.intc)
+        _enet_regression_single_gram(G, Dx.copy(), X, np.ones((100, 4)),
+                                     np.arange(100), 1, 1e-1, False, 1e-8,
+                                     1000, warm_start, n_iter)
+        n_iters.append(n_iter)
+    # The first sample starts from the same code
+    assert n_iters[0][0] == n_iters[1][0]
+    assert np.sum(n_iters[1]) < np.sum(n_iters[0])
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("comp_pos", [False, True])
+def test_update_dict_subset(dtype, comp_pos):
+    rng = check_random_state(0)
+    n_components, len_subset = 5, 30
+    code = rng.randn(50, n_components)
+    C = code.T.dot(code).astype(dtype)
+    components = np.abs(rng.randn(n_components, len_subset)).astype(dtype)
+    gradient = rng.randn(n_components, len_subset).astype(dtype)
+    comp_norm = np.ones(n_components, dtype=dtype)
+    order = rng.permutation(n_components)
+
+    components_ref = components.copy()
+    comp_norm_ref = comp_norm.copy()
+    gradient_ref = gradient - C.dot(components_ref)
+    atom_temp = np.zeros(len_subset, dtype=dtype)
+    for k in order:
+        comp_norm_ref[k] += enet_norm(components_ref[k], 0.5)
+        gradient_ref += np.outer(C[k], components_ref[k])
+        components_ref[k] = gradient_ref[k] / C[k, k]
+        if comp_pos:
+            components_ref[k][components_ref[k] < 0] = 0
+        enet_projection(components_ref[k], atom_temp, comp_norm_ref[k], 0.5)
+        components_ref[k] = atom_temp
+        comp_norm_ref[k] -= enet_norm(components_ref[k], 0.5)
+        gradient_ref -= np.outer(C[k], components_ref[k])
+
+    components = np.asfortranarray(components)
+    gradient = np.asfortranarray(gradient)
+    _update_dict_subset(C, gradient, components, comp_norm, order,
+                        0.5, comp_pos)
+    decimal = 4 if dtype == np.float32 else 10
+    assert_array_almost_equal(components, components_ref, decimal)
+    assert_array_almost_equal(comp_norm, comp_norm_ref, decimal)
+
+
 def enet_regression_multi_gram_(G, Dx, X, code, l1_ratio, alpha,
                                 positive):
     batch_size = code.shape[0]
@@ -1,11 +1,20 @@
+import gc
+import multiprocessing
+import weakref
+
 import nibabel
 import numpy as np
 import pytest
+from numpy.testing import assert_array_equal, assert_array_almost_equal
 from nilearn.image import iter_img
 from nilearn.input_data import MultiNiftiMasker
 from sklearn.externals.joblib import Memory
 
 from modl.decomposition import fMRIDictFact
+from modl.decomposition.fmri import rfMRIDictionaryScorer, fit_multiple
+from modl.input_data.fmri.cache import MaskedDataCache
+from modl.input_data.fmri.store import create_raw_store
+from modl.input_data.fmri.unmask import MultiRawMasker
 from modl.utils.system import get_cache_dirs
 
 methods = ['masked', 'average', 'gram', 'reducing ratio', 'dictionary only']
@@ -130,11 +139,289 @@ def test_component_sign():
         mp = mp.get_data()
         assert(np.sum(mp[mp <= 0]) <= np.sum(mp[mp > 0]))
 
+
+def test_prefetch():
+    data, mask_img, components, init = _make_test_data(n_subjects=4)
+    maps = []
+    for n_prefetch, prefetch_max_bytes in [(0, None), (2, None), (2, 1)]:
+        dict_fact = fMRIDictFact(n_components=4, random_state=0,
+                                 mask=mask_img, dict_init=init,
+                                 reduction=2, n_epochs=2,
+                                 smoothing_fwhm=0.,
+                                 n_prefetch=n_prefetch,
+                                 prefetch_max_bytes=prefetch_max_bytes)
+        dict_fact.fit(data)
+        maps.append(dict_fact.components_)
+    assert_array_equal(maps[0], maps[1])
+    assert_array_equal(maps[0], maps[2])
+
+
+@pytest.mark.parametrize("store", [False, True])
+def test_block_streaming(tmpdir, store):
+    data, mask_img, components, init = _make_test_data(n_subjects=4)
+    masker = MultiRawMasker(mask_img=mask_img).fit()
+    records = []
+    for i, img in enumerate(data):
+        filename = str(tmpdir.join('record_%i.npy' % i))
+        np.save(filename, masker.transform(img))
+        records.append(filename)
+    if store:
+        records = create_raw_store(str(tmpdir.join('store.npy')),
+                                   records).records()
+    dict_fact = fMRIDictFact(n_components=4, random_state=0,
+                             mask=masker, dict_init=init,
+                             reduction=2, n_epochs=2,
+                             block_size=10, n_blocks=4)
+    dict_fact.fit(records)
+    maps = dict_fact.components_
+    components = masker.transform(components)
+    maps /= np.sqrt(np.sum(maps ** 2, axis=1))[:, np.newaxis]
+    components /= np.sqrt(np.sum(components ** 2, axis=1))[:, np.newaxis]
+    G = np.abs(components.dot(maps.T))
+    assert np.sum(G > 0.95) >= 4
+
+
+def test_multi_resolution():
+    data, mask_img, components, init = _make_test_data(n_subjects=10)
+    dict_fact = fMRIDictFact(n_components=4, random_state=0,
+                             mask=mask_img, dict_init=init,
+                             resolutions=[2], reduction=2,
+                             smoothing_fwhm=0., n_epochs=1, alpha=1)
+    dict_fact.fit(data)
+    maps = np.rollaxis(dict_fact.components_img_.get_data(), 3, 0)
+    components = np.rollaxis(components.get_data(), 3, 0)
+    maps = maps.reshape((maps.shape[0], -1))
+    components = components.reshape((components.shape[0], -1))
+    maps /= np.sqrt(np.sum(maps ** 2, axis=1))[:, np.newaxis]
+    components /= np.sqrt(np.sum(components ** 2, axis=1))[:, np.newaxis]
+    G = np.abs(components.dot(maps.T))
+    assert np.sum(G > 0.95) >= 4
+
+    with pytest.raises(ValueError):
+        fMRIDictFact(n_components=4, mask=mask_img,
+                     resolutions=[2, 4]).fit(data)
+
+
+def test_svd_init():
+    data, mask_img, components, init = _make_test_data(n_subjects=4)
+    # Initialization only
+    dict_fact = fMRIDictFact(n_components=4, random_state=0,
+                             mask=mask_img, dict_init='svd',
+                             standardize=False, detrend=False,
+                             smoothing_fwhm=0., n_epochs=0)
+    dict_fact.fit(data)
+    maps = np.rollaxis(dict_fact.components_img_.get_data(), 3, 0)
+    components = np.rollaxis(components.get_data(), 3, 0)
+    maps = maps.reshape((maps.shape[0], -1))
+    components = components.reshape((components.shape[0], -1))
+    # Initial maps span the components
+    coefs = np.linalg.lstsq(maps.T, components.T, rcond=None)[0]
+    assert_array_almost_equal(coefs.T.dot(maps), components, decimal=2)
+
+
+def test_temporal_reduction(tmpdir):
+    data, mask_img, components, init = _make_test_data(n_subjects=10)
+    masker = MultiRawMasker(mask_img=mask_img).fit()
+    records = []
+    for i, img in enumerate(data):
+        filename = str(tmpdir.join('record_%i.npy' % i))
+        np.save(filename, masker.transform(img))
+        records.append(filename)
+    dict_fact = fMRIDictFact(n_components=4, random_state=0,
+                             mask=masker, dict_init=init,
+                             temporal_reduction=10, reduction=2,
+                             n_epochs=2, alpha=1)
+    dict_fact.fit(records)
+    assert len(tmpdir.listdir(lambda path: '.svd-' in path.basename)) == 10
+    maps = dict_fact.components_
+    components = masker.transform(components)
+    maps /= np.sqrt(np.sum(maps ** 2, axis=1))[:, np.newaxis]
+    components /= np.sqrt(np.sum(components ** 2, axis=1))[:, np.newaxis]
+    G = np.abs(components.dot(maps.T))
+    assert np.sum(G > 0.95) >= 4
+
+
+def test_temporal_reduction_nifti():
+    # Nifti images without data_cache are reduced in memory
+    data, mask_img, components, init = _make_test_data(n_subjects=4)
+    dict_fact = fMRIDictFact(n_components=4, random_state=0,
+                             mask=mask_img, dict_init=init,
+                             smoothing_fwhm=0., temporal_reduction=5,
+                             n_epochs=1, alpha=1)
+    dict_fact.fit(data)
+    assert dict_fact.components_.shape == (4, 400)
+
+
+def test_temporal_reduction_callback():
+    data, mask_img, components, init = _make_test_data(n_subjects=4)
+    maskers = []
+
+    def callback(masker, dict_fact, cpu_time, io_time):
+        maskers.append(masker)
+
+    masker = MultiRawMasker(mask_img=mask_img, voxel_order='hilbert',
+                            standardize=True, detrend=True)
+    dict_fact = fMRIDictFact(n_components=4, random_state=0,
+                             mask=masker, dict_init=init,
+                             smoothing_fwhm=0., temporal_reduction=5,
+                             n_epochs=1, alpha=1, callback=callback,
+                             verbose=2)
+    dict_fact.fit(data)
+    assert len(maskers) > 0
+    # Test records are masked and cleaned as training records
+    for masker in maskers:
+        assert_array_equal(masker.transform(data[0]),
+                           dict_fact.masker_.transform(data[0]))
+
+
+def test_voxel_order():
+    data, mask_img, components, init = _make_test_data(n_subjects=4)
+    components_imgs = []
+    for voxel_order in [None, 'hilbert']:
+        masker = MultiRawMasker(mask_img=mask_img, voxel_order=voxel_order,
+                                standardize=True, detrend=True)
+        dict_fact = fMRIDictFact(n_components=4, random_state=0,
+                                 mask=masker, dict_init=init,
+                                 smoothing_fwhm=0., n_epochs=1, alpha=1)
+        dict_fact.fit(data)
+        assert dict_fact.masker_.voxel_order == voxel_order
+        components_imgs.append(dict_fact.components_img_.get_data())
+    assert_array_almost_equal(*components_imgs, decimal=4)
+
+
+def test_data_cache(tmpdir):
+    data, mask_img, components, init = _make_test_data(n_subjects=3)
+    imgs = []
+    for i, img in enumerate(data):
+        filename = str(tmpdir.join('img_%i.nii.gz' % i))
+        img.to_filename(filename)
+        imgs.append(filename)
+    data_cache = MaskedDataCache(str(tmpdir.join('cache')))
+    dict_fact = fMRIDictFact(n_components=4, random_state=0,
+                             mask=mask_img, dict_init=init,
+                             smoothing_fwhm=0., n_epochs=2,
+                             data_cache=data_cache)
+    dict_fact.fit(imgs)
+    assert data_cache.stats['misses'] == 3
+    assert data_cache.stats['hits'] == 3
+    codes = dict_fact.transform(imgs)
+    assert data_cache.stats['hits'] == 6
+    ref_dict_fact = fMRIDictFact(n_components=4, random_state=0,
+                                 mask=mask_img, dict_init=init,
+                                 smoothing_fwhm=0., n_epochs=2).fit(imgs)
+    assert_array_almost_equal(dict_fact.components_,
+                              ref_dict_fact.components_)
+    for code, ref_code in zip(codes, ref_dict_fact.transform(imgs)):
+        assert_array_almost_equal(code, ref_code)
+
+
 def test_verbose():
     pass
 
 def test_score():
     pass
 
-def test_transform():
-    pass
\ No newline at end of file
+
+def test_transform(tmpdir):
+    data, mask_img, components, init = _make_test_data(n_subjects=3)
+    dict_fact = fMRIDictFact(n_components=4, random_state=0,
+                             mask=mask_img, dict_init=init,
+                             smoothing_fwhm=0., n_epochs=1)
+    dict_fact.fit(data)
+    codes = dict_fact.transform(data)
+    score = dict_fact.score(data)
+    output = str(tmpdir.join('codes.npy'))
+    dict_fact.set_params(n_jobs=2)
+    for this_output in [None, output]:
+        parallel_codes = dict_fact.transform(data, output=this_output)
+        assert len(parallel_codes) == len(codes)
+        for code, parallel_code in zip(codes, parallel_codes):
+            assert_array_almost_equal(code, parallel_code)
+    # The pool is reused across calls
+    pool = dict_fact._coder_pool
+    assert_array_almost_equal(dict_fact.score(data), score)
+    assert dict_fact._coder_pool is pool
+    assert_array_almost_equal(np.load(output),
+                              np.concatenate(codes))
+    # Pools of collected estimators are closed
+    pool = weakref.ref(pool)
+    del dict_fact
+    gc.collect()
+    assert pool() is None
+
+
+def test_transform_temporal_warm_start():
+    data, mask_img, components, init = _make_test_data(n_subjects=3)
+    dict_fact = fMRIDictFact(n_components=4, random_state=0,
+                             mask=mask_img, dict_init=init,
+                             smoothing_fwhm=0., n_epochs=1,
+                             transform_l1_ratio=1)
+    dict_fact.fit(data)
+    codes = dict_fact.transform(data)
+    dict_fact.set_params(temporal_warm_start=True)
+    dict_fact.fit(data)
+    assert dict_fact.coder_.code_l1_ratio == 1
+    assert dict_fact.coder_.temporal_warm_start
+    for code, warm_code in zip(codes, dict_fact.transform(data)):
+        assert_array_almost_equal(code, warm_code, decimal=3)
+
+
+def test_transform_negative_n_jobs(monkeypatch):
+    data, mask_img, components, init = _make_test_data(n_subjects=3)
+    monkeypatch.setattr(multiprocessing, 'cpu_count', lambda: 3)
+    dict_fact = fMRIDictFact(n_components=4, random_state=0,
+                             mask=mask_img, dict_init=init,
+                             smoothing_fwhm=0., n_epochs=1, n_jobs=-2)
+    dict_fact.fit(data)
+    assert dict_fact.coder_.n_threads == 2
+    codes = dict_fact.transform(data)
+    assert dict_fact._coder_pool.pool._processes == 2
+    dict_fact.set_params(n_jobs=1)
+    for code, ref_code in zip(codes, dict_fact.transform(data)):
+        assert_array_almost_equal(code, ref_code)
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_scorer(asynchronous):
+    data, mask_img, components, init = _make_test_data(n_subjects=3)
+    scorer = rfMRIDictionaryScorer(data[:1], asynchronous=asynchronous)
+    dict_fact = fMRIDictFact(n_components=4, random_state=0,
+                             mask=mask_img, dict_init=init,
+                             smoothing_fwhm=0., n_epochs=1, verbose=3,
+                             callback=scorer)
+    dict_fact.fit(data[1:])
+    scorer.flush()
+    assert len(scorer.score) == len(scorer.iter) == len(scorer.io_time) > 0
+    assert np.all(np.isfinite(scorer.score))
+
+
+def test_fit_multiple():
+    data, mask_img, components, init = _make_test_data(n_subjects=3)
+    params = dict(n_components=4, random_state=0, mask=mask_img,
+                  dict_init=init, smoothing_fwhm=0., n_epochs=1,
+                  n_jobs=2)
+    estimators = [fMRIDictFact(alpha=1, **params),
+                  fMRIDictFact(alpha=1, **params),
+                  fMRIDictFact(alpha=0.1, reduction=2, **params)]
+    fit_multiple(estimators, data)
+    for estimator in estimators:
+        assert estimator.components_.shape == (4, 400)
+        assert estimator.components_img_.shape == (20, 20, 1, 4)
+    assert_array_equal(estimators[0].components_,
+                       estimators[1].components_)
+    assert not np.allclose(estimators[0].components_,
+                           estimators[2].components_)
+    with pytest.raises(ValueError):
+        fit_multiple([fMRIDictFact(**params),
+                      fMRIDictFact(batch_size=10, **params)], data)
+
+
+@pytest.mark.parametrize("dict_init", ['init', 'svd'])
+def test_fit_multiple_single_fit(dict_init):
+    data, mask_img, components, init = _make_test_data(n_subjects=3)
+    params = dict(n_components=4, random_state=0, mask=mask_img,
+                  dict_init=init if dict_init == 'init' else 'svd',
+                  smoothing_fwhm=0., n_epochs=2, reduction=2)
+    estimator = fMRIDictFact(**params).fit(data)
+    other, = fit_multiple([fMRIDictFact(**params)], data)
+    assert_array_equal(other.components_, estimator.components_)
@@ -0,0 +1,72 @@
+import threading
+
+import numpy as np
+import pytest
+from numpy.testing import assert_array_almost_equal
+
+from modl.decomposition.dict_fact import DictFact
+from modl.decomposition.monitoring import AsyncScorer, score_data, \
+    snapshot_coder
+from modl.decomposition.tests.test_dict_fact import generate_synthetic
+
+
+def _fitted_dict_fact():
+    X, _ = generate_synthetic(n_samples=200, n_features=30,
+                              n_components=4)
+    dict_fact = DictFact(n_components=4, code_alpha=1e-2, n_epochs=1,
+                         random_state=0, batch_size=20)
+    dict_fact.fit(X)
+    return dict_fact, X
+
+
+def test_snapshot_coder():
+    dict_fact, X = _fitted_dict_fact()
+    coder = snapshot_coder(dict_fact)
+    score = coder.score(X)
+    assert score == pytest.approx(dict_fact.score(X))
+    # Further updates do not affect the snapshot
+    dict_fact.components_[:] = 0
+    assert coder.score(X) == score
+
+
+@pytest.mark.parametrize("backend", ['thread', 'process'])
+def test_async_scorer(backend):
+    dict_fact, X = _fitted_dict_fact()
+    data = [X[:100], X[100:]]
+    scorer = AsyncScorer(data, backend=backend, max_pending=None)
+    scores = []
+    for n_iter in range(3):
+        scores.append(score_data(dict_fact, data))
+        assert scorer.submit(dict_fact, n_iter, cpu_time=n_iter / 10)
+        dict_fact.components_ *= 2
+    scorer.close()
+    assert scorer.iter == [0, 1, 2]
+    assert scorer.cpu_time == [0, .1, .2]
+    assert len(scorer.timestamp) == 3
+    assert np.all(np.diff(scorer.time) >= 0)
+    assert_array_almost_equal(scorer.score, scores)
+
+
+def test_async_scorer_loader():
+    dict_fact, X = _fitted_dict_fact()
+    scorer = AsyncScorer(lambda: [X])
+    scorer.submit(dict_fact, 0)
+    scorer.close()
+    assert scorer.score[0] == pytest.approx(dict_fact.score(X))
+
+
+def test_async_scorer_max_pending():
+    dict_fact, X = _fitted_dict_fact()
+    event = threading.Event()
+
+    def load():
+        event.wait()
+        return [X]
+
+    scorer = AsyncScorer(load, max_pending=2)
+    submitted = [scorer.submit(dict_fact, n_iter) for n_iter in range(4)]
+    assert submitted == [True, True, False, False]
+    assert scorer.n_skipped == 2
+    event.set()
+    scorer.close()
+    assert scorer.iter == [0, 1]
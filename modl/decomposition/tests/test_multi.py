@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+
+from modl.decomposition.dict_fact import DictFact
+from modl.decomposition.image import ImageDictFact, \
+    fit_multiple as image_fit_multiple
+from modl.decomposition.multi import MultiDictFact
+from modl.decomposition.tests.test_dict_fact import generate_synthetic
+
+
+def _dict_fact(**params):
+    params = dict(dict(n_components=4, code_alpha=1e-2, batch_size=10,
+                       random_state=0), **params)
+    return DictFact(**params)
+
+
+@pytest.mark.parametrize("n_threads", [1, 2])
+def test_multi_dict_fact(n_threads):
+    X, _ = generate_synthetic(n_samples=200, n_features=30,
+                              n_components=4)
+    ref = _dict_fact(reduction=2).prepare(X=X)
+    ref.partial_fit(X)
+    estimators = [_dict_fact(reduction=2), _dict_fact(reduction=2),
+                  _dict_fact(reduction=1, G_agg='full', Dx_agg='full')]
+    multi_dict_fact = MultiDictFact(estimators, n_threads=n_threads)
+    multi_dict_fact.prepare(X=X)
+    multi_dict_fact.partial_fit(X)
+    # A single estimator of a reduction draws the subsets of its own sampler
+    for estimator in estimators[:2]:
+        assert_array_almost_equal(estimator.components_, ref.components_)
+    assert estimators[2].n_iter_ == 200
+    assert not np.allclose(estimators[2].components_, ref.components_)
+
+
+def test_multi_dict_fact_fit():
+    X, _ = generate_synthetic(n_samples=200, n_features=30,
+                              n_components=4)
+    estimators = [_dict_fact(reduction=2), _dict_fact(code_alpha=1)]
+    multi_dict_fact = MultiDictFact(estimators, n_epochs=2, random_state=0,
+                                    n_threads=2).fit(X)
+    for estimator in estimators:
+        assert estimator.n_iter_ == 400
+        assert np.all(estimator.sample_n_iter_ == 2)
+        assert estimator.score(X) < np.sum(X ** 2) / 2 / X.shape[0]
+    # Threads are stopped after fit, and restarted by partial_fit
+    assert multi_dict_fact._pool is None
+    multi_dict_fact.partial_fit(X[:20])
+    assert multi_dict_fact._pool is not None
+    multi_dict_fact.close()
+    assert multi_dict_fact._pool is None
+
+
+def test_multi_dict_fact_check():
+    estimators = [_dict_fact(), DictFact(n_components=4, batch_size=20)]
+    with pytest.raises(ValueError):
+        MultiDictFact(estimators).prepare(X=np.ones((10, 5)))
+
+
+def test_image_fit_multiple():
+    image = np.random.RandomState(0).rand(20, 20, 1)
+    params = dict(patch_size=(4, 4), n_components=5, batch_size=10,
+                  n_epochs=2, random_state=0)
+    estimators = [ImageDictFact(reduction=2, **params),
+                  ImageDictFact(reduction=2, **params),
+                  ImageDictFact(reduction=1, alpha=1, **params)]
+    image_fit_multiple(estimators, image, n_threads=2)
+    for estimator in estimators:
+        assert estimator.components_.shape == (5, 4, 4, 1)
+    assert_array_equal(estimators[0].components_,
+                       estimators[1].components_)
+    with pytest.raises(ValueError):
+        image_fit_multiple([ImageDictFact(**params),
+                            ImageDictFact(n_threads=2, **params)], image)
@@ -0,0 +1,21 @@
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from modl.feature_extraction.image import LazyCleanPatchExtractor
+
+
+def test_lazy_clean_patch_extractor():
+    rng = np.random.RandomState(0)
+    image = rng.uniform(size=(8, 7, 3))
+    # Unknown pixel: patches covering it are discarded
+    image[0, 0, 0] = -1
+    extractor = LazyCleanPatchExtractor(patch_size=(3, 3), max_patches=20,
+                                        random_state=0).fit(image)
+    patches = extractor.transform()
+    assert patches.shape == (20, 3, 3, 3)
+    for patch, (i, j, _) in zip(patches, extractor.indices_3d):
+        assert_array_equal(patch, image[i:i + 3, j:j + 3])
+    assert not np.any(patches == -1)
+    assert_array_equal(extractor.partial_transform(batch=5), patches[:5])
+    assert_array_equal(extractor.partial_transform(batch=slice(5, 12)),
+                       patches[5:12])
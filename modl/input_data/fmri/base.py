@@ -99,7 +99,8 @@ def check_embedded_nifti_masker(estimator):
     if mask is not None and hasattr(mask, 'mask_img'):
         # Creating (Multi)NiftiMasker from provided masker
         masker_class = mask.__class__
-        masker_params = get_params(MultiNiftiMasker, mask)
+        # Including parameters specific to the masker class
+        masker_params = get_params(masker_class, mask)
         new_masker_params = masker_params
     else:
         # Creating (Multi)NiftiMasker
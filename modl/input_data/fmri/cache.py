@@ -0,0 +1,218 @@
+"""
+Size-bounded cache of masked (and cleaned) records.
+
+Masked records are stored as .npy files named after a hash of the record
+file (path, modification time and size), of the confounds and of the masker
+parameters and mask, so that a cache hit costs a single memory map. The
+least recently used records are evicted when the cache grows beyond its
+byte budget: the modification time of cached files is updated on each hit,
+so that recency is shared by all processes using the same directory.
+"""
+import os
+import threading
+from tempfile import mkstemp
+
+import numpy as np
+from nilearn._utils.class_inspect import get_params
+from sklearn.externals.joblib import hash as joblib_hash
+
+from modl.input_data.fmri.stream import is_raw_record
+
+# Masker parameters that do not change masked data
+_IGNORED_PARAMS = ['memory', 'memory_level', 'n_jobs', 'verbose']
+
+
+def _file_key(filename):
+    stat = os.stat(filename)
+    return os.path.abspath(filename), stat.st_mtime, stat.st_size
+
+
+def _img_key(img):
+    """Identity of an image file, or None if img is not linked to a file"""
+    if isinstance(img, str):
+        return _file_key(img)
+    get_filename = getattr(img, 'get_filename', None)
+    if get_filename is not None and get_filename() is not None:
+        return _file_key(get_filename())
+    return None
+
+
+def _confounds_key(confounds):
+    if confounds is None:
+        return None
+    if isinstance(confounds, str):
+        return _file_key(confounds)
+    if isinstance(confounds, (list, tuple)):
+        return [_confounds_key(confound) for confound in confounds]
+    return joblib_hash(np.asarray(confounds))
+
+
+class MaskedDataCache(object):
+    """
+    Cache of masked records, bounded in size, with LRU eviction.
+
+    Only records read from Nifti files are cached: raw records are already
+    memory-mappable, and in-memory images cannot be identified cheaply.
+
+    Parameters
+    ----------
+    cachedir: str
+        Directory of cached records, created if needed. It may be shared
+        by several processes.
+
+    max_bytes: int or None
+        Byte budget of the cache. The least recently used records are
+        removed when the cached records exceed it. None means no limit.
+
+    mmap_mode: str or None
+        Mode used to open cached records. Cached records are read-only.
+
+    Attributes
+    ----------
+    stats: dict
+        Number of 'hits', 'misses' and 'evictions', and 'bytes_served'
+        (size of records served from the cache) and 'bytes_written', for
+        this process
+    """
+
+    def __init__(self, cachedir, max_bytes=None, mmap_mode='r'):
+        self.cachedir = cachedir
+        self.max_bytes = max_bytes
+        self.mmap_mode = mmap_mode
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0,
+                      'bytes_served': 0, 'bytes_written': 0}
+        self._lock = threading.Lock()
+        os.makedirs(cachedir, exist_ok=True)
+
+    def key(self, masker, img, confounds=None):
+        """Hash identifying the masked data, None if img is not cacheable"""
+        if is_raw_record(img):
+            return None
+        img_key = _img_key(img)
+        if img_key is None:
+            return None
+        params = get_params(masker.__class__, masker,
+                            ignore=_IGNORED_PARAMS + ['mask_img'])
+        mask = np.asarray(masker.mask_img_.get_data())
+        return joblib_hash((masker.__class__.__name__,
+                            sorted(params.items()),
+                            mask, img_key, _confounds_key(confounds)))
+
+    def _filename(self, key):
+        return os.path.join(self.cachedir, key + '.npy')
+
+    def transform(self, masker, img, confounds=None):
+        """Masked data of img, as given by masker.transform(img, confounds),
+        read from the cache when possible"""
+        key = self.key(masker, img, confounds)
+        if key is None:
+            return masker.transform(img, confounds=confounds)
+        filename = self._filename(key)
+        try:
+            data = np.load(filename, mmap_mode=self.mmap_mode)
+        except (IOError, ValueError):
+            data = None
+        if data is not None:
+            try:
+                # Mark as recently used
+                os.utime(filename)
+            except OSError:
+                pass
+            with self._lock:
+                self.stats['hits'] += 1
+                self.stats['bytes_served'] += data.nbytes
+            return data
+        data = masker.transform(img, confounds=confounds)
+        with self._lock:
+            self.stats['misses'] += 1
+        self._put(filename, data)
+        return data
+
+    def _put(self, filename, data):
+        if self.max_bytes is not None and data.nbytes > self.max_bytes:
+            return
+        fd, tmp_filename = mkstemp(suffix='.tmp', dir=self.cachedir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, data)
+            os.replace(tmp_filename, filename)
+        except OSError:
+            if os.path.exists(tmp_filename):
+                os.unlink(tmp_filename)
+            return
+        with self._lock:
+            self.stats['bytes_written'] += data.nbytes
+        self.evict()
+
+    def entries(self):
+        """Cached records, as (filename, size, last use), least recently
+        used first"""
+        entries = []
+        for entry in os.scandir(self.cachedir):
+            if not entry.name.endswith('.npy'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    @property
+    def nbytes(self):
+        """Size of cached records"""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_bytes=None):
+        """Remove the least recently used records until the cache holds
+        less than max_bytes (defaults to the budget of the cache)"""
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        if max_bytes is None:
+            return
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for filename, size, _ in entries:
+            if total <= max_bytes:
+                break
+            try:
+                # Memory maps of evicted records remain valid
+                os.unlink(filename)
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        self.evict(max_bytes=0)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_lock')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__ = state
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'MaskedDataCache(%r, max_bytes=%r)' % (self.cachedir,
+                                                      self.max_bytes)
+
+
+def check_data_cache(data_cache):
+    """Turn a directory into a MaskedDataCache without byte budget"""
+    if data_cache is None or isinstance(data_cache, MaskedDataCache):
+        return data_cache
+    if isinstance(data_cache, str):
+        return MaskedDataCache(data_cache)
+    raise ValueError('data_cache should be None, a directory or a '
+                     'MaskedDataCache, got %r' % data_cache)
+
+
+def mask_record(masker, img, confounds=None, data_cache=None):
+    """masker.transform(img, confounds), through data_cache if not None"""
+    if data_cache is None:
+        return masker.transform(img, confounds=confounds)
+    return data_cache.transform(masker, img, confounds=confounds)
@@ -0,0 +1,132 @@
+"""
+Temporal cleaning of masked signals, equivalent to nilearn.signal.clean
+(detrending, confound removal, band-pass filtering and standardization).
+
+Signals are cleaned in place, by chunks of voxels processed in parallel
+threads, so that raw records can be preprocessed when loaded instead of
+being unmasked again for every set of preprocessing parameters.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from nilearn._utils.numpy_conversions import csv_to_array
+from nilearn.signal import _standardize, butterworth
+from scipy import linalg
+
+# Number of voxels cleaned at once
+CHUNK_SIZE = 4096
+
+
+def regressors(n_frames, confounds, detrend, standardize):
+    """Orthonormal basis of the signals removed by nilearn.signal.clean
+    before filtering, shape (n_frames, n_regressors)"""
+    basis = []
+    if detrend:
+        trend = np.ones((n_frames, 2))
+        trend[:, 1] = np.arange(n_frames)
+        trend, _ = linalg.qr(trend, mode='economic')
+        basis.append(trend)
+    if confounds is not None:
+        if not isinstance(confounds, (list, tuple)):
+            confounds = [confounds]
+        all_confounds = []
+        for confound in confounds:
+            if isinstance(confound, str):
+                confound = csv_to_array(confound)
+            confound = np.asarray(confound, dtype=np.float64)
+            if confound.ndim == 1:
+                confound = confound[:, np.newaxis]
+            if confound.shape[0] != n_frames:
+                raise ValueError("Confound signal has an incorrect length")
+            all_confounds.append(confound)
+        confounds = np.hstack(all_confounds)
+        # Same preprocessing of confounds as nilearn.signal.clean
+        confounds = _standardize(confounds, normalize=standardize,
+                                 detrend=detrend)
+        if not standardize:
+            confound_max = np.max(np.abs(confounds), axis=0)
+            confound_max[confound_max == 0] = 1
+            confounds /= confound_max
+        Q, R, _ = linalg.qr(confounds, mode='economic', pivoting=True)
+        Q = Q[:, np.abs(np.diag(R)) > np.finfo(np.float64).eps * 100.]
+        basis.append(Q)
+    if not basis:
+        return np.zeros((n_frames, 0))
+    return np.hstack(basis)
+
+
+def needs_cleaning(masker, confounds=None):
+    """Whether masker parameters or confounds require temporal cleaning"""
+    return bool(masker.detrend or masker.standardize or
+                masker.low_pass is not None or
+                masker.high_pass is not None or
+                confounds is not None)
+
+
+def _get_n_threads(n_jobs):
+    if n_jobs < 0:
+        return max(os.cpu_count() + 1 + n_jobs, 1)
+    return max(n_jobs, 1)
+
+
+def clean_signals(signals, confounds=None, detrend=False, standardize=False,
+                  low_pass=None, high_pass=None, t_r=None, n_jobs=1,
+                  chunk_size=CHUNK_SIZE):
+    """
+    Clean signals in place, as nilearn.signal.clean.
+
+    Parameters
+    ----------
+    signals: ndarray, shape (n_frames, n_voxels)
+        Signals to clean. Modified in place if of floating type, converted
+        to float32 otherwise.
+
+    confounds: CSV file path, 2D array, list of these or None
+
+    detrend, standardize, low_pass, high_pass, t_r:
+        See nilearn.signal.clean
+
+    n_jobs: int
+        Number of threads cleaning chunks of voxels. -1 means all CPUs.
+
+    chunk_size: int
+        Number of voxels cleaned at once, in double precision
+
+    Returns
+    -------
+    signals: ndarray, shape (n_frames, n_voxels)
+    """
+    filtering = low_pass is not None or high_pass is not None
+    if filtering and t_r is None:
+        raise ValueError("Repetition time (t_r) must be specified for "
+                         "filtering")
+    if signals.dtype.kind != 'f':
+        signals = signals.astype(np.float32)
+    n_frames, n_voxels = signals.shape
+    basis = regressors(n_frames, confounds, detrend, standardize)
+
+    def clean_chunk(start):
+        chunk = signals[:, start:start + chunk_size].astype(np.float64)
+        if basis.shape[1] > 0:
+            chunk -= basis.dot(basis.T.dot(chunk))
+        if filtering:
+            chunk = butterworth(chunk, sampling_rate=1. / t_r,
+                                low_pass=low_pass, high_pass=high_pass)
+        if standardize:
+            chunk -= chunk.mean(axis=0)
+            norm = np.sqrt(np.sum(chunk ** 2, axis=0))
+            norm[norm < np.finfo(np.float64).eps] = 1
+            chunk *= np.sqrt(n_frames) / norm
+        signals[:, start:start + chunk_size] = chunk
+
+    starts = range(0, n_voxels, chunk_size)
+    n_threads = min(_get_n_threads(n_jobs), len(starts))
+    if n_threads <= 1:
+        for start in starts:
+            clean_chunk(start)
+    else:
+        with ThreadPoolExecutor(n_threads) as executor:
+            # Propagate exceptions
+            list(executor.map(clean_chunk, starts))
+    return signals
@@ -18,9 +18,28 @@ from sklearn.externals import joblib as joblib
 from sklearn.externals.joblib.func_inspect import filter_args
 from sklearn.externals.joblib.hashing import NumpyHasher
 
+from modl.input_data.fmri.gzindex import load_indexed
 
-def load(filename, **kwargs):
-    img = nibabel_load(filename, **kwargs)
+
+# Number of threads decompressing .nii.gz images, set by
+# monkey_patch_nifti_image. None disables indexed decompression.
+_gzip_n_jobs = None
+
+
+def load(filename, gzip_n_jobs=None, **kwargs):
+    """Load a Nifti image.
+
+    If gzip_n_jobs (or the value set by monkey_patch_nifti_image) is not
+    None, .nii.gz images are read through a gzip seek-point index (see
+    modl.input_data.fmri.gzindex), decompressed in gzip_n_jobs threads.
+    """
+    if gzip_n_jobs is None:
+        gzip_n_jobs = _gzip_n_jobs
+    if (gzip_n_jobs is not None and isinstance(filename, str) and
+            filename.endswith('.nii.gz') and not kwargs):
+        img = load_indexed(filename, n_jobs=gzip_n_jobs)
+    else:
+        img = nibabel_load(filename, **kwargs)
     img.__class__ = Nifti1Image
     return img
 
@@ -207,7 +226,17 @@ def our_transform_single_imgs(self, imgs, confounds=None, copy=True):
     return data
 
 
-def monkey_patch_nifti_image():
+def monkey_patch_nifti_image(gzip_n_jobs=None):
+    """Patch nibabel, nilearn and joblib for the needs of modl.
+
+    Parameters
+    ----------
+    gzip_n_jobs: int or None
+        If not None, .nii.gz images are loaded through a gzip seek-point
+        index, and decompressed in gzip_n_jobs threads
+    """
+    global _gzip_n_jobs
+    _gzip_n_jobs = gzip_n_jobs
     nibabel.load = load
     joblib.memory.MemorizedFunc._get_argument_hash = our_get_argument_hash
     nilearn._utils.niimg.load_niimg = our_load_niimg
@@ -0,0 +1,275 @@
+"""
+Seek-point indices of gzip-compressed (.nii.gz) images, for random access
+to ranges of frames and multi-threaded decompression.
+
+The index of a file is built during a first sequential decompression (see
+modl.input_data.fmri.gzip_fast), and saved next to the file with a
+.gzidx.npz suffix, or only kept in memory if the directory is not
+writable. Subsequent reads inflate the ranges between seek points in
+parallel threads, directly into a preallocated buffer.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from nibabel.loadsave import load as nibabel_load
+from nibabel.volumeutils import apply_read_scaling
+
+from modl.input_data.fmri.gzip_fast import build_index, inflate_range
+
+# Minimal number of uncompressed bytes between seek points
+SPAN = 1 << 22
+
+# Process-wide registry: filename -> GzipIndex
+_indices = {}
+
+
+def _stat(filename):
+    stat = os.stat(filename)
+    return stat.st_mtime, stat.st_size
+
+
+def index_filename(filename):
+    return filename + '.gzidx.npz'
+
+
+class GzipIndex(object):
+    """
+    Seek points of a gzip file, built by build_index.
+
+    Attributes
+    ----------
+    size: int
+        Size of the uncompressed data
+
+    stat: (float, int)
+        Modification time and size of the indexed file
+    """
+
+    def __init__(self, in_offsets, out_offsets, bits, windows, size, stat):
+        self.in_offsets = in_offsets
+        self.out_offsets = out_offsets
+        self.bits = bits
+        self.windows = windows
+        self.size = size
+        self.stat = tuple(stat)
+
+    @classmethod
+    def build(cls, filename, span=SPAN, out=None):
+        """Index filename, writing its uncompressed data in out (uint8
+        array) if given"""
+        stat = _stat(filename)
+        src = np.memmap(filename, dtype=np.uint8, mode='r')
+        return cls(*build_index(src, span, out=out), stat=stat)
+
+    def save(self, filename):
+        tmp_filename = filename + '.tmp.npz'
+        np.savez_compressed(tmp_filename, in_offsets=self.in_offsets,
+                            out_offsets=self.out_offsets, bits=self.bits,
+                            windows=self.windows, size=self.size,
+                            stat=np.array(self.stat))
+        os.replace(tmp_filename, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as index:
+            return cls(index['in_offsets'], index['out_offsets'],
+                       index['bits'], index['windows'], int(index['size']),
+                       stat=(float(index['stat'][0]), int(index['stat'][1])))
+
+    def read(self, filename, start=0, stop=None, out=None, n_jobs=1):
+        """
+        Uncompressed bytes [start, stop) of filename.
+
+        Parameters
+        ----------
+        filename: str
+            Indexed gzip file
+
+        start, stop: int
+
+        out: uint8 array or None
+            Buffer of size stop - start to write into
+
+        n_jobs: int
+            Number of threads inflating ranges between seek points
+
+        Returns
+        -------
+        out: uint8 array
+        """
+        if stop is None:
+            stop = self.size
+        start, stop = max(start, 0), min(stop, self.size)
+        if out is None:
+            out = np.empty(max(stop - start, 0), dtype=np.uint8)
+        if stop <= start:
+            return out
+        src = np.memmap(filename, dtype=np.uint8, mode='r')
+        # Seek points from which the range is inflated
+        first = np.searchsorted(self.out_offsets, start, side='right') - 1
+        last = np.searchsorted(self.out_offsets, stop, side='left')
+        points = np.arange(first, last)
+        n_jobs = max(min(n_jobs, len(points)), 1)
+        groups = [group[0] for group in np.array_split(points, n_jobs)]
+        starts = [start] + [self.out_offsets[i] for i in groups[1:]]
+        stops = starts[1:] + [stop]
+
+        def inflate(job):
+            i, this_start, this_stop = job
+            inflate_range(src, self.in_offsets[i], self.bits[i],
+                          self.windows[i], this_start - self.out_offsets[i],
+                          out[this_start - start:this_stop - start])
+
+        jobs = list(zip(groups, starts, stops))
+        if n_jobs == 1:
+            inflate(jobs[0])
+        else:
+            with ThreadPoolExecutor(n_jobs) as executor:
+                # Propagate exceptions
+                list(executor.map(inflate, jobs))
+        return out
+
+
+def get_index(filename, span=SPAN, out=None):
+    """
+    Index of filename, loaded from the registry or from its index file, or
+    built (and saved) if missing or outdated.
+
+    Returns
+    -------
+    index: GzipIndex
+
+    filled: bool
+        Whether the index was built, and the uncompressed data written
+        into out
+    """
+    stat = _stat(filename)
+    index = _indices.get(filename)
+    if index is not None and index.stat == stat:
+        return index, False
+    try:
+        index = GzipIndex.load(index_filename(filename))
+    except (IOError, KeyError, ValueError):
+        index = None
+    filled = False
+    if index is None or index.stat != stat:
+        index = GzipIndex.build(filename, span=span, out=out)
+        filled = out is not None
+        try:
+            index.save(index_filename(filename))
+        except OSError:
+            # Read-only directory: the index only lives in this process
+            pass
+    _indices[filename] = index
+    return index, filled
+
+
+def read_gz(filename, start=0, stop=None, out=None, n_jobs=1):
+    """
+    Uncompressed bytes [start, stop) of a gzip file, through its index.
+
+    If the file is not indexed yet, it is indexed first. Ranges starting at
+    0 are then read during indexing, if out (of size stop - start) is
+    given.
+    """
+    index, filled = get_index(filename,
+                              out=out if start == 0 else None)
+    if filled:
+        return out
+    return index.read(filename, start, stop, out=out, n_jobs=n_jobs)
+
+
+class IndexedGzipProxy(object):
+    """
+    Array proxy of a gzip-compressed Nifti image, read through a seek-point
+    index. Slicing the last (time) axis only inflates the requested frames.
+
+    Parameters
+    ----------
+    filename: str
+
+    shape: tuple
+
+    dtype: np.dtype
+        On-disk data type
+
+    offset: int
+        Position of the data in the uncompressed file
+
+    slope, inter: float or None
+        Scaling of the data (see nibabel.volumeutils.apply_read_scaling)
+
+    n_jobs: int
+        Number of decompression threads
+    """
+    is_proxy = True
+
+    def __init__(self, filename, shape, dtype, offset, slope=None,
+                 inter=None, n_jobs=1):
+        self.filename = filename
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.offset = int(offset)
+        self.slope = slope
+        self.inter = inter
+        self.n_jobs = n_jobs
+
+    @classmethod
+    def from_proxy(cls, proxy, n_jobs=1):
+        """Read the data of a nibabel ArrayProxy through an index"""
+        return cls(proxy.file_like, proxy.shape, proxy.dtype, proxy.offset,
+                   slope=proxy.slope, inter=proxy.inter, n_jobs=n_jobs)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def _read_frames(self, start, stop):
+        """Frames [start, stop) along the last axis, scaled"""
+        frame_size = int(np.prod(self.shape[:-1])) * self.dtype.itemsize
+        byte_start = self.offset + start * frame_size
+        shape = self.shape[:-1] + (stop - start,)
+        n_bytes = frame_size * (stop - start)
+        if start == 0:
+            # Header included, so that the first read of a file decompresses
+            # it while building its index
+            data = np.empty(byte_start + n_bytes, dtype=np.uint8)
+            read_gz(self.filename, 0, byte_start + n_bytes, out=data,
+                    n_jobs=self.n_jobs)
+            data = data[byte_start:]
+        else:
+            data = read_gz(self.filename, byte_start, byte_start + n_bytes,
+                           n_jobs=self.n_jobs)
+        data = data.view(self.dtype).reshape(shape, order='F')
+        return apply_read_scaling(data, self.slope, self.inter)
+
+    def __array__(self, dtype=None, copy=None):
+        data = self._read_frames(0, self.shape[-1])
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+        return data
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        # Slices of the last axis are read without the other frames
+        if (len(index) == 2 and index[0] is Ellipsis and
+                isinstance(index[1], slice) and index[1].step in (None, 1)):
+            start, stop, _ = index[1].indices(self.shape[-1])
+            return self._read_frames(start, max(start, stop))
+        return np.asarray(self)[index]
+
+    def __repr__(self):
+        return 'IndexedGzipProxy(%r, shape=%r)' % (self.filename, self.shape)
+
+
+def load_indexed(filename, n_jobs=1):
+    """nibabel image of a .nii.gz file, whose data is read through its
+    seek-point index by an IndexedGzipProxy"""
+    img = nibabel_load(filename)
+    proxy = IndexedGzipProxy.from_proxy(img.dataobj, n_jobs=n_jobs)
+    img = img.__class__(proxy, img.affine, header=img.header,
+                        extra=img.extra)
+    img.set_filename(filename)
+    return img
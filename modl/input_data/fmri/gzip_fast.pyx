@@ -0,0 +1,251 @@
+# encoding: utf-8
+# cython: cdivision=True
+# cython: boundscheck=False
+# cython: wraparound=False
+"""
+Random access into gzip streams, after zlib's examples/zran.c.
+
+A first sequential pass records seek points at deflate block boundaries,
+every `span` bytes of uncompressed output: the position of the block in
+the compressed stream (in bytes, and bits within the byte) and the 32KB of
+uncompressed data preceding it, that later blocks may reference.
+Decompression can then start from any seek point, so that ranges of the
+uncompressed data are read without inflating what precedes them, and
+distinct ranges can be inflated in parallel threads.
+"""
+from libc.stdlib cimport malloc, free
+from libc.string cimport memcpy, memset
+
+import numpy as np
+
+cdef extern from "zlib.h":
+    ctypedef struct z_stream:
+        unsigned char *next_in
+        unsigned int avail_in
+        unsigned long total_in
+        unsigned char *next_out
+        unsigned int avail_out
+        unsigned long total_out
+        char *msg
+        int data_type
+
+    int Z_OK
+    int Z_STREAM_END
+    int Z_NEED_DICT
+    int Z_DATA_ERROR
+    int Z_MEM_ERROR
+    int Z_BUF_ERROR
+    int Z_NO_FLUSH
+    int Z_BLOCK
+
+    int inflateInit2(z_stream *strm, int windowBits) nogil
+    int inflate(z_stream *strm, int flush) nogil
+    int inflateEnd(z_stream *strm) nogil
+    int inflatePrime(z_stream *strm, int bits, int value) nogil
+    int inflateSetDictionary(z_stream *strm, const unsigned char *dictionary,
+                             unsigned int dictLength) nogil
+
+# Size of the window of deflate streams
+DEF WINSIZE = 32768
+# Maximum input fed to zlib at once
+DEF MAX_AVAIL_IN = 1 << 30
+
+WINDOW_SIZE = WINSIZE
+
+
+cdef inline void _feed(z_stream *strm, const unsigned char *src,
+                       Py_ssize_t *pos, Py_ssize_t size) nogil:
+    cdef Py_ssize_t avail
+    if strm.avail_in == 0 and pos[0] < size:
+        avail = min(size - pos[0], MAX_AVAIL_IN)
+        strm.next_in = <unsigned char *> src + pos[0]
+        strm.avail_in = <unsigned int> avail
+        pos[0] += avail
+
+
+def build_index(const unsigned char[::1] src, Py_ssize_t span,
+                unsigned char[::1] out=None):
+    """
+    Record seek points in the gzip stream src.
+
+    Parameters
+    ----------
+    src: uint8 array
+        Whole compressed file
+
+    span: int
+        Minimal number of uncompressed bytes between seek points
+
+    out: uint8 array or None
+        If given, uncompressed data is also written in out, up to its size
+
+    Returns
+    -------
+    in_offsets: int64 array, shape (n_points)
+        Position of seek points in src. If bits is not zero, the point
+        starts within byte in_offsets - 1.
+
+    out_offsets: int64 array, shape (n_points)
+        Position of seek points in the uncompressed data
+
+    bits: uint8 array, shape (n_points)
+        Number of bits of the point in byte in_offsets - 1
+
+    windows: uint8 array, shape (n_points, WINDOW_SIZE)
+        Uncompressed data preceding each point
+
+    size: int
+        Size of the uncompressed data
+    """
+    cdef z_stream strm
+    cdef Py_ssize_t size = src.shape[0]
+    cdef Py_ssize_t pos = 0
+    cdef Py_ssize_t out_size = 0 if out is None else out.shape[0]
+    cdef Py_ssize_t last = 0, total_out = 0, produced, left, n_copy
+    cdef unsigned char *window = <unsigned char *> malloc(WINSIZE)
+    cdef unsigned char *dest
+    cdef int ret
+    cdef unsigned char[::1] point_window
+    in_offsets, out_offsets, bits, windows = [], [], [], []
+    if window == NULL:
+        raise MemoryError()
+    memset(window, 0, WINSIZE)
+    memset(&strm, 0, sizeof(z_stream))
+    # Automatic zlib or gzip header decoding
+    if inflateInit2(&strm, 47) != Z_OK:
+        free(window)
+        raise MemoryError()
+    strm.avail_out = 0
+    try:
+        while True:
+            _feed(&strm, &src[0], &pos, size)
+            # Without input, inflate may only flush pending output
+            if strm.avail_in == 0 and strm.avail_out != 0:
+                raise ValueError('Truncated gzip stream')
+            if strm.avail_out == 0:
+                strm.avail_out = WINSIZE
+                strm.next_out = window
+            dest = strm.next_out
+            ret = inflate(&strm, Z_BLOCK)
+            if ret == Z_NEED_DICT or ret == Z_DATA_ERROR:
+                raise ValueError('Invalid gzip stream')
+            elif ret == Z_MEM_ERROR:
+                raise MemoryError()
+            produced = strm.next_out - dest
+            if out_size > total_out and produced > 0:
+                n_copy = min(produced, out_size - total_out)
+                memcpy(&out[total_out], dest, n_copy)
+            total_out += produced
+            if ret == Z_STREAM_END:
+                break
+            # At the end of a block which is not the last one
+            if ((strm.data_type & 128) and not (strm.data_type & 64) and
+                    (total_out == 0 or total_out - last > span)):
+                point_window = np.empty(WINSIZE, dtype=np.uint8)
+                left = strm.avail_out
+                # Unroll the circular window
+                if left > 0:
+                    memcpy(&point_window[0], window + WINSIZE - left, left)
+                if left < WINSIZE:
+                    memcpy(&point_window[left], window, WINSIZE - left)
+                in_offsets.append(<Py_ssize_t> strm.total_in)
+                out_offsets.append(total_out)
+                bits.append(strm.data_type & 7)
+                windows.append(np.asarray(point_window))
+                last = total_out
+        # Trailing bytes would be another gzip member
+        if strm.avail_in > 0 or pos < size:
+            if np.any(np.asarray(src[size - strm.avail_in - (size - pos):])):
+                raise ValueError('Multi-member gzip files are not supported')
+    finally:
+        inflateEnd(&strm)
+        free(window)
+    if windows:
+        windows = np.vstack(windows)
+    else:
+        windows = np.zeros((0, WINSIZE), dtype=np.uint8)
+    return (np.array(in_offsets, dtype=np.int64),
+            np.array(out_offsets, dtype=np.int64),
+            np.array(bits, dtype=np.uint8), windows, total_out)
+
+
+cdef int _inflate_range(const unsigned char *src, Py_ssize_t size,
+                        Py_ssize_t in_offset, int bits,
+                        const unsigned char *window, Py_ssize_t skip,
+                        unsigned char *out, Py_ssize_t length) nogil:
+    """Inflate length bytes into out, skip bytes after the seek point.
+    Returns a zlib error code, or Z_BUF_ERROR if the stream is too short"""
+    cdef z_stream strm
+    cdef Py_ssize_t pos = in_offset
+    cdef Py_ssize_t chunk
+    cdef unsigned char *discard = NULL
+    cdef bint full = True
+    cdef int ret = Z_OK
+    memset(&strm, 0, sizeof(z_stream))
+    # Raw deflate
+    ret = inflateInit2(&strm, -15)
+    if ret != Z_OK:
+        return ret
+    if bits:
+        ret = inflatePrime(&strm, bits, src[pos - 1] >> (8 - bits))
+    if ret == Z_OK:
+        ret = inflateSetDictionary(&strm, window, WINSIZE)
+    if ret == Z_OK and skip > 0:
+        discard = <unsigned char *> malloc(WINSIZE)
+        if discard == NULL:
+            ret = Z_MEM_ERROR
+    while ret == Z_OK and (skip > 0 or length > 0):
+        _feed(&strm, src, &pos, size)
+        # Without input, inflate may only flush pending output
+        if strm.avail_in == 0 and not full:
+            ret = Z_BUF_ERROR
+            break
+        if skip > 0:
+            chunk = min(skip, WINSIZE)
+            strm.next_out = discard
+        else:
+            chunk = min(length, MAX_AVAIL_IN)
+            strm.next_out = out
+        strm.avail_out = <unsigned int> chunk
+        ret = inflate(&strm, Z_NO_FLUSH)
+        full = strm.avail_out == 0
+        chunk -= strm.avail_out
+        if skip > 0:
+            skip -= chunk
+        else:
+            out += chunk
+            length -= chunk
+        if ret == Z_STREAM_END:
+            ret = Z_OK if (skip == 0 and length == 0) else Z_BUF_ERROR
+            break
+        elif ret == Z_BUF_ERROR:
+            # No progress possible: more input is needed
+            ret = Z_OK
+    inflateEnd(&strm)
+    if discard != NULL:
+        free(discard)
+    return ret
+
+
+def inflate_range(const unsigned char[::1] src, Py_ssize_t in_offset,
+                  int bits, const unsigned char[::1] window, Py_ssize_t skip,
+                  unsigned char[::1] out):
+    """
+    Inflate out.shape[0] bytes, starting skip bytes after the seek point
+    (in_offset, bits, window) recorded by build_index. The GIL is released
+    while inflating.
+    """
+    cdef int ret
+    cdef Py_ssize_t size = src.shape[0]
+    cdef Py_ssize_t length = out.shape[0]
+    if length == 0:
+        return
+    with nogil:
+        ret = _inflate_range(&src[0], size, in_offset, bits, &window[0],
+                             skip, &out[0], length)
+    if ret == Z_MEM_ERROR:
+        raise MemoryError()
+    elif ret == Z_BUF_ERROR:
+        raise ValueError('Truncated gzip stream')
+    elif ret != Z_OK:
+        raise ValueError('Invalid gzip stream (zlib error %i)' % ret)
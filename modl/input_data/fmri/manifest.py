@@ -0,0 +1,107 @@
+"""
+Manifest of fMRI records: number of frames, dtype and data offset of each
+record file, so that datasets can be scanned without opening every file.
+
+Entries are validated against the modification time and size of files,
+and kept in a process-wide registry filled by `load_manifest` and
+`scan_records`.
+"""
+import json
+import os
+
+import numpy as np
+from nilearn._utils import check_niimg
+
+# Process-wide registry: filename -> entry
+_registry = {}
+
+
+def _stat(filename):
+    stat = os.stat(filename)
+    return stat.st_mtime, stat.st_size
+
+
+def scan_record(filename):
+    """
+    Read the header of a record file (.npy or Nifti), without loading data.
+
+    Returns
+    -------
+    entry: dict
+        Keys 'n_frames', 'dtype', 'offset' (position of the data in bytes
+        within the file, None if compressed), 'mtime' and 'size'
+    """
+    mtime, size = _stat(filename)
+    if os.path.splitext(filename)[1] == '.npy':
+        with open(filename, 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+        n_frames = shape[0]
+    else:
+        img = check_niimg(filename)
+        n_frames = img.shape[3]
+        dtype = img.get_data_dtype()
+        if filename.endswith('.gz'):
+            offset = None
+        else:
+            offset = int(img.header.get_data_offset())
+    return {'n_frames': int(n_frames), 'dtype': np.dtype(dtype).str,
+            'offset': offset, 'mtime': mtime, 'size': size}
+
+
+def get_entry(filename):
+    """Registered entry of filename, or None if filename is unknown or was
+    modified since it was scanned"""
+    entry = _registry.get(filename)
+    if entry is None:
+        return None
+    try:
+        if _stat(filename) != (entry['mtime'], entry['size']):
+            return None
+    except OSError:
+        return None
+    return entry
+
+
+def scan_records(filenames):
+    """Entries of all filenames, scanning only new or modified files"""
+    entries = []
+    for filename in filenames:
+        entry = get_entry(filename)
+        if entry is None:
+            entry = scan_record(filename)
+            _registry[filename] = entry
+        entries.append(entry)
+    return entries
+
+
+def write_manifest(filename, records):
+    """Scan records and write their manifest to filename, as json"""
+    entries = scan_records(records)
+    manifest = {'records': [dict(entry, filename=record)
+                            for record, entry in zip(records, entries)]}
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w+') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_filename, filename)
+
+
+def load_manifest(filename):
+    """Register the entries of a manifest file written by write_manifest.
+
+    Returns
+    -------
+    entries: list of dict
+    """
+    with open(filename, 'r') as f:
+        manifest = json.load(f)
+    entries = manifest['records']
+    for entry in entries:
+        entry = dict(entry)
+        record = entry.pop('filename')
+        _registry[record] = entry
+    return entries
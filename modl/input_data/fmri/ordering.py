@@ -0,0 +1,110 @@
+"""
+Space-filling-curve orderings of the voxels of a mask.
+
+Maskers order voxels as the C-order raveling of the 3D mask, so that
+voxels that are neighbours along the first two axes lie far apart in
+masked data. Sorting voxels along a Morton (Z-order) or Hilbert curve keeps
+spatial neighbours close in memory, which benefits sparse atoms and
+contiguous blocks of features.
+"""
+import numpy as np
+from nilearn._utils import check_niimg
+
+VOXEL_ORDERS = ['morton', 'hilbert']
+
+
+def _n_bits(coords):
+    return max(int(coords.max()).bit_length(), 1) if coords.size else 1
+
+
+def morton_keys(coords):
+    """
+    Position of voxels along a Morton curve.
+
+    Parameters
+    ----------
+    coords: ndarray of int, shape (n_voxels, 3)
+
+    Returns
+    -------
+    keys: ndarray of int64, shape (n_voxels)
+    """
+    coords = np.asarray(coords, dtype=np.int64)
+    keys = np.zeros(coords.shape[0], dtype=np.int64)
+    for bit in range(_n_bits(coords)):
+        for axis in range(3):
+            keys |= ((coords[:, axis] >> bit) & 1) << (3 * bit + 2 - axis)
+    return keys
+
+
+def hilbert_keys(coords):
+    """
+    Position of voxels along a Hilbert curve, after J. Skilling,
+    'Programming the Hilbert curve', AIP Conf. Proc. 707 (2004).
+
+    Parameters
+    ----------
+    coords: ndarray of int, shape (n_voxels, 3)
+
+    Returns
+    -------
+    keys: ndarray of int64, shape (n_voxels)
+    """
+    X = np.array(coords, dtype=np.int64).T
+    n_dims = X.shape[0]
+    n_bits = _n_bits(X)
+    # Inverse undo excess work
+    Q = 1 << (n_bits - 1)
+    while Q > 1:
+        P = Q - 1
+        for i in range(n_dims):
+            high = (X[i] & Q) != 0
+            X[0, high] ^= P
+            low = ~high
+            t = (X[0, low] ^ X[i, low]) & P
+            X[0, low] ^= t
+            X[i, low] ^= t
+        Q >>= 1
+    # Gray encode
+    for i in range(1, n_dims):
+        X[i] ^= X[i - 1]
+    t = np.zeros(X.shape[1], dtype=np.int64)
+    Q = 1 << (n_bits - 1)
+    while Q > 1:
+        t[(X[n_dims - 1] & Q) != 0] ^= Q - 1
+        Q >>= 1
+    X ^= t
+    # Interleave the transposed index, most significant bits first
+    keys = np.zeros(X.shape[1], dtype=np.int64)
+    for bit in range(n_bits - 1, -1, -1):
+        for i in range(n_dims):
+            keys = (keys << 1) | ((X[i] >> bit) & 1)
+    return keys
+
+
+def get_voxel_order(mask_img, voxel_order=None):
+    """
+    Permutation of the voxels of a mask along a space-filling curve.
+
+    Parameters
+    ----------
+    mask_img: Niimg-like object
+
+    voxel_order: None, 'morton' or 'hilbert'
+
+    Returns
+    -------
+    order: ndarray of int, shape (n_voxels) or None
+        Masked data in C-order is reordered as data[:, order]. None if
+        voxel_order is None.
+    """
+    if voxel_order is None:
+        return None
+    if voxel_order not in VOXEL_ORDERS:
+        raise ValueError('voxel_order should be None or one of %s, got %r'
+                         % (VOXEL_ORDERS, voxel_order))
+    mask = check_niimg(mask_img, ensure_ndim=3).get_data() != 0
+    coords = np.array(np.nonzero(mask)).T
+    keys = morton_keys(coords) if voxel_order == 'morton' \
+        else hilbert_keys(coords)
+    return np.argsort(keys, kind='mergesort')
@@ -0,0 +1,222 @@
+"""
+Compressed storage of raw (masked) records, as float16 or as int16 with a
+per-voxel scale and offset. Records are decoded to float32 in chunks of
+frames when read.
+"""
+import os
+
+import numpy as np
+
+# Number of frames decoded at once
+CHUNK_SIZE = 64
+
+
+def _scale_filename(filename):
+    return os.path.splitext(filename)[0] + '.scale'
+
+
+def is_scaled(filename):
+    """Whether the raw record filename holds int16 codes with a per-voxel
+    scale and offset"""
+    return os.path.exists(_scale_filename(filename))
+
+
+def decoded_dtype(dtype, scaled=False):
+    """dtype of the decoded data of a record stored with dtype. int16
+    records are only decoded if scaled (see is_scaled)."""
+    dtype = np.dtype(dtype)
+    if dtype == np.float16 or (dtype == np.int16 and scaled):
+        return np.dtype(np.float32)
+    return dtype
+
+
+def save_raw(filename, data, raw_dtype=None):
+    """
+    Save a raw record, possibly quantized.
+
+    Data is written in chunks of frames to a temporary file, renamed to
+    filename once complete, so that filename is either absent or valid.
+
+    Parameters
+    ----------
+    filename: str
+        .npy file to write
+
+    data: ndarray or memmap, shape (n_frames, n_voxels)
+
+    raw_dtype: None, 'float16' or 'int16'
+        Storage type. With 'int16', the data of each voxel is linearly
+        mapped onto the int16 range, and the scale and offset of each
+        voxel are stored next to filename, with a .scale extension.
+    """
+    if raw_dtype is None:
+        dtype = data.dtype
+    elif raw_dtype in ('float16', 'int16'):
+        dtype = np.dtype(raw_dtype)
+    else:
+        raise ValueError("raw_dtype should be None, 'float16' or 'int16',"
+                         " got %r" % raw_dtype)
+    tmp_filename = filename + '.tmp.npy'
+    out = np.lib.format.open_memmap(tmp_filename, mode='w+', dtype=dtype,
+                                    shape=data.shape)
+    if raw_dtype == 'int16':
+        _, scale, offset = quantize(data, out=out)
+        with open(_scale_filename(tmp_filename), 'wb') as f:
+            np.save(f, np.array([scale, offset]))
+    else:
+        for start in range(0, data.shape[0], CHUNK_SIZE):
+            out[start:start + CHUNK_SIZE] = data[start:start + CHUNK_SIZE]
+    out.flush()
+    del out
+    if raw_dtype == 'int16':
+        os.replace(_scale_filename(tmp_filename), _scale_filename(filename))
+    os.replace(tmp_filename, filename)
+
+
+def quantize(data, out=None):
+    """Map each column of data linearly onto the int16 range.
+
+    Parameters
+    ----------
+    data: ndarray, shape (n_frames, n_voxels)
+
+    out: ndarray of int16 or None
+        Buffer to write codes into
+
+    Returns
+    -------
+    codes: ndarray of int16, same shape as data
+
+    scale, offset: ndarray of float32, shape (n_voxels)
+        data ~ codes * scale + offset
+    """
+    max_code = np.iinfo(np.int16).max
+    data_min = data.min(axis=0)
+    data_max = data.max(axis=0)
+    offset = ((data_max + data_min) / 2).astype(np.float32)
+    scale = ((data_max - data_min) / (2 * max_code)).astype(np.float32)
+    scale[scale == 0] = 1
+    if out is None:
+        out = np.empty(data.shape, dtype=np.int16)
+    for start in range(0, data.shape[0], CHUNK_SIZE):
+        chunk = data[start:start + CHUNK_SIZE] - offset
+        chunk /= scale
+        np.clip(np.rint(chunk), -max_code, max_code,
+                out=chunk)
+        out[start:start + CHUNK_SIZE] = chunk
+    return out, scale, offset
+
+
+class QuantizedArray(object):
+    """
+    Read-only access to a compressed record, decoding frames on slicing.
+
+    Parameters
+    ----------
+    codes: ndarray or memmap of float16 or int16
+
+    scale, offset: ndarray, shape (n_voxels) or None
+        Per-voxel scale and offset of int16 codes
+    """
+
+    def __init__(self, codes, scale=None, offset=None):
+        self.codes = codes
+        self.scale = scale
+        self.offset = offset
+        self.dtype = decoded_dtype(codes.dtype, scaled=scale is not None)
+        self.shape = codes.shape
+        self.ndim = codes.ndim
+
+    def __len__(self):
+        return self.shape[0]
+
+    def decode(self, codes, out=None):
+        """Decode frames in chunks, writing into out if provided"""
+        if out is None:
+            out = np.empty(codes.shape, dtype=self.dtype)
+        for start in range(0, codes.shape[0], CHUNK_SIZE):
+            chunk = out[start:start + CHUNK_SIZE]
+            if self.scale is None:
+                chunk[:] = codes[start:start + CHUNK_SIZE]
+            else:
+                np.multiply(codes[start:start + CHUNK_SIZE], self.scale,
+                            out=chunk, casting='unsafe')
+                chunk += self.offset
+        return out
+
+    def decode_rows(self, start, stop, out, rows):
+        """Decode frames [start, stop) into out[rows], through a buffer of
+        at most CHUNK_SIZE frames"""
+        buffer = np.empty((min(CHUNK_SIZE, stop - start), self.shape[1]),
+                          dtype=self.dtype)
+        for chunk_start in range(start, stop, CHUNK_SIZE):
+            chunk_stop = min(chunk_start + CHUNK_SIZE, stop)
+            chunk = self.decode(self.codes[chunk_start:chunk_stop],
+                                out=buffer[:chunk_stop - chunk_start])
+            out[rows[chunk_start - start:chunk_stop - start]] = chunk
+        return out
+
+    def __getitem__(self, index):
+        codes = self.codes[index]
+        if codes.ndim < 2:
+            codes = codes[np.newaxis]
+            return self.decode(codes)[0]
+        return self.decode(codes)
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.decode(self.codes)
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+        return data
+
+
+def open_raw(filename, mmap_mode='r'):
+    """
+    Open a raw record saved by save_raw.
+
+    Returns
+    -------
+    data: ndarray, memmap or QuantizedArray
+        Plain records are returned as given by np.load, compressed
+        records as a QuantizedArray that decodes frames to float32 when
+        sliced.
+    """
+    codes = np.load(filename, mmap_mode=mmap_mode)
+    if codes.dtype == np.float16:
+        return QuantizedArray(codes)
+    if codes.dtype == np.int16 and is_scaled(filename):
+        scale, offset = np.load(_scale_filename(filename))
+        return QuantizedArray(codes, scale, offset)
+    return codes
+
+
+def load_raw(filename, mmap_mode=None, out=None):
+    """
+    Load a raw record saved by save_raw, decoding compressed records.
+
+    Parameters
+    ----------
+    filename: str
+
+    mmap_mode: str or None
+        Memory-map plain records. Compressed records are always decoded in
+        memory.
+
+    out: ndarray or None
+        Buffer of shape (n_frames, n_voxels) to decode compressed records
+        into
+
+    Returns
+    -------
+    data: ndarray
+    """
+    data = open_raw(filename, mmap_mode='r' if mmap_mode is None
+                    else mmap_mode)
+    if isinstance(data, QuantizedArray):
+        return data.decode(data.codes, out=out)
+    if mmap_mode is None:
+        if out is not None:
+            out[:] = data
+            return out
+        return np.array(data)
+    return data
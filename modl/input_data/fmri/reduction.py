@@ -0,0 +1,153 @@
+"""
+Temporal reduction of fMRI records: each record X, shape (n_frames,
+n_voxels), is replaced by the projection U^T X of its frames on their
+n_components leading temporal singular vectors U. The reduced record holds
+n_components samples S V^T, scaled by the singular values S, so that its
+spatial covariance is that of X restricted to its leading components.
+
+Reduced records are cached as .npy files next to the raw records they are
+computed from (in the directory of unmasked records or of a raw store), or
+in the directory of a MaskedDataCache for Nifti images.
+"""
+import os
+
+import numpy as np
+from nilearn._utils.class_inspect import get_params
+from scipy import linalg
+from sklearn.externals.joblib import Parallel, delayed, \
+    hash as joblib_hash
+
+from modl.input_data.fmri.cache import _IGNORED_PARAMS, _confounds_key, \
+    mask_record
+from modl.input_data.fmri.quantize import save_raw
+from modl.input_data.fmri.store import RawRecord
+
+
+def reduce_signals(signals, n_components):
+    """
+    Projection of signals on their leading temporal singular vectors.
+
+    Parameters
+    ----------
+    signals: ndarray, shape (n_frames, n_voxels)
+
+    n_components: int
+
+    Returns
+    -------
+    reduced: ndarray, shape (min(n_components, n_frames), n_voxels)
+        U^T signals, where U holds the leading left singular vectors of
+        signals
+    """
+    signals = np.asarray(signals)
+    dtype = signals.dtype if signals.dtype.kind == 'f' else np.float32
+    n_components = min(n_components, signals.shape[0])
+    # Temporal Gram matrix, small compared to signals
+    gram = signals.dot(signals.T).astype(np.float64)
+    _, U = linalg.eigh(gram)
+    U = U[:, ::-1][:, :n_components].astype(dtype)
+    return np.ascontiguousarray(U.T.dot(signals), dtype=dtype)
+
+
+def _reduction_key(masker, confounds, n_components):
+    """Hash of the preprocessing of reduced records"""
+    params = get_params(masker.__class__, masker,
+                        ignore=_IGNORED_PARAMS + ['mask_img'])
+    mask = np.asarray(masker.mask_img_.get_data())
+    return joblib_hash((sorted(params.items()), mask,
+                        _confounds_key(confounds), n_components))[:12]
+
+
+def reduced_filename(img, key, cachedir=None):
+    """
+    Cache file of the reduced version of img, or None if img is not
+    linked to a file or is a Nifti image and cachedir is None.
+
+    Raw records are reduced next to them, records of raw stores next to
+    the store, and Nifti images in cachedir.
+    """
+    if isinstance(img, RawRecord):
+        return '%s-%i-%i.svd-%s.npy' % (os.path.splitext(img.filename)[0],
+                                        img.start, img.stop, key)
+    if not isinstance(img, str):
+        get_filename = getattr(img, 'get_filename', None)
+        img = get_filename() if get_filename is not None else None
+        if img is None:
+            return None
+    if img.endswith('.npy'):
+        return '%s.svd-%s.npy' % (os.path.splitext(img)[0], key)
+    if cachedir is None:
+        return None
+    return os.path.join(cachedir, '%s.svd-%s.npy'
+                        % (joblib_hash(os.path.abspath(img)), key))
+
+
+def _source_filename(img):
+    if isinstance(img, RawRecord):
+        return img.filename
+    if isinstance(img, str):
+        return img
+    return img.get_filename()
+
+
+def _reduce_record(masker, img, confounds, n_components, filename=None,
+                   data_cache=None, overwrite=False):
+    if (filename is not None and not overwrite and
+            os.path.exists(filename) and os.path.getmtime(filename) >=
+            os.path.getmtime(_source_filename(img))):
+        return filename
+    data = mask_record(masker, img, confounds, data_cache=data_cache)
+    reduced = reduce_signals(data, n_components)
+    if filename is None:
+        return reduced
+    save_raw(filename, reduced)
+    return filename
+
+
+def reduce_records(masker, imgs, confounds=None, n_components=50,
+                   n_jobs=1, data_cache=None, overwrite=False):
+    """
+    Reduce records in parallel, caching reduced records.
+
+    Parameters
+    ----------
+    masker: MultiNiftiMasker or MultiRawMasker, fitted
+        Used to mask and clean records before their reduction
+
+    imgs: list of Niimg-like objects, raw record filenames or RawRecord
+
+    confounds: list of confounds or None
+
+    n_components: int
+        Number of temporal components kept per record
+
+    n_jobs: int
+        Number of records reduced in parallel
+
+    data_cache: MaskedDataCache or None
+        Used to mask Nifti images, and to cache their reduced records
+
+    overwrite: boolean
+        Reduce records even if they are cached
+
+    Returns
+    -------
+    reduced_imgs: list of str or ndarray
+        Filenames of reduced records, or arrays for records that cannot be
+        cached. They are masked and cleaned: they should be loaded by a
+        MultiRawMasker without temporal preprocessing.
+    """
+    if confounds is None:
+        confounds = [None] * len(imgs)
+    cachedir = data_cache.cachedir if data_cache is not None else None
+    filenames = [reduced_filename(img,
+                                  _reduction_key(masker, these_confounds,
+                                                 n_components),
+                                  cachedir=cachedir)
+                 for img, these_confounds in zip(imgs, confounds)]
+    return Parallel(n_jobs=n_jobs)(
+        delayed(_reduce_record)(masker, img, these_confounds, n_components,
+                                filename=filename, data_cache=data_cache,
+                                overwrite=overwrite)
+        for img, these_confounds, filename in zip(imgs, confounds,
+                                                  filenames))
@@ -0,0 +1,98 @@
+"""
+Coarse grids of masks, for coarse-to-fine learning.
+
+A mask is downsampled by an integer factor by grouping native voxels into
+cubic cells of factor ** 3 voxels. The coarse grid is described by an affine
+with voxel sizes scaled by factor, centered on cells, so that coarse images
+can be handled by maskers (as a target_affine). Masked data is brought to
+the coarse grid by summing voxels of each cell, and coarse maps are brought
+back to the native grid by assigning cell values to their voxels, both
+scaled so that the operator is orthonormal (see pooling_matrix).
+"""
+import nibabel
+import numpy as np
+import scipy.sparse as sp
+from nilearn._utils import check_niimg
+
+
+def coarse_affine(affine, factor):
+    """Affine of the grid of cells of factor ** 3 voxels, whose voxel
+    (0, 0, 0) is centered on the cell of native voxels [0, factor) ** 3"""
+    affine = np.array(affine, dtype=np.float64)
+    new_affine = affine.copy()
+    new_affine[:3, :3] *= factor
+    new_affine[:3, 3] = affine[:3].dot(
+        np.array([(factor - 1) / 2] * 3 + [1]))
+    return new_affine
+
+
+def downsample_mask(mask_img, factor):
+    """
+    Coarse version of a mask, in which a cell is kept if it contains at
+    least one voxel of the mask.
+
+    Parameters
+    ----------
+    mask_img: Niimg-like object
+        Native 3D mask
+
+    factor: int
+        Downsampling factor along each axis
+
+    Returns
+    -------
+    coarse_mask_img: Nifti1Image
+        Coarse mask, with affine coarse_affine(mask_img.affine, factor)
+
+    labels: ndarray, shape (n_voxels)
+        Index of the cell of each voxel of the native mask, among voxels of
+        the coarse mask (in the order of masked data)
+    """
+    factor = int(factor)
+    if factor < 1:
+        raise ValueError('Downsampling factor should be a positive integer,'
+                         ' got %r' % factor)
+    mask_img = check_niimg(mask_img, ensure_ndim=3)
+    mask = mask_img.get_data() != 0
+    coords = np.array(np.nonzero(mask)) // factor
+    shape = tuple(-(-np.array(mask.shape) // factor))
+    coarse_mask = np.zeros(shape, dtype=bool)
+    coarse_mask[tuple(coords)] = True
+    # Index of coarse voxels in masked data order
+    index = np.cumsum(coarse_mask.ravel()).reshape(shape) - 1
+    labels = index[tuple(coords)]
+    coarse_mask_img = nibabel.Nifti1Image(coarse_mask.astype(np.int8),
+                                          coarse_affine(mask_img.affine,
+                                                        factor))
+    return coarse_mask_img, labels
+
+
+def pooling_matrix(labels, n_cells=None, dtype=np.float64):
+    """
+    Orthonormal operator from the coarse grid to masked voxels.
+
+    Parameters
+    ----------
+    labels: ndarray, shape (n_voxels)
+        Cell of each native voxel, as returned by downsample_mask
+
+    n_cells: int or None
+        Number of cells, defaults to labels.max() + 1
+
+    Returns
+    -------
+    pooling: csr_matrix, shape (n_voxels, n_cells)
+        X.dot(pooling) sums masked data X over cells, scaled by the inverse
+        square root of the number of voxels of cells, and
+        pooling.dot(maps.T).T assigns the values of coarse maps, scaled
+        likewise, to the voxels of their cells. Its columns are orthonormal,
+        so that pooling preserves the norm of data constant over cells, and
+        the scale of the penalties of the learning problem.
+    """
+    n_voxels = labels.shape[0]
+    if n_cells is None:
+        n_cells = labels.max() + 1 if n_voxels > 0 else 0
+    counts = np.bincount(labels, minlength=n_cells)
+    return sp.csr_matrix((1. / np.sqrt(counts[labels]).astype(dtype),
+                          (np.arange(n_voxels), labels)),
+                         shape=(n_voxels, n_cells))
@@ -5,17 +5,28 @@ import traceback
 from itertools import repeat
 from os.path import join
 
-import numpy as np
 import pandas as pd
 from nilearn._utils import check_niimg
-from nilearn.input_data import MultiNiftiMasker
 from sklearn.externals.joblib import Memory, Parallel, delayed
 
+from modl.input_data.fmri.gzindex import load_indexed
+from modl.input_data.fmri.manifest import load_manifest, write_manifest
+from modl.input_data.fmri.quantize import save_raw
+from modl.input_data.fmri.slabs import acquire_lock, can_unmask_slabs, \
+    release_lock, remove_partial, unmask_slabs
+from modl.input_data.fmri.store import RawStore, create_raw_store
 from modl.input_data.fmri.unmask import MultiRawMasker
 
 
 def _unmask_single_img(masker, imgs, confounds, root,
-                       raw_dir, mock=False, overwrite=False):
+                       raw_dir, mock=False, overwrite=False,
+                       raw_dtype=None, slab_size=None, gzip_n_jobs=None):
+    if (isinstance(imgs, str) and imgs.endswith('.nii.gz') and
+            (gzip_n_jobs is not None or slab_size is not None)):
+        # Slabs read from a plain gzip stream would inflate it from the
+        # start for each slab
+        imgs = load_indexed(imgs, n_jobs=1 if gzip_n_jobs is None
+                            else gzip_n_jobs)
     imgs = check_niimg(imgs)
     if imgs.get_filename() is None:
         raise ValueError('Provided Nifti1Image should be linked to a file.')
@@ -26,11 +37,25 @@ def _unmask_single_img(masker, imgs, confounds, root,
     print('Saving %s to %s' % (filename, raw_filename))
     if not mock:
         if overwrite or not os.path.exists(raw_filename):
+            if not os.path.exists(dirname):
+                os.makedirs(dirname, exist_ok=True)
+            lock_filename = raw_filename
+            if not acquire_lock(lock_filename):
+                print('File being unmasked by another job: skipping.')
+                return None
             try:
-                data = masker.transform(imgs, confounds=confounds)
-                if not os.path.exists(dirname):
-                    os.makedirs(dirname)
-                np.save(raw_filename, data)
+                if overwrite:
+                    remove_partial(raw_filename)
+                if slab_size is not None and can_unmask_slabs(masker):
+                    # Resumes from the last slab written by an interrupted
+                    # job
+                    unmask_slabs(masker, imgs, raw_filename,
+                                 confounds=confounds, slab_size=slab_size,
+                                 raw_dtype=raw_dtype)
+                else:
+                    data = masker.transform_single_imgs(imgs,
+                                                        confounds=confounds)
+                    save_raw(raw_filename, data, raw_dtype=raw_dtype)
             except EOFError:
                 exc_type, exc_value, exc_traceback = sys.exc_info()
                 msg = '\n'.join(traceback.format_exception(
@@ -40,18 +65,52 @@ def _unmask_single_img(masker, imgs, confounds, root,
                     os.makedirs(dirname)
                 with open(raw_filename, 'w+') as f:
                     f.write(msg)
+            finally:
+                release_lock(lock_filename)
         else:
             print('File already exists: skipping.')
     return raw_filename
 
 
-def get_raw_rest_data(raw_dir):
+def get_raw_rest_data(raw_dir, use_store=False):
+    """
+    Load the masker and the list of records unmasked by
+    create_raw_rest_data.
+
+    Parameters
+    ----------
+    raw_dir: str
+    use_store: boolean
+        Replace record filenames with references to the consolidated raw
+        store (RawRecord), if it was created
+
+    Returns
+    -------
+    masker: MultiRawMasker
+        Its temporal preprocessing is disabled, as records were cleaned
+        when unmasked. It may be enabled to clean records when loaded.
+    unmasked_imgs_list: DataFrame with column filename
+    """
     if not os.path.exists(raw_dir):
         raise ValueError('Unmask directory %s does not exist.'
                          'Unmasking must be done beforehand.' % raw_dir)
     params = json.load(open(join(raw_dir, 'masker.json'), 'r'))
+    # Records were cleaned when unmasked
+    params.update(detrend=False, standardize=False, low_pass=None,
+                  high_pass=None)
     masker = MultiRawMasker(**params)
     unmasked_imgs_list = pd.read_csv(join(raw_dir, 'data.csv'))
+    store_file = join(raw_dir, 'store.npy')
+    if use_store and os.path.exists(store_file):
+        store = RawStore(store_file)
+        records = dict(zip(store.names, store.records()))
+        filenames = [records.get(filename, filename) for filename
+                     in unmasked_imgs_list['filename']]
+        unmasked_imgs_list = unmasked_imgs_list.assign(filename=filenames)
+    # Register record lengths, to avoid opening every file before learning
+    manifest_file = join(raw_dir, 'manifest.json')
+    if os.path.exists(manifest_file):
+        load_manifest(manifest_file)
     return masker, unmasked_imgs_list
 
 
@@ -62,7 +121,12 @@ def create_raw_rest_data(imgs_list,
                          n_jobs=1,
                          mock=False,
                          memory=Memory(cachedir=None),
-                         overwrite=False):
+                         overwrite=False,
+                         consolidate=False,
+                         raw_dtype=None,
+                         slab_size=None,
+                         gzip_n_jobs=None,
+                         voxel_order=None):
     """
 
     Parameters
@@ -74,6 +138,32 @@ def create_raw_rest_data(imgs_list,
     masker_params
     n_jobs
     mock
+    consolidate: boolean
+        Also concatenate all records in a single memory-mappable store
+        (store.npy, indexed by store.json), see get_raw_rest_data
+    raw_dtype: None, 'float16' or 'int16'
+        Store records compressed, as float16 or as int16 with a per-voxel
+        scale and offset (see modl.input_data.fmri.quantize). They are
+        decoded to float32 by MultiRawMasker.
+    slab_size: int or None
+        Unmask images by slabs of slab_size frames, so that memory does not
+        depend on the length of runs. Interrupted jobs resume from their
+        last checkpointed slab, and records are renamed to their final name
+        once complete. .nii.gz images are then read through a gzip index
+        (see gzip_n_jobs). Images are unmasked whole if None, or if the
+        masker filters or resamples images.
+    gzip_n_jobs: int or None
+        If not None, .nii.gz images are read through a gzip seek-point
+        index saved next to them (see modl.input_data.fmri.gzindex), and
+        decompressed in gzip_n_jobs threads within each of the n_jobs
+        processes. Slabs are then read without inflating previous frames.
+        Defaults to 1 thread if slab_size is not None.
+    voxel_order: None, 'morton' or 'hilbert'
+        Store voxels ordered along a space-filling curve instead of the
+        C-order of the mask (see modl.input_data.fmri.ordering). The order
+        is recorded in masker.json, so that the MultiRawMasker returned by
+        get_raw_rest_data reorders Nifti images and inverse transforms maps
+        consistently.
 
     Returns
     -------
@@ -81,9 +171,9 @@ def create_raw_rest_data(imgs_list,
     """
     if masker_params is None:
         masker_params = {}
-    masker = MultiNiftiMasker(verbose=1, memory=memory,
-                              memory_level=1,
-                              **masker_params)
+    masker = MultiRawMasker(verbose=1, memory=memory,
+                            memory_level=1, voxel_order=voxel_order,
+                            **masker_params)
     if masker.mask_img is None:
         masker.fit(imgs_list['filename'])
     else:
@@ -99,10 +189,15 @@ def create_raw_rest_data(imgs_list,
         os.makedirs(raw_dir)
     filenames = Parallel(n_jobs=n_jobs)(delayed(_unmask_single_img)(
         masker, imgs, confounds, root, raw_dir, mock=mock,
-        overwrite=overwrite)
+        overwrite=overwrite, raw_dtype=raw_dtype, slab_size=slab_size,
+        gzip_n_jobs=gzip_n_jobs)
                                         for imgs, confounds in
                                         zip(imgs_list['filename'],
                                             confounds))
+    # Records still being written by concurrent jobs are left out
+    unmasked = [filename is not None for filename in filenames]
+    imgs_list = imgs_list[unmasked]
+    filenames = [filename for filename in filenames if filename is not None]
     imgs_list = imgs_list.rename(columns={'filename': 'orig_filename'})
     imgs_list = imgs_list.assign(filename=filenames)
     imgs_list = imgs_list.assign(confounds=None)
@@ -116,4 +211,10 @@ def create_raw_rest_data(imgs_list,
         params.pop('n_jobs')
         params.pop('verbose')
         params['mask_img'] = mask_img_file
-        json.dump(params, open(os.path.join(raw_dir, 'masker.json'), 'w+'))
\ No newline at end of file
+        json.dump(params, open(os.path.join(raw_dir, 'masker.json'), 'w+'))
+        records = [filename for filename in filenames
+                   if os.path.exists(filename)
+                   and not filename.endswith('-error')]
+        write_manifest(os.path.join(raw_dir, 'manifest.json'), records)
+        if consolidate and records:
+            create_raw_store(os.path.join(raw_dir, 'store.npy'), records)
\ No newline at end of file
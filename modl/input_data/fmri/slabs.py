@@ -0,0 +1,255 @@
+"""
+Unmasking of 4D images by slabs of frames, with memory bounded
+independently of the run length, and resumable after interruption.
+
+Temporal cleaning (linear detrending, confound removal and
+standardization, as done by nilearn.signal.clean) only requires a few
+statistics per voxel, that are accumulated over a first pass on slabs:
+the signal is projected onto an orthonormal basis B of the removed
+regressors (constant, linear trend and confounds), whose coefficients
+A = B^T X are summed slab by slab, along with the sum and the sum of
+squares of the signal. A second pass writes cleaned slabs
+(X - B A - mean) / std.
+
+Progress is checkpointed every few slabs next to the output file, so
+that an interrupted job resumes from the last checkpointed slab. The output
+is renamed to its final name only once complete.
+"""
+import os
+
+import numpy as np
+from nilearn._utils import check_niimg
+from nilearn.image.image import _smooth_array
+
+from modl.input_data.fmri.clean import regressors
+from modl.input_data.fmri.quantize import save_raw
+
+
+def can_unmask_slabs(masker):
+    """Whether the preprocessing of masker can be done by slabs.
+    Temporal filtering and resampling require the whole image."""
+    return (masker.low_pass is None and masker.high_pass is None
+            and masker.target_affine is None
+            and masker.target_shape is None)
+
+
+class _Checkpoint(object):
+    """Progress of the unmasking of one image, stored in a .npz file"""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return None
+        with np.load(self.filename) as state:
+            return {key: state[key] for key in state.files}
+
+    def save(self, **state):
+        tmp_filename = self.filename + '.tmp.npz'
+        np.savez(tmp_filename, **state)
+        os.replace(tmp_filename, self.filename)
+
+    def remove(self):
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+
+
+def _read_slab(img, mask, start, stop, affine, smoothing_fwhm):
+    slab = np.asarray(img.dataobj[..., start:stop])
+    if smoothing_fwhm is not None:
+        slab = _smooth_array(slab, affine, smoothing_fwhm)
+    slab = slab[mask].T
+    if slab.dtype.kind != 'f':
+        slab = slab.astype(np.float32)
+    return slab
+
+
+def unmask_slabs(masker, img, filename, confounds=None, slab_size=100,
+                 raw_dtype=None, checkpoint_every=10):
+    """
+    Mask and clean a 4D image slab by slab, writing the result to
+    filename (.npy).
+
+    The result is equal to masker.transform(img, confounds) up to numerical
+    precision, for maskers without temporal filtering nor resampling
+    (see can_unmask_slabs).
+
+    Parameters
+    ----------
+    masker: fitted MultiNiftiMasker
+        If it has a voxel_order_ permutation (see MultiRawMasker), voxels
+        are written in this order
+
+    img: str or Nifti1Image
+        4D image, linked to a file
+
+    filename: str
+        Output .npy file. Intermediary files are written next to it, with
+        suffixes .part.npy and .state.npz, and removed on completion.
+
+    confounds: CSV file path, 2D array or None
+
+    slab_size: int
+        Number of frames processed at once
+
+    raw_dtype: None, 'float16' or 'int16'
+        Compression of the output, see modl.input_data.fmri.quantize
+
+    checkpoint_every: int
+        Number of slabs processed between checkpoints. Each checkpoint
+        rewrites the accumulated statistics (n_voxels x n_regressors), so
+        that checkpointing every slab is costly for small slabs.
+        Checkpoints are also written at the end of each pass.
+    """
+    img = check_niimg(img)
+    mask = masker.mask_img_.get_data().astype(bool)
+    n_voxels = mask.sum()
+    voxel_order = getattr(masker, 'voxel_order_', None)
+    if voxel_order is not None:
+        # Voxels are gathered directly in voxel order
+        mask = tuple(np.array(np.nonzero(mask))[:, voxel_order])
+    affine = img.affine
+    n_frames = img.shape[3]
+    smoothing_fwhm = masker.smoothing_fwhm
+    if smoothing_fwhm == 0:
+        smoothing_fwhm = None
+    basis = regressors(n_frames, confounds, masker.detrend,
+                       masker.standardize)
+    clean = basis.shape[1] > 0 or masker.standardize
+
+    part_filename = filename + '.part.npy'
+    checkpoint = _Checkpoint(filename + '.state.npz')
+    state = checkpoint.load()
+    if state is None or not os.path.exists(part_filename):
+        state = {'stage': 0, 'frames_done': 0}
+    stage = int(state['stage'])
+
+    def slabs(first_frame):
+        for start in range(first_frame, n_frames, slab_size):
+            stop = min(start + slab_size, n_frames)
+            yield start, stop, _read_slab(img, mask, start, stop, affine,
+                                          smoothing_fwhm)
+
+    if stage == 0:
+        # Allocate the output with the dtype of masked data
+        dtype = _read_slab(img, mask, 0, 1, affine, smoothing_fwhm).dtype
+        part = np.lib.format.open_memmap(part_filename, mode='w+',
+                                         dtype=dtype,
+                                         shape=(n_frames, n_voxels))
+        del part
+        stage = 1 if clean else 2
+        state = {'stage': stage, 'frames_done': 0}
+        if clean:
+            state.update(coef=np.zeros((basis.shape[1], n_voxels)),
+                         sum=np.zeros(n_voxels), sum_sq=np.zeros(n_voxels))
+        checkpoint.save(**state)
+
+    if stage == 1:
+        # Accumulate statistics
+        coef, sum_, sum_sq = state['coef'], state['sum'], state['sum_sq']
+        for i, (start, stop, slab) in enumerate(
+                slabs(int(state['frames_done'])), 1):
+            slab = slab.astype(np.float64)
+            coef += basis[start:stop].T.dot(slab)
+            sum_ += slab.sum(axis=0)
+            sum_sq += np.sum(slab ** 2, axis=0)
+            if i % checkpoint_every == 0:
+                checkpoint.save(stage=1, frames_done=stop, coef=coef,
+                                sum=sum_, sum_sq=sum_sq)
+        state = dict(stage=2, frames_done=0, coef=coef, sum=sum_,
+                     sum_sq=sum_sq)
+        checkpoint.save(**state)
+        stage = 2
+
+    if stage == 2:
+        # Write cleaned slabs
+        part = np.load(part_filename, mmap_mode='r+')
+        if clean:
+            coef = state['coef']
+            if masker.standardize:
+                res_sum = state['sum'] - basis.sum(axis=0).dot(coef)
+                res_sum_sq = state['sum_sq'] - np.sum(coef ** 2, axis=0)
+                mean = res_sum / n_frames
+                norm = np.sqrt(np.maximum(res_sum_sq - n_frames * mean ** 2,
+                                          0))
+                norm[norm < np.finfo(np.float64).eps] = 1
+                std = norm / np.sqrt(n_frames)
+        for i, (start, stop, slab) in enumerate(
+                slabs(int(state['frames_done'])), 1):
+            if clean:
+                slab = slab - basis[start:stop].dot(coef)
+                if masker.standardize:
+                    slab -= mean
+                    slab /= std
+            part[start:stop] = slab
+            if i % checkpoint_every == 0:
+                part.flush()
+                state['frames_done'] = stop
+                checkpoint.save(**state)
+        part.flush()
+        del part
+        state = dict(stage=3)
+        checkpoint.save(**state)
+        stage = 3
+
+    if stage == 3:
+        if raw_dtype is None:
+            os.replace(part_filename, filename)
+        else:
+            save_raw(filename, np.load(part_filename, mmap_mode='r'),
+                     raw_dtype=raw_dtype)
+            os.unlink(part_filename)
+        checkpoint.remove()
+    return filename
+
+
+def acquire_lock(filename):
+    """Create filename.lock holding the pid of this process. Returns False
+    if the lock is held by another running process of this host."""
+    lock_filename = filename + '.lock'
+    while True:
+        try:
+            fd = os.open(lock_filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(lock_filename, 'r') as f:
+                    content = f.read()
+            except FileNotFoundError:
+                continue
+            try:
+                pid = int(content)
+            except ValueError:
+                # Lock being written by another process
+                return False
+            if pid == os.getpid():
+                return True
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                # Stale lock from an interrupted job
+                try:
+                    os.unlink(lock_filename)
+                except OSError:
+                    pass
+                continue
+            except PermissionError:
+                pass
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(os.getpid()))
+        return True
+
+
+def release_lock(filename):
+    try:
+        os.unlink(filename + '.lock')
+    except OSError:
+        pass
+
+
+def remove_partial(filename):
+    """Remove intermediary files of an interrupted unmask_slabs"""
+    for suffix in ['.part.npy', '.state.npz']:
+        if os.path.exists(filename + suffix):
+            os.unlink(filename + suffix)
@@ -0,0 +1,256 @@
+"""
+Consolidated storage of raw (masked) records: a single memory-mappable
+.npy file holding the frames of all records, and a json index of the
+frame range of each record.
+
+Compressed records (see modl.input_data.fmri.quantize) are stored
+compressed, the per-voxel scales and offsets of int16 records being stored
+next to the data file, with a .scale extension.
+"""
+import json
+import os
+
+import numpy as np
+
+from modl.input_data.fmri.quantize import open_raw, QuantizedArray, \
+    _scale_filename
+
+
+# Opened stores: filename -> ((mtime, size), (memmap, offsets, scales))
+_opened = {}
+
+
+def _index_filename(filename):
+    return os.path.splitext(filename)[0] + '.json'
+
+
+def _load_scales(filename):
+    """Scales and offsets of the records of an int16 store, of shape
+    (n_records, 2, n_voxels), or None"""
+    if not os.path.exists(_scale_filename(filename)):
+        return None
+    with open(_scale_filename(filename), 'rb') as f:
+        return np.load(f)
+
+
+def open_store_data(filename):
+    """Read-only memory map of a store data file, record offsets and
+    scales (see _load_scales), kept open across calls unless the file is
+    modified"""
+    stat = os.stat(filename)
+    key = stat.st_mtime, stat.st_size
+    cached = _opened.get(filename)
+    if cached is None or cached[0] != key:
+        with open(_index_filename(filename), 'r') as f:
+            offsets = np.array(json.load(f)['offsets'], dtype='int')
+        cached = key, (np.load(filename, mmap_mode='r'), offsets,
+                       _load_scales(filename))
+        _opened[filename] = cached
+    return cached[1]
+
+
+def _wrap_codes(codes, scales, offsets, start):
+    """Frames of codes, starting at frame start of a store, wrapped in a
+    QuantizedArray if compressed"""
+    if scales is not None:
+        record = np.searchsorted(offsets, start, side='right') - 1
+        scale, offset = scales[record]
+        return QuantizedArray(codes, scale, offset)
+    if codes.dtype == np.float16:
+        return QuantizedArray(codes)
+    return codes
+
+
+class RawRecord(object):
+    """Reference to the frames [start, stop) of a raw store, usable in
+    place of a record filename (e.g. by MultiRawMasker.transform)"""
+    __slots__ = ('filename', 'start', 'stop')
+
+    def __init__(self, filename, start, stop):
+        self.filename = filename
+        self.start = start
+        self.stop = stop
+
+    def open(self):
+        """Frames of the record, as a view on the memory-mapped store, or a
+        QuantizedArray decoding them when sliced if the store is
+        compressed"""
+        data, offsets, scales = open_store_data(self.filename)
+        return _wrap_codes(data[self.start:self.stop], scales, offsets,
+                           self.start)
+
+    def load(self, mmap_mode='r'):
+        """Frames of the record, as a view on the memory-mapped store if
+        mmap_mode is not None, or loaded in memory otherwise. Compressed
+        records are always decoded in memory."""
+        data = self.open()
+        if isinstance(data, QuantizedArray):
+            return data.decode(data.codes)
+        if mmap_mode is None:
+            data = np.array(data)
+        return data
+
+    @property
+    def dtype(self):
+        return self.open().dtype
+
+    @property
+    def n_frames(self):
+        return self.stop - self.start
+
+    def __getstate__(self):
+        return self.filename, self.start, self.stop
+
+    def __setstate__(self, state):
+        self.filename, self.start, self.stop = state
+
+    def __eq__(self, other):
+        return (isinstance(other, RawRecord) and
+                self.__getstate__() == other.__getstate__())
+
+    def __hash__(self):
+        return hash(self.__getstate__())
+
+    def __repr__(self):
+        return 'RawRecord(%r, %i, %i)' % (self.filename, self.start,
+                                          self.stop)
+
+
+class RawStore(object):
+    """
+    Read access to a raw store written by create_raw_store.
+
+    Slicing returns views on the memory-mapped data file, without copy,
+    unless the store is compressed.
+
+    Parameters
+    ----------
+    filename: str
+        Path of the .npy data file of the store
+
+    mmap_mode: str
+        Passed to np.load
+
+    Attributes
+    ----------
+    data: np.memmap, shape (n_frames, n_voxels)
+        Frames of all records, concatenated, possibly compressed
+
+    scales: ndarray, shape (n_records, 2, n_voxels) or None
+        Scale and offset of each voxel of each record, for int16 stores
+
+    names: list of str
+        Name of each record (usually, the filename of the unmasked record)
+
+    offsets: ndarray, shape (n_records + 1)
+        Index of the first frame of each record in data
+    """
+
+    def __init__(self, filename, mmap_mode='r'):
+        self.filename = filename
+        self.data = np.load(filename, mmap_mode=mmap_mode)
+        with open(_index_filename(filename), 'r') as f:
+            index = json.load(f)
+        self.names = index['names']
+        self.offsets = np.array(index['offsets'], dtype='int')
+        self.scales = _load_scales(filename)
+
+    def __len__(self):
+        return len(self.names)
+
+    def record(self, i, start=0, stop=None):
+        """Frames [start, stop) of record i, wrapped in a QuantizedArray if
+        the store is compressed"""
+        n_frames = self.offsets[i + 1] - self.offsets[i]
+        start, stop, _ = slice(start, stop).indices(n_frames)
+        start, stop = self.offsets[i] + start, self.offsets[i] + stop
+        return _wrap_codes(self.data[start:stop], self.scales, self.offsets,
+                           start)
+
+    def __getitem__(self, index):
+        """Frames by global sample index (int, slice or array), decoded if
+        the store is compressed"""
+        codes = self.data[index]
+        if self.scales is None:
+            if codes.dtype == np.float16:
+                return codes.astype(np.float32)
+            return codes
+        frames = np.arange(len(self.data))[index]
+        records = np.searchsorted(self.offsets, frames, side='right') - 1
+        scales = self.scales[records]
+        return codes * scales[..., 0, :] + scales[..., 1, :]
+
+    def records(self):
+        """References to every record of the store"""
+        return [RawRecord(self.filename, start, stop)
+                for start, stop in zip(self.offsets[:-1], self.offsets[1:])]
+
+
+def create_raw_store(filename, records, names=None):
+    """
+    Concatenate raw records into a single store, one record at a time.
+
+    Parameters
+    ----------
+    filename: str
+        Path of the .npy data file to create. The record index is written
+        next to it, with a .json extension.
+
+    records: list of str or ndarray
+        Raw records, as .npy filenames or arrays of shape
+        (n_frames, n_voxels), with the same number of voxels and dtype.
+        Records compressed the same way (see save_raw) are stored
+        compressed. Otherwise, compressed records are decoded.
+
+    names: list of str or None
+        Names of records stored in the index. Defaults to records filenames.
+
+    Returns
+    -------
+    store: RawStore
+    """
+    if names is None:
+        names = [record if isinstance(record, str) else str(i)
+                 for i, record in enumerate(records)]
+    arrays = [open_raw(record) if isinstance(record, str)
+              else record for record in records]
+    if not arrays:
+        raise ValueError('Cannot create a raw store without records.')
+    n_voxels = arrays[0].shape[1]
+    compressed = all(isinstance(array, QuantizedArray) for array in arrays)
+    if compressed:
+        formats = set((array.codes.dtype, array.scale is None)
+                      for array in arrays)
+        compressed = len(formats) == 1
+    if compressed:
+        dtype = arrays[0].codes.dtype
+        scaled = arrays[0].scale is not None
+    else:
+        dtype = arrays[0].dtype
+        scaled = False
+    offsets = np.zeros(len(arrays) + 1, dtype='int')
+    offsets[1:] = np.cumsum([array.shape[0] for array in arrays])
+    data = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                     shape=(offsets[-1], n_voxels))
+    for array, start, stop in zip(arrays, offsets[:-1], offsets[1:]):
+        if array.shape[1] != n_voxels:
+            raise ValueError('Records should have the same number of '
+                             'voxels, got %i and %i' % (n_voxels,
+                                                        array.shape[1]))
+        if compressed:
+            data[start:stop] = array.codes
+        elif isinstance(array, QuantizedArray):
+            array.decode(array.codes, out=data[start:stop])
+        else:
+            data[start:stop] = array
+    data.flush()
+    del data
+    if scaled:
+        scales = np.array([[array.scale, array.offset] for array in arrays])
+        with open(_scale_filename(filename), 'wb') as f:
+            np.save(f, scales)
+    elif os.path.exists(_scale_filename(filename)):
+        os.unlink(_scale_filename(filename))
+    with open(_index_filename(filename), 'w+') as f:
+        json.dump({'names': list(names), 'offsets': offsets.tolist()}, f)
+    return RawStore(filename)
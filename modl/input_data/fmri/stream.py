@@ -0,0 +1,135 @@
+"""
+Streaming of random time-blocks from several raw (masked) records, to
+build mini-batches mixing subjects without loading whole records.
+"""
+import os
+
+import numpy as np
+from sklearn.utils import check_random_state
+
+from modl.input_data.fmri.quantize import open_raw, QuantizedArray
+from modl.input_data.fmri.store import RawRecord
+
+
+def is_raw_record(img):
+    """Whether img is an already masked record: a 2D array, a .npy file or
+    a record of a raw store"""
+    if isinstance(img, str):
+        return os.path.splitext(img)[1] == '.npy'
+    return isinstance(img, (np.ndarray, RawRecord))
+
+
+def make_blocks(n_samples_list, block_size):
+    """
+    Split records into consecutive blocks of frames.
+
+    Parameters
+    ----------
+    n_samples_list: list of int
+        Number of frames in each record
+
+    block_size: int
+        Number of frames in each block (the last block of each record may be
+        shorter)
+
+    Returns
+    -------
+    blocks: ndarray, shape (n_blocks, 3)
+        Each row holds (record, start, stop)
+    """
+    blocks = []
+    for record, n_samples in enumerate(n_samples_list):
+        starts = np.arange(0, n_samples, block_size)
+        stops = np.minimum(starts + block_size, n_samples)
+        blocks.append(np.c_[np.full(len(starts), record), starts, stops])
+    if not blocks:
+        return np.zeros((0, 3), dtype='int')
+    return np.concatenate(blocks).astype('int')
+
+
+def draw_block_groups(n_samples_list, block_size, n_blocks,
+                      n_epochs=1, random_state=None):
+    """
+    Draw, for each epoch, a random partition of all the blocks of all
+    records into groups of n_blocks blocks.
+
+    Random draws are done eagerly, so that groups can be loaded in any
+    order (e.g. in background threads) with reproducible results.
+
+    Returns
+    -------
+    groups: list of (epoch, blocks, seed)
+        blocks is an array of at most n_blocks rows (record, start, stop),
+        seed is used to shuffle the frames of the group once loaded
+    """
+    random_state = check_random_state(random_state)
+    all_blocks = make_blocks(n_samples_list, block_size)
+    groups = []
+    for epoch in range(n_epochs):
+        permutation = random_state.permutation(len(all_blocks))
+        for start in range(0, len(all_blocks), n_blocks):
+            blocks = all_blocks[permutation[start:start + n_blocks]]
+            seed = random_state.randint(np.iinfo(np.int32).max)
+            groups.append((epoch, blocks, seed))
+    return groups
+
+
+def load_blocks(records, blocks, offsets, random_state=None):
+    """
+    Read time-blocks from records, concatenate and shuffle their frames.
+
+    Only the frames of the requested blocks are read from .npy files, that
+    are opened as memory maps. Compressed records (see
+    modl.input_data.fmri.quantize) are decoded to float32, directly into
+    the returned array.
+
+    Parameters
+    ----------
+    records: list of str, ndarray or RawRecord
+        Raw records, as .npy filenames, arrays of shape
+        (n_samples, n_voxels) or records of a raw store. Any container
+        indexable by the record numbers of blocks can be used.
+
+    blocks: ndarray, shape (n_blocks, 3)
+        Rows (record, start, stop) of frames to read
+
+    offsets: ndarray, shape (n_records + 1)
+        Index of the first frame of each record in the whole dataset
+
+    random_state: int or RandomState
+        Used to shuffle the frames. No shuffling if None.
+
+    Returns
+    -------
+    data: ndarray, shape (n_frames, n_voxels)
+
+    sample_indices: ndarray, shape (n_frames)
+        Index of each frame of data in the whole dataset
+    """
+    n_frames = int(np.sum(blocks[:, 2] - blocks[:, 1]))
+    if random_state is not None:
+        permutation = check_random_state(random_state).permutation(n_frames)
+    else:
+        permutation = np.arange(n_frames)
+    data = None
+    sample_indices = np.empty(n_frames, dtype='int')
+    # Blocks frames are written directly at their shuffled position
+    position = 0
+    for record, start, stop in blocks:
+        record_data = records[record]
+        if isinstance(record_data, str):
+            record_data = open_raw(record_data)
+        elif isinstance(record_data, RawRecord):
+            record_data = record_data.open()
+        if data is None:
+            data = np.empty((n_frames, record_data.shape[1]),
+                            dtype=record_data.dtype)
+        dest = permutation[position:position + stop - start]
+        if isinstance(record_data, QuantizedArray):
+            record_data.decode_rows(start, stop, data, dest)
+        else:
+            data[dest] = record_data[start:stop]
+        sample_indices[dest] = np.arange(offsets[record] + start,
+                                         offsets[record] + stop)
+        position += stop - start
+    return data, sample_indices
@@ -6,15 +6,45 @@ from nilearn._utils.compat import _basestring
 from nilearn.input_data import MultiNiftiMasker
 from sklearn.externals.joblib import Memory, Parallel, delayed
 
+from modl.input_data.fmri.clean import clean_signals, needs_cleaning
+from modl.input_data.fmri.ordering import get_voxel_order
+from modl.input_data.fmri.quantize import load_raw
+from modl.input_data.fmri.store import RawRecord
+
+
+def _load_raw(imgs, mmap_mode=None):
+    if isinstance(imgs, RawRecord):
+        return imgs.load(mmap_mode=mmap_mode)
+    if isinstance(imgs, np.ndarray):
+        return imgs
+    return load_raw(imgs, mmap_mode=mmap_mode)
+
 
 class MultiRawMasker(MultiNiftiMasker):
+    """MultiNiftiMasker that also accepts raw (already masked) records:
+    .npy files, arrays or records of a raw store.
+
+    Temporal preprocessing (detrend, standardize, low_pass, high_pass and
+    confounds) is applied to raw records when they are loaded, in place and
+    in n_jobs threads, so that a single unmasked dataset can be used with
+    any temporal preprocessing. Spatial preprocessing (smoothing_fwhm,
+    resampling) is only applied to Nifti images.
+
+    If voxel_order is 'morton' or 'hilbert', voxels are ordered along a
+    space-filling curve (see modl.input_data.fmri.ordering) instead of the
+    C-order of the mask: masked Nifti images are reordered, raw records are
+    expected to be stored in this order (see create_raw_rest_data), and
+    inverse_transform restores the C-order. The permutation is stored in
+    voxel_order_.
+    """
+
     def __init__(self, mask_img=None, smoothing_fwhm=None,
                  standardize=False, detrend=False,
                  low_pass=None, high_pass=None, t_r=None,
                  target_affine=None, target_shape=None,
                  mask_strategy='background', mask_args=None,
                  memory=Memory(cachedir=None), memory_level=0,
-                 n_jobs=1, verbose=0
+                 n_jobs=1, verbose=0, voxel_order=None
                  ):
         # Mask is provided or computed
         MultiNiftiMasker.__init__(self, mask_img=mask_img, n_jobs=n_jobs,
@@ -29,29 +59,66 @@ class MultiRawMasker(MultiNiftiMasker):
                                   memory=memory,
                                   memory_level=memory_level,
                                   verbose=verbose)
+        self.voxel_order = voxel_order
 
     def fit(self, imgs=None, y=None):
-        self.mask_img_ = check_niimg(self.mask_img)
+        if (self.mask_img is None or self.target_affine is not None or
+                self.target_shape is not None):
+            # Mask computed from imgs, or resampled
+            MultiNiftiMasker.fit(self, imgs)
+        else:
+            self.mask_img_ = check_niimg(self.mask_img)
         self.mask_size_ = np.sum(self.mask_img_.get_data() == 1)
+        self.voxel_order_ = get_voxel_order(self.mask_img_, self.voxel_order)
         return self
 
+    def _reorder(self, data):
+        """Masked data of a Nifti image, in voxel order"""
+        if getattr(self, 'voxel_order_', None) is None:
+            return data
+        return data[:, self.voxel_order_]
+
+    def inverse_transform(self, X):
+        self._check_fitted()
+        if getattr(self, 'voxel_order_', None) is not None:
+            X = np.asarray(X)
+            unordered = np.empty_like(X)
+            unordered[..., self.voxel_order_] = X
+            X = unordered
+        return MultiNiftiMasker.inverse_transform(self, X)
+
     def transform_single_imgs(self, imgs, confounds=None, copy=True,
                               mmap_mode=None):
         self._check_fitted()
         if isinstance(imgs, str):
             name, ext = os.path.splitext(imgs)
-            if ext == '.npy':
-                data = np.load(imgs, mmap_mode=mmap_mode)
-            else:
-                return MultiNiftiMasker.transform_single_imgs(self, imgs,
-                                                              confounds=confounds,
-                                                              copy=copy)
-        elif isinstance(imgs, np.ndarray):
-            data = imgs
+            if ext != '.npy':
+                return self._reorder(MultiNiftiMasker.transform_single_imgs(
+                    self, imgs, confounds=confounds, copy=copy))
+        elif not isinstance(imgs, (np.ndarray, RawRecord)):
+            return self._reorder(MultiNiftiMasker.transform_single_imgs(
+                self, imgs, confounds=confounds, copy=copy))
+        return self._load_raw(imgs, confounds=confounds, mmap_mode=mmap_mode)
+
+    def _load_raw(self, imgs, confounds=None, mmap_mode=None,
+                  n_jobs=None):
+        """Load a raw record and clean it in place"""
+        if not needs_cleaning(self, confounds):
+            # Compressed records are decoded to float32
+            data = _load_raw(imgs, mmap_mode=mmap_mode)
         else:
-            return MultiNiftiMasker.transform_single_imgs(self, imgs,
-                                                          confounds=confounds,
-                                                          copy=copy)
+            # Cleaned data is written in memory
+            data = _load_raw(imgs)
+            if isinstance(imgs, np.ndarray):
+                data = data.copy()
+            data = clean_signals(data, confounds=confounds,
+                                 detrend=self.detrend,
+                                 standardize=self.standardize,
+                                 low_pass=self.low_pass,
+                                 high_pass=self.high_pass,
+                                 t_r=self.t_r,
+                                 n_jobs=self.n_jobs if n_jobs is None
+                                 else n_jobs)
         assert (data.ndim == 2 and data.shape[1] == self.mask_size_)
         return data
 
@@ -95,19 +162,28 @@ class MultiRawMasker(MultiNiftiMasker):
                 if ext != '.npy':
                     raw = False
                     break
-            elif not isinstance(imgs, np.ndarray):
+            elif not isinstance(imgs, (np.ndarray, RawRecord)):
                 raw = False
                 break
         if raw:
-            data = Parallel(n_jobs=n_jobs)(delayed(np.load)(imgs,
-                                                            mmap_mode=mmap_mode)
-                                           for imgs in imgs_list)
+            if confounds is None:
+                confounds = [None] * len(imgs_list)
+            if any(needs_cleaning(self, these_confounds)
+                   for these_confounds in confounds):
+                # Records are cleaned one at a time, in n_jobs threads
+                return [self._load_raw(imgs, confounds=these_confounds,
+                                       mmap_mode=mmap_mode, n_jobs=n_jobs)
+                        for imgs, these_confounds in zip(imgs_list,
+                                                         confounds)]
+            data = Parallel(n_jobs=n_jobs)(delayed(_load_raw)(
+                imgs, mmap_mode=mmap_mode) for imgs in imgs_list)
             return data
         else:
-            return MultiNiftiMasker.transform_imgs(self, imgs_list,
+            data = MultiNiftiMasker.transform_imgs(self, imgs_list,
                                                    confounds=confounds,
                                                    copy=copy,
                                                    n_jobs=n_jobs, )
+            return [self._reorder(this_data) for this_data in data]
 
     def transform(self, imgs, confounds=None, mmap_mode=None):
         """ Apply mask, spatial and temporal preprocessing
@@ -128,9 +204,12 @@ class MultiRawMasker(MultiNiftiMasker):
             preprocessed images
         """
         self._check_fitted()
+        # A 2D array is a single record, not a list of records
         if not hasattr(imgs, '__iter__') \
-                or isinstance(imgs, _basestring):
-            return self.transform_single_imgs(imgs, mmap_mode=mmap_mode)
+                or isinstance(imgs, _basestring) \
+                or (isinstance(imgs, np.ndarray) and imgs.ndim == 2):
+            return self.transform_single_imgs(imgs, confounds=confounds,
+                                              mmap_mode=mmap_mode)
         return self.transform_imgs(imgs, confounds, n_jobs=self.n_jobs,
                                    mmap_mode=mmap_mode)
 
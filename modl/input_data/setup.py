@@ -13,6 +13,10 @@ def configuration(parent_package='', top_path=None):
                             sources=['modl/input_data/image_fast.pyx'],
                             include_dirs=[numpy.get_include()]
                             ),
+                  Extension('modl.input_data.fmri.gzip_fast',
+                            sources=['modl/input_data/fmri/gzip_fast.pyx'],
+                            libraries=['z'],
+                            ),
                   ]
     config.add_subpackage('tests')
     config.add_subpackage('fmri')
@@ -0,0 +1,79 @@
+import os
+
+import nibabel
+import numpy as np
+from nilearn.input_data import MultiNiftiMasker
+from numpy.testing import assert_array_equal
+
+from modl.input_data.fmri.cache import MaskedDataCache
+
+
+def _make_imgs(tmpdir, n_imgs=3):
+    rng = np.random.RandomState(0)
+    imgs = []
+    for i in range(n_imgs):
+        data = rng.randn(4, 4, 4, 10).astype('float32')
+        filename = str(tmpdir.join('img_%i.nii.gz' % i))
+        nibabel.Nifti1Image(data, np.eye(4)).to_filename(filename)
+        imgs.append(filename)
+    mask_img = nibabel.Nifti1Image(np.ones((4, 4, 4), dtype='int8'),
+                                   np.eye(4))
+    masker = MultiNiftiMasker(mask_img=mask_img, standardize=True).fit()
+    return imgs, masker
+
+
+def test_cache(tmpdir):
+    imgs, masker = _make_imgs(tmpdir)
+    cache = MaskedDataCache(str(tmpdir.join('cache')))
+    data = cache.transform(masker, imgs[0])
+    assert cache.stats['misses'] == 1
+    cached = cache.transform(masker, imgs[0])
+    assert isinstance(cached, np.memmap)
+    assert_array_equal(cached, data)
+    assert_array_equal(cached, masker.transform(imgs[0]))
+    assert cache.stats['hits'] == 1
+    assert cache.stats['bytes_served'] == data.nbytes
+
+    # Different parameters or confounds
+    masker.set_params(standardize=False)
+    cache.transform(masker, imgs[0])
+    cache.transform(masker, imgs[0], confounds=np.ones((10, 1)))
+    assert cache.stats['misses'] == 3
+
+    # Modified image
+    img = nibabel.load(imgs[0])
+    data = np.asarray(img.dataobj) * 2
+    nibabel.Nifti1Image(data, np.eye(4)).to_filename(imgs[0])
+    os.utime(imgs[0], (0, 0))
+    assert_array_equal(cache.transform(masker, imgs[0]),
+                       masker.transform(imgs[0]))
+    assert cache.stats['misses'] == 4
+
+    # Raw records are not cached
+    assert cache.key(masker, data.reshape(-1, 10).T) is None
+    assert cache.key(masker, str(tmpdir.join('img.npy'))) is None
+    cache.clear()
+    assert cache.nbytes == 0
+
+
+def test_cache_eviction(tmpdir):
+    imgs, masker = _make_imgs(tmpdir)
+    cache = MaskedDataCache(str(tmpdir.join('cache')))
+    cache.transform(masker, imgs[0])
+    (_, size, _), = cache.entries()
+    # Room for two records
+    cache.max_bytes = 2 * size
+    cache.transform(masker, imgs[1])
+    assert cache.stats['evictions'] == 0
+    # Ensure distinct access times
+    for i, (filename, _, _) in enumerate(cache.entries()):
+        os.utime(filename, (i, i))
+    # imgs[0] becomes the most recently used record
+    cache.transform(masker, imgs[0])
+    cache.transform(masker, imgs[2])
+    assert cache.stats['evictions'] == 1
+    assert cache.nbytes == 2 * size
+    cache.transform(masker, imgs[0])
+    assert cache.stats['hits'] == 2
+    cache.transform(masker, imgs[1])
+    assert cache.stats['misses'] == 4
@@ -0,0 +1,71 @@
+import nibabel
+import numpy as np
+import pytest
+from nilearn.input_data import MultiNiftiMasker
+from nilearn.signal import clean
+from numpy.testing import assert_array_almost_equal
+
+from modl.input_data.fmri.clean import clean_signals
+from modl.input_data.fmri.unmask import MultiRawMasker
+
+
+def _make_signals(n_frames=60, n_voxels=50):
+    rng = np.random.RandomState(0)
+    signals = rng.randn(n_frames, n_voxels)
+    signals += np.linspace(0, 3, n_frames)[:, np.newaxis] + 10
+    confounds = rng.randn(n_frames, 2)
+    return signals, confounds
+
+
+@pytest.mark.parametrize("detrend", [False, True])
+@pytest.mark.parametrize("standardize", [False, True])
+@pytest.mark.parametrize("confounds", [False, True])
+@pytest.mark.parametrize("filtering", [False, True])
+def test_clean_signals(detrend, standardize, confounds, filtering):
+    signals, these_confounds = _make_signals()
+    if not confounds:
+        these_confounds = None
+    params = dict(detrend=detrend, standardize=standardize,
+                  confounds=these_confounds)
+    if filtering:
+        params.update(low_pass=0.2, high_pass=0.01, t_r=2)
+    ref = clean(signals.copy(), **params)
+    res = clean_signals(signals, chunk_size=16, n_jobs=2, **params)
+    assert_array_almost_equal(res, ref)
+    # Cleaned in place
+    assert res is signals
+
+
+def test_clean_signals_errors():
+    signals, _ = _make_signals()
+    with pytest.raises(ValueError):
+        clean_signals(signals, low_pass=0.1)
+    with pytest.raises(ValueError):
+        clean_signals(signals, confounds=np.ones((10, 1)))
+
+
+def test_raw_masker_clean(tmpdir):
+    signals, confounds = _make_signals(n_voxels=64)
+    mask_img = nibabel.Nifti1Image(np.ones((4, 4, 4), dtype='int8'),
+                                   np.eye(4))
+    params = dict(mask_img=mask_img, detrend=True, standardize=True)
+    nifti_masker = MultiNiftiMasker(**params).fit()
+    img = nifti_masker.inverse_transform(signals.astype('float32'))
+    record = str(tmpdir.join('record.npy'))
+    np.save(record, MultiRawMasker(mask_img=mask_img).fit().transform(img))
+    raw_masker = MultiRawMasker(n_jobs=2, **params).fit()
+    for mmap_mode in [None, 'r']:
+        data = raw_masker.transform(record, confounds=confounds,
+                                    mmap_mode=mmap_mode)
+        assert_array_almost_equal(
+            data, nifti_masker.transform_single_imgs(img,
+                                                     confounds=confounds),
+            decimal=4)
+    array = np.load(record)
+    data_list = raw_masker.transform([record, array],
+                                     confounds=[None, confounds])
+    assert_array_almost_equal(data_list[0], nifti_masker.transform(img),
+                              decimal=4)
+    assert_array_almost_equal(data_list[1], data, decimal=5)
+    # Raw arrays are not modified
+    assert_array_almost_equal(array, np.load(record))
@@ -0,0 +1,69 @@
+import gzip
+import os
+
+import nibabel
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from modl.input_data.fmri import gzindex
+from modl.input_data.fmri.gzindex import GzipIndex, read_gz, \
+    index_filename, load_indexed
+
+
+@pytest.fixture
+def raw_file(tmpdir):
+    rng = np.random.RandomState(0)
+    raw = (rng.randn(1000000) * 10).astype(np.int16).tobytes()
+    filename = str(tmpdir.join('raw.gz'))
+    with gzip.open(filename, 'wb') as f:
+        f.write(raw)
+    return filename, raw
+
+
+@pytest.mark.parametrize("n_jobs", [1, 3])
+def test_read_gz(raw_file, n_jobs):
+    filename, raw = raw_file
+    index = GzipIndex.build(filename, span=1 << 16)
+    assert index.size == len(raw)
+    assert len(index.in_offsets) > 10
+    for start, stop in [(0, len(raw)), (0, 10), (12345, 1234567),
+                        (len(raw) - 10, len(raw)), (100, 100)]:
+        data = index.read(filename, start, stop, n_jobs=n_jobs)
+        assert data.tobytes() == raw[start:stop]
+
+
+def test_index_persistence(raw_file):
+    filename, raw = raw_file
+    gzindex._indices.clear()
+    out = np.empty(len(raw), dtype=np.uint8)
+    assert read_gz(filename, 0, len(raw), out=out) is out
+    assert out.tobytes() == raw
+    assert os.path.exists(index_filename(filename))
+    gzindex._indices.clear()
+    assert read_gz(filename, 10, 20).tobytes() == raw[10:20]
+    # Modified file
+    with gzip.open(filename, 'wb') as f:
+        f.write(raw[::-1])
+    os.utime(filename, (0, 0))
+    assert read_gz(filename, 10, 20).tobytes() == raw[::-1][10:20]
+
+
+def test_indexed_img(tmpdir):
+    rng = np.random.RandomState(0)
+    data = rng.randn(5, 6, 7, 20).astype(np.float32)
+    filename = str(tmpdir.join('img.nii.gz'))
+    nibabel.Nifti1Image(data, np.eye(4)).to_filename(filename)
+    img = load_indexed(filename, n_jobs=2)
+    assert isinstance(img.dataobj, gzindex.IndexedGzipProxy)
+    assert img.get_filename() == filename
+    assert_array_equal(img.dataobj[..., 3:11], data[..., 3:11])
+    assert_array_equal(img.get_data(), data)
+    assert_array_equal(img.dataobj[1, 2], data[1, 2])
+    # Scaled data
+    img = nibabel.Nifti1Image(data, np.eye(4))
+    img.set_data_dtype(np.int16)
+    img.to_filename(filename)
+    ref = nibabel.load(filename).get_fdata()
+    assert_array_equal(np.asarray(load_indexed(filename).dataobj),
+                       ref)
@@ -0,0 +1,87 @@
+import os
+
+import nibabel
+import numpy as np
+import pandas as pd
+from numpy.testing import assert_array_equal
+
+from modl.input_data.fmri import manifest
+from modl.input_data.fmri.manifest import get_entry, load_manifest, \
+    scan_records
+from modl.input_data.fmri.rest import create_raw_rest_data, \
+    get_raw_rest_data
+from modl.input_data.fmri.store import RawRecord
+
+
+def test_manifest(tmpdir):
+    root = str(tmpdir.mkdir('root'))
+    raw_dir = str(tmpdir.join('raw'))
+    rng = np.random.RandomState(0)
+    filenames = []
+    for i, n_frames in enumerate([5, 7]):
+        filename = os.path.join(root, 'img_%i.nii.gz' % i)
+        data = rng.randn(3, 3, 3, n_frames).astype('float32')
+        nibabel.Nifti1Image(data, np.eye(4)).to_filename(filename)
+        filenames.append(filename)
+    mask_img = nibabel.Nifti1Image(np.ones((3, 3, 3), dtype='int8'),
+                                   np.eye(4))
+    imgs_list = pd.DataFrame(filenames, columns=['filename'])
+    create_raw_rest_data(imgs_list, root, raw_dir,
+                         masker_params=dict(mask_img=mask_img),
+                         consolidate=True)
+
+    manifest._registry.clear()
+    masker, data = get_raw_rest_data(raw_dir)
+    records = list(data['filename'])
+    for record, n_frames in zip(records, [5, 7]):
+        entry = get_entry(record)
+        assert entry['n_frames'] == n_frames
+        array = np.load(record)
+        assert np.dtype(entry['dtype']) == array.dtype
+        with open(record, 'rb') as f:
+            f.seek(entry['offset'])
+            values = np.frombuffer(f.read(), dtype=array.dtype)
+        assert_array_equal(values, array.ravel())
+
+    # Modified files are scanned again
+    np.save(records[0], np.zeros((3, 27)))
+    assert get_entry(records[0]) is None
+    entries = scan_records(records)
+    assert [entry['n_frames'] for entry in entries] == [3, 7]
+    assert get_entry(records[0])['n_frames'] == 3
+
+    entries = load_manifest(os.path.join(raw_dir, 'manifest.json'))
+    assert [entry['filename'] for entry in entries] == records
+
+    # Records of the consolidated store replace files
+    masker, data = get_raw_rest_data(raw_dir, use_store=True)
+    raw_records = list(data['filename'])
+    assert isinstance(raw_records[0], RawRecord)
+    assert [record.n_frames for record in raw_records] == [5, 7]
+    assert_array_equal(masker.fit().transform(raw_records[1]),
+                       np.load(records[1]))
+
+
+def test_locked_records(tmpdir):
+    root = str(tmpdir.mkdir('root'))
+    raw_dir = str(tmpdir.mkdir('raw'))
+    rng = np.random.RandomState(0)
+    filenames = []
+    for i in range(2):
+        filename = os.path.join(root, 'img_%i.nii.gz' % i)
+        data = rng.randn(3, 3, 3, 5).astype('float32')
+        nibabel.Nifti1Image(data, np.eye(4)).to_filename(filename)
+        filenames.append(filename)
+    mask_img = nibabel.Nifti1Image(np.ones((3, 3, 3), dtype='int8'),
+                                   np.eye(4))
+    # First image being unmasked by another running process
+    with open(os.path.join(raw_dir, 'img_0.npy.lock'), 'w') as f:
+        f.write(str(os.getppid()))
+    imgs_list = pd.DataFrame(filenames, columns=['filename'])
+    create_raw_rest_data(imgs_list, root, raw_dir,
+                         masker_params=dict(mask_img=mask_img),
+                         slab_size=2)
+    masker, data = get_raw_rest_data(raw_dir)
+    assert list(data['orig_filename']) == filenames[1:]
+    assert list(data['filename']) == [os.path.join(raw_dir, 'img_1.npy')]
+    assert_array_equal(np.load(data['filename'][0]).shape, (5, 27))
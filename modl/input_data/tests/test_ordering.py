@@ -0,0 +1,96 @@
+import json
+import os
+
+import nibabel
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+
+from modl.input_data.fmri.ordering import get_voxel_order, hilbert_keys, \
+    morton_keys
+from modl.input_data.fmri.rest import create_raw_rest_data, \
+    get_raw_rest_data
+from modl.input_data.fmri.slabs import unmask_slabs
+from modl.input_data.fmri.unmask import MultiRawMasker
+
+
+def _grid(size):
+    return np.array(np.meshgrid(*[np.arange(size)] * 3,
+                                indexing='ij')).reshape(3, -1).T
+
+
+@pytest.mark.parametrize("size", [2, 4, 8])
+def test_curve_keys(size):
+    coords = _grid(size)
+    for keys in (morton_keys(coords), hilbert_keys(coords)):
+        assert_array_equal(np.sort(keys), np.arange(size ** 3))
+    # Consecutive voxels of the Hilbert curve are neighbours
+    path = coords[np.argsort(hilbert_keys(coords))]
+    assert np.all(np.sum(np.abs(np.diff(path, axis=0)), axis=1) == 1)
+    # Morton curve visits octants one after the other
+    path = coords[np.argsort(morton_keys(coords))]
+    octant = size ** 3 // 8
+    assert np.all(path[:octant] < size // 2)
+
+
+def _make_img(tmpdir, n_frames=20):
+    rng = np.random.RandomState(0)
+    data = rng.randn(5, 6, 4, n_frames).astype('float32')
+    filename = str(tmpdir.join('img.nii.gz'))
+    nibabel.Nifti1Image(data, np.eye(4)).to_filename(filename)
+    mask = rng.uniform(size=(5, 6, 4)) > .3
+    mask_img = nibabel.Nifti1Image(mask.astype('int8'), np.eye(4))
+    return filename, mask_img
+
+
+@pytest.mark.parametrize("voxel_order", ['morton', 'hilbert'])
+def test_masker_voxel_order(tmpdir, voxel_order):
+    img, mask_img = _make_img(tmpdir)
+    masker = MultiRawMasker(mask_img=mask_img).fit()
+    ordered_masker = MultiRawMasker(mask_img=mask_img,
+                                    voxel_order=voxel_order,
+                                    detrend=True).fit()
+    order = ordered_masker.voxel_order_
+    assert_array_equal(order, get_voxel_order(mask_img, voxel_order))
+    assert_array_equal(np.sort(order), np.arange(masker.mask_size_))
+    masker.set_params(detrend=True)
+    data = masker.transform(img)
+    ordered_data = ordered_masker.transform(img)
+    assert_array_almost_equal(ordered_data, data[:, order])
+    assert_array_almost_equal(ordered_masker.transform([img])[0],
+                              ordered_data)
+    # Maps come back to their voxels
+    assert_array_equal(ordered_masker.inverse_transform(
+        ordered_data).get_data(), masker.inverse_transform(data).get_data())
+    # Records are unmasked in voxel order
+    filename = str(tmpdir.join('img.npy'))
+    unmask_slabs(ordered_masker, img, filename, slab_size=6)
+    assert_array_almost_equal(np.load(filename), ordered_data, decimal=4)
+    assert_array_almost_equal(ordered_masker.transform(filename),
+                              ordered_data, decimal=4)
+
+    with pytest.raises(ValueError):
+        MultiRawMasker(mask_img=mask_img, voxel_order='spiral').fit()
+
+
+def test_raw_rest_data_voxel_order(tmpdir):
+    root = str(tmpdir.mkdir('root'))
+    raw_dir = str(tmpdir.join('raw'))
+    img, mask_img = _make_img(tmpdir.join('root'))
+    imgs_list = pd.DataFrame([img], columns=['filename'])
+    create_raw_rest_data(imgs_list, root, raw_dir,
+                         masker_params=dict(mask_img=mask_img),
+                         voxel_order='hilbert')
+    with open(os.path.join(raw_dir, 'masker.json'), 'r') as f:
+        assert json.load(f)['voxel_order'] == 'hilbert'
+    masker, data = get_raw_rest_data(raw_dir)
+    masker.fit()
+    record = data['filename'][0]
+    assert_array_almost_equal(masker.transform(record),
+                              masker.transform(img))
+    plain_masker = MultiRawMasker(mask_img=mask_img).fit()
+    assert_array_almost_equal(
+        masker.inverse_transform(masker.transform(record)).get_data(),
+        plain_masker.inverse_transform(
+            plain_masker.transform(img)).get_data())
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+
+from modl.input_data.fmri.quantize import save_raw, open_raw, load_raw, \
+    QuantizedArray, decoded_dtype, is_scaled
+from modl.input_data.fmri.stream import load_blocks
+
+
+@pytest.mark.parametrize("raw_dtype", [None, 'float16', 'int16'])
+def test_save_raw(tmpdir, raw_dtype):
+    rng = np.random.RandomState(0)
+    data = (rng.randn(150, 20) * rng.uniform(0, 10, 20)).astype('float32')
+    data[:, 0] = 1
+    filename = str(tmpdir.join('record.npy'))
+    save_raw(filename, data, raw_dtype=raw_dtype)
+
+    raw = open_raw(filename)
+    assert raw.shape == data.shape
+    assert raw.dtype == np.float32
+    if raw_dtype is None:
+        assert not isinstance(raw, QuantizedArray)
+        decimal = 6
+    else:
+        assert isinstance(raw, QuantizedArray)
+        decimal = 2
+    scale = np.abs(data).max(axis=0)
+    assert_array_almost_equal(raw[10:90] / scale, data[10:90] / scale,
+                              decimal=decimal)
+    assert_array_almost_equal(raw[3] / scale, data[3] / scale,
+                              decimal=decimal)
+    out = np.empty_like(data)
+    res = load_raw(filename, out=out)
+    assert res is out
+    assert_array_almost_equal(out / scale, data / scale, decimal=decimal)
+    assert_array_equal(np.asarray(raw), out)
+
+    X, sample_indices = load_blocks([filename], np.array([[0, 20, 60]]),
+                                    np.array([0, 150]), random_state=0)
+    assert X.dtype == np.float32
+    assert_array_equal(X, out[sample_indices])
+
+
+def test_decoded_dtype(tmpdir):
+    filename = str(tmpdir.join('record.npy'))
+    np.save(filename, np.arange(12, dtype='int16').reshape(3, 4))
+    assert not is_scaled(filename)
+    assert decoded_dtype(np.int16, scaled=is_scaled(filename)) == np.int16
+    assert load_raw(filename).dtype == np.int16
+    save_raw(filename, np.ones((3, 4), dtype='float32'), raw_dtype='int16')
+    assert is_scaled(filename)
+    assert decoded_dtype(np.int16, scaled=is_scaled(filename)) == np.float32
+    assert decoded_dtype(np.float16) == np.float32
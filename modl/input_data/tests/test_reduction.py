@@ -0,0 +1,69 @@
+import os
+
+import nibabel
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+
+from modl.input_data.fmri.reduction import reduce_records, reduce_signals
+from modl.input_data.fmri.store import create_raw_store
+from modl.input_data.fmri.unmask import MultiRawMasker
+
+
+def _make_records(n_records=3, n_frames=30, n_voxels=40):
+    rng = np.random.RandomState(0)
+    maps = rng.randn(3, n_voxels)
+    return [(rng.randn(n_frames, 3).dot(maps) +
+             0.01 * rng.randn(n_frames, n_voxels)).astype(np.float32)
+            for _ in range(n_records)]
+
+
+def _make_masker(n_voxels=40):
+    mask_img = nibabel.Nifti1Image(np.ones((n_voxels, 1, 1), dtype=np.int8),
+                                   np.eye(4))
+    return MultiRawMasker(mask_img=mask_img).fit()
+
+
+def test_reduce_signals():
+    signals = _make_records(n_records=1)[0].astype(np.float64)
+    reduced = reduce_signals(signals, 5)
+    assert reduced.shape == (5, signals.shape[1])
+    _, S, V = np.linalg.svd(signals, full_matrices=False)
+    # Leading components, scaled by singular values
+    assert_array_almost_equal(np.abs(reduced), np.abs(S[:5, np.newaxis] *
+                                                      V[:5]))
+    assert reduce_signals(signals[:3], 5).shape == (3, signals.shape[1])
+
+
+def test_reduce_records(tmpdir):
+    masker = _make_masker()
+    records = _make_records()
+    filenames = []
+    for i, record in enumerate(records):
+        filename = str(tmpdir.join('record_%i.npy' % i))
+        np.save(filename, record)
+        filenames.append(filename)
+    store_records = create_raw_store(str(tmpdir.join('store.npy')),
+                                     filenames).records()
+    reduced = reduce_records(masker, filenames, n_components=4, n_jobs=2)
+    for reduced_filename, record in zip(reduced, records):
+        assert os.path.dirname(reduced_filename) == str(tmpdir)
+        assert_array_almost_equal(np.load(reduced_filename),
+                                  reduce_signals(record, 4), decimal=4)
+    # Reduced records are cached
+    mtimes = [os.path.getmtime(filename) for filename in reduced]
+    assert reduce_records(masker, filenames, n_components=4) == reduced
+    assert mtimes == [os.path.getmtime(filename) for filename in reduced]
+    # Preprocessing is part of the key of reduced records
+    masker.set_params(standardize=True)
+    assert not set(reduce_records(masker, filenames,
+                                  n_components=4)) & set(reduced)
+
+    masker.set_params(standardize=False)
+    reduced_store = reduce_records(masker, store_records, n_components=4)
+    for filename, store_filename in zip(reduced, reduced_store):
+        assert_array_almost_equal(np.load(filename),
+                                  np.load(store_filename))
+    # Arrays are reduced in memory
+    reduced_arrays = reduce_records(masker, records, n_components=4)
+    for filename, array in zip(reduced, reduced_arrays):
+        assert_array_almost_equal(np.load(filename), array)
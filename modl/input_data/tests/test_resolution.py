@@ -0,0 +1,48 @@
+import nibabel
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+
+from modl.input_data.fmri.resolution import downsample_mask, \
+    pooling_matrix
+
+
+def _make_mask():
+    rng = np.random.RandomState(0)
+    mask = rng.uniform(size=(9, 8, 6)) > .3
+    affine = np.diag([3., 2., 2.5, 1.])
+    affine[:3, 3] = [-10, 4, 7]
+    return nibabel.Nifti1Image(mask.astype(np.int8), affine)
+
+
+def test_downsample_mask():
+    mask_img = _make_mask()
+    coarse_mask_img, labels = downsample_mask(mask_img, 2)
+    assert coarse_mask_img.shape == (5, 4, 3)
+    n_cells = np.sum(coarse_mask_img.get_data())
+    assert_array_equal(np.unique(labels), np.arange(n_cells))
+    pooling = pooling_matrix(labels)
+    assert pooling.shape == (labels.shape[0], n_cells)
+    assert_array_almost_equal(pooling.T.dot(pooling).toarray(),
+                              np.eye(n_cells))
+    # Pooling upsampled maps gives back the maps
+    rng = np.random.RandomState(0)
+    maps = rng.randn(3, n_cells)
+    assert_array_almost_equal(pooling.T.dot(pooling.dot(maps.T)).T, maps)
+
+
+def test_downsample_mask_affine():
+    # Coarse voxels are centered on their cells
+    mask_img = _make_mask()
+    coarse_mask_img, labels = downsample_mask(mask_img, 2)
+    coords = np.array(np.nonzero(mask_img.get_data()))
+    coarse_coords = np.array(np.nonzero(coarse_mask_img.get_data()))
+    affine = mask_img.affine
+    coarse_affine = coarse_mask_img.affine
+    coarse_coords_world = coarse_affine[:3, :3].dot(coarse_coords) \
+        + coarse_affine[:3, 3:]
+    # Voxels at the corner of their cell
+    corner = np.all(coords % 2 == 0, axis=0)
+    coords_world = affine[:3, :3].dot(coords[:, corner] + .5) \
+        + affine[:3, 3:]
+    assert_array_almost_equal(coarse_coords_world[:, labels[corner]],
+                              coords_world)
@@ -0,0 +1,124 @@
+import os
+
+import nibabel
+import numpy as np
+import pytest
+from nilearn.input_data import MultiNiftiMasker
+from numpy.testing import assert_array_almost_equal
+
+from modl.input_data.fmri import slabs
+from modl.input_data.fmri.gzindex import load_indexed
+from modl.input_data.fmri.slabs import unmask_slabs, acquire_lock, \
+    release_lock
+
+
+def _make_img(tmpdir, n_frames=53):
+    rng = np.random.RandomState(0)
+    data = rng.randn(4, 4, 4, n_frames).astype('float32')
+    data += np.linspace(0, 3, n_frames)
+    data += 100
+    filename = str(tmpdir.join('img.nii.gz'))
+    nibabel.Nifti1Image(data, np.eye(4)).to_filename(filename)
+    mask = np.zeros((4, 4, 4), dtype='int8')
+    mask[1:, :3] = 1
+    mask_img = nibabel.Nifti1Image(mask, np.eye(4))
+    return filename, mask_img
+
+
+@pytest.mark.parametrize("detrend", [False, True])
+@pytest.mark.parametrize("standardize", [False, True])
+@pytest.mark.parametrize("confounds", [False, True])
+def test_unmask_slabs(tmpdir, detrend, standardize, confounds):
+    img, mask_img = _make_img(tmpdir)
+    if confounds:
+        confounds = np.random.RandomState(1).randn(53, 3)
+    else:
+        confounds = None
+    masker = MultiNiftiMasker(mask_img=mask_img, detrend=detrend,
+                              standardize=standardize,
+                              smoothing_fwhm=2).fit()
+    filename = str(tmpdir.join('img.npy'))
+    unmask_slabs(masker, img, filename, confounds=confounds, slab_size=10)
+    data = masker.transform_single_imgs(img, confounds=confounds)
+    res = np.load(filename)
+    assert res.dtype == data.dtype
+    assert_array_almost_equal(res, data, decimal=3)
+    assert sorted(os.listdir(str(tmpdir))) == ['img.nii.gz', 'img.npy']
+
+
+def test_unmask_slabs_resume(tmpdir, monkeypatch):
+    img, mask_img = _make_img(tmpdir)
+    masker = MultiNiftiMasker(mask_img=mask_img, detrend=True,
+                              standardize=True).fit()
+    filename = str(tmpdir.join('img.npy'))
+    read_slab = slabs._read_slab
+    n_calls = [0]
+
+    def interrupted_read_slab(*args):
+        n_calls[0] += 1
+        if n_calls[0] == 9:
+            raise KeyboardInterrupt
+        return read_slab(*args)
+
+    # Interrupted during the second pass
+    monkeypatch.setattr(slabs, '_read_slab', interrupted_read_slab)
+    with pytest.raises(KeyboardInterrupt):
+        unmask_slabs(masker, img, filename, slab_size=10,
+                     checkpoint_every=1)
+    assert not os.path.exists(filename)
+    assert os.path.exists(filename + '.part.npy')
+
+    n_calls[0] = 0
+    monkeypatch.setattr(slabs, '_read_slab', lambda *args: (
+        n_calls.__setitem__(0, n_calls[0] + 1) or read_slab(*args)))
+    unmask_slabs(masker, img, filename, slab_size=10, raw_dtype='float16',
+                 checkpoint_every=1)
+    # Only the 5 slabs that were not written are read again
+    assert n_calls[0] == 5
+    assert_array_almost_equal(np.load(filename), masker.transform(img),
+                              decimal=2)
+    assert not os.path.exists(filename + '.part.npy')
+    assert not os.path.exists(filename + '.state.npz')
+
+
+def test_unmask_slabs_checkpoint_every(tmpdir, monkeypatch):
+    img, mask_img = _make_img(tmpdir)
+    masker = MultiNiftiMasker(mask_img=mask_img, detrend=True,
+                              standardize=True).fit()
+    filename = str(tmpdir.join('img.npy'))
+    save = slabs._Checkpoint.save
+    saved = []
+
+    def counted_save(self, **state):
+        saved.append((int(state['stage']), int(state.get('frames_done', 0))))
+        save(self, **state)
+
+    monkeypatch.setattr(slabs._Checkpoint, 'save', counted_save)
+    unmask_slabs(masker, img, filename, slab_size=10, checkpoint_every=4)
+    # Allocation, 1 checkpoint in each pass of 6 slabs, end of each pass
+    assert saved == [(1, 0), (1, 40), (2, 0), (2, 40), (3, 0)]
+    assert_array_almost_equal(np.load(filename), masker.transform(img),
+                              decimal=4)
+
+
+def test_lock(tmpdir):
+    filename = str(tmpdir.join('img.npy'))
+    assert acquire_lock(filename)
+    assert acquire_lock(filename)
+    # Stale lock
+    with open(filename + '.lock', 'w') as f:
+        f.write('999999999')
+    assert acquire_lock(filename)
+    release_lock(filename)
+    assert not os.path.exists(filename + '.lock')
+
+
+def test_unmask_slabs_indexed_gzip(tmpdir):
+    img, mask_img = _make_img(tmpdir)
+    masker = MultiNiftiMasker(mask_img=mask_img, detrend=True,
+                              standardize=True).fit()
+    filename = str(tmpdir.join('img.npy'))
+    unmask_slabs(masker, load_indexed(img, n_jobs=2), filename,
+                 slab_size=10)
+    assert_array_almost_equal(np.load(filename), masker.transform(img),
+                              decimal=4)
@@ -0,0 +1,92 @@
+import pickle
+
+import nibabel
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal, assert_array_almost_equal
+
+from modl.input_data.fmri.quantize import save_raw, load_raw
+from modl.input_data.fmri.store import RawRecord, RawStore, \
+    create_raw_store
+from modl.input_data.fmri.stream import load_blocks
+from modl.input_data.fmri.unmask import MultiRawMasker
+
+
+def _make_records(tmpdir):
+    rng = np.random.RandomState(0)
+    arrays = [rng.randn(n_frames, 27) for n_frames in [5, 7, 3]]
+    records = []
+    for i, array in enumerate(arrays):
+        filename = str(tmpdir.join('record_%i.npy' % i))
+        np.save(filename, array)
+        records.append(filename)
+    records[1] = arrays[1]
+    return arrays, records
+
+
+def test_raw_store(tmpdir):
+    arrays, records = _make_records(tmpdir)
+    filename = str(tmpdir.join('store.npy'))
+    create_raw_store(filename, records)
+    store = RawStore(filename)
+    assert len(store) == 3
+    assert store.names == [records[0], '1', records[2]]
+    assert_array_equal(store.offsets, [0, 5, 12, 15])
+    data = np.concatenate(arrays)
+    assert_array_equal(store[3:9], data[3:9])
+    assert_array_equal(store[[1, 13]], data[[1, 13]])
+    record = store.record(1, 2, 6)
+    assert_array_equal(record, arrays[1][2:6])
+    assert np.shares_memory(record, store.data)
+
+    raw_records = store.records()
+    assert raw_records[2] == RawRecord(filename, 12, 15)
+    assert pickle.loads(pickle.dumps(raw_records[2])) == raw_records[2]
+
+    mask_img = nibabel.Nifti1Image(np.ones((3, 3, 3), dtype='int8'),
+                                   np.eye(4))
+    masker = MultiRawMasker(mask_img=mask_img).fit()
+    assert_array_equal(masker.transform(raw_records[1]), arrays[1])
+    for array, this_array in zip(arrays, masker.transform(raw_records)):
+        assert_array_equal(array, this_array)
+
+    blocks = np.array([[2, 1, 3], [0, 0, 2]])
+    X, sample_indices = load_blocks(raw_records, blocks, store.offsets,
+                                    random_state=0)
+    assert_array_equal(X, data[sample_indices])
+    assert_array_equal(np.sort(sample_indices), [0, 1, 13, 14])
+
+
+@pytest.mark.parametrize("raw_dtype", ['float16', 'int16'])
+def test_compressed_raw_store(tmpdir, raw_dtype):
+    rng = np.random.RandomState(0)
+    records = []
+    for i, n_frames in enumerate([5, 7, 3]):
+        filename = str(tmpdir.join('record_%i.npy' % i))
+        save_raw(filename, rng.randn(n_frames, 27).astype('float32') * i,
+                 raw_dtype=raw_dtype)
+        records.append(filename)
+    data = np.concatenate([load_raw(record) for record in records])
+    filename = str(tmpdir.join('store.npy'))
+    store = create_raw_store(filename, records)
+    # Records are stored compressed
+    assert store.data.dtype == np.dtype(raw_dtype)
+    assert_array_almost_equal(store[3:9], data[3:9])
+    assert_array_almost_equal(store[[1, 13]], data[[1, 13]])
+    assert_array_almost_equal(store.record(1, 2, 6)[:], data[7:11])
+
+    raw_records = store.records()
+    assert raw_records[1].dtype == np.float32
+    assert_array_almost_equal(raw_records[1].load(), data[5:12])
+    blocks = np.array([[2, 1, 3], [0, 0, 2], [1, 0, 7]])
+    X, sample_indices = load_blocks(raw_records, blocks, store.offsets,
+                                    random_state=0)
+    assert X.dtype == np.float32
+    assert_array_almost_equal(X, data[sample_indices])
+
+    # Mixed compressions are decoded
+    records[1] = data[5:12]
+    store = create_raw_store(filename, records)
+    assert store.data.dtype == np.float32
+    assert store.scales is None
+    assert_array_almost_equal(store[:], data)
@@ -0,0 +1,39 @@
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from modl.input_data.fmri.stream import make_blocks, draw_block_groups, \
+    load_blocks
+
+
+def test_make_blocks():
+    blocks = make_blocks([5, 3], 2)
+    assert_array_equal(blocks, [[0, 0, 2], [0, 2, 4], [0, 4, 5],
+                                [1, 0, 2], [1, 2, 3]])
+
+
+def test_load_blocks(tmpdir):
+    n_samples_list = [7, 5, 9]
+    offsets = np.zeros(len(n_samples_list) + 1, dtype='int')
+    offsets[1:] = np.cumsum(n_samples_list)
+    data = np.arange(offsets[-1] * 2, dtype='float').reshape(-1, 2)
+    records = []
+    for i in range(len(n_samples_list)):
+        filename = str(tmpdir.join('record_%i.npy' % i))
+        np.save(filename, data[offsets[i]:offsets[i + 1]])
+        records.append(filename)
+    records[1] = data[offsets[1]:offsets[2]]
+
+    groups = draw_block_groups(n_samples_list, 3, 2, n_epochs=2,
+                               random_state=0)
+    for epoch in range(2):
+        seen = []
+        for this_epoch, blocks, seed in groups:
+            if this_epoch != epoch:
+                continue
+            assert len(blocks) <= 2
+            X, sample_indices = load_blocks(records, blocks, offsets,
+                                            random_state=seed)
+            assert_array_equal(X, data[sample_indices])
+            seen.append(sample_indices)
+        assert_array_equal(np.sort(np.concatenate(seen)),
+                           np.arange(offsets[-1]))
@@ -14,3 +14,13 @@ cpdef void enet_projection(floating[:] v, floating[:] out, floating radius,
 
 cpdef void enet_scale(floating[:] X,
                               floating l1_ratio, floating radius=*) nogil
+
+cpdef void enet_projection_rows(floating[:, :] V, floating[:, :] out,
+                                floating[:] radius, floating l1_ratio,
+                                int n_threads=*)
+
+cpdef void enet_norm_rows(floating[:, :] V, floating[:] out,
+                          floating l1_ratio, int n_threads=*)
+
+cpdef void enet_scale_rows(floating[:, :] X, floating l1_ratio,
+                           floating[:] radius, int n_threads=*)
@@ -13,6 +13,8 @@ for sparse coding (http://www.di.ens.fr/sierra/pdfs/icml09.pdf)
 from libc.math cimport sqrt, fabs
 
 from cython cimport floating
+from cython cimport view
+from cython.parallel cimport prange, threadid
 
 cdef inline floating positive(floating a) nogil:
     if a > 0:
@@ -28,17 +30,20 @@ cdef inline floating sign(floating a) nogil:
         return -1.
 
 
-cdef inline void swap(floating[:] b, unsigned int i, unsigned int j,
-                      floating * buf) nogil:
-    buf[0] = b[i]
-    b[i] = b[j]
-    b[j] = buf[0]
+cdef inline void swap(floating* b, int stride, unsigned int i,
+                      unsigned int j, floating * buf) nogil:
+    buf[0] = b[i * stride]
+    b[i * stride] = b[j * stride]
+    b[j * stride] = buf[0]
     return
 
 
-cpdef void enet_projection(floating[:] v, floating[:] out, floating radius,
-                             floating l1_ratio) nogil:
-    cdef unsigned int m = v.shape[0]
+cdef void _enet_projection(floating* v, int v_stride,
+                           floating* out, int out_stride,
+                           unsigned int m, floating radius,
+                           floating l1_ratio) nogil:
+    """Project v onto the elastic-net ball of given radius. out must not
+    alias v, as it is used as workspace"""
     cdef unsigned int i
     cdef unsigned int j
     cdef unsigned int size_U
@@ -56,29 +61,31 @@ cpdef void enet_projection(floating[:] v, floating[:] out, floating radius,
     cdef floating l
     cdef floating norm = 0
     if radius == 0:
-        out[:] = 0
+        for i in range(m):
+            out[i * out_stride] = 0
         return
 
     # L2 projection
     if l1_ratio == 0:
         for i in range(m):
-            norm += v[i] ** 2
+            norm += v[i * v_stride] ** 2
         if norm <= radius:
             norm = 1
         else:
             norm = sqrt(norm / radius)
         for i in range(m):
-            out[i] = v[i] / norm
+            out[i * out_stride] = v[i * v_stride] / norm
     else:
         # Scaling by 1 / l1_ratio
         gamma = 2 / l1_ratio - 2
         radius /= l1_ratio
         # Preparing data
         for j in range(m):
-            out[j] = fabs(v[j])
-            norm += out[j] * (1 + gamma / 2 * out[j])
+            out[j * out_stride] = fabs(v[j * v_stride])
+            norm += out[j * out_stride] * (1 + gamma / 2 * out[j * out_stride])
         if norm <= radius:
-            out[:] = v[:]
+            for j in range(m):
+                out[j * out_stride] = v[j * v_stride]
         else:
             # s and rho computation
             s = 0
@@ -88,18 +95,22 @@ cpdef void enet_projection(floating[:] v, floating[:] out, floating radius,
             while size_U > 0:
                 pivot = start_U + size_U / 2
                 # Putting pivot at the beginning
-                swap(out, pivot, start_U, &buf)
+                swap(out, out_stride, pivot, start_U, &buf)
                 pivot = start_U
                 drho = 1
-                ds = out[pivot] * (1 + gamma / 2 * out[pivot])
+                ds = out[pivot * out_stride] * (
+                    1 + gamma / 2 * out[pivot * out_stride])
                 # Ordering : [pivot, >=, <], using Lobato quicksort
                 for i in range(start_U + 1, start_U + size_U):
-                    if out[i] >= out[pivot]:
-                        ds += out[i] * (1 + gamma / 2 * out[i])
-                        swap(out, i, start_U + drho, &buf)
+                    if out[i * out_stride] >= out[pivot * out_stride]:
+                        ds += out[i * out_stride] * (
+                            1 + gamma / 2 * out[i * out_stride])
+                        swap(out, out_stride, i, start_U + drho, &buf)
                         drho += 1
-                if s + ds - (rho + drho) * (1 + gamma / 2 * out[pivot])\
-                        * out[pivot] < radius * (1 + gamma * out[pivot]) ** 2:
+                if s + ds - (rho + drho) * (1 + gamma / 2
+                                            * out[pivot * out_stride])\
+                        * out[pivot * out_stride] < radius * (
+                            1 + gamma * out[pivot * out_stride]) ** 2:
                     # U <- L : [<]
                     start_U += drho
                     size_U -= drho
@@ -119,10 +130,53 @@ cpdef void enet_projection(floating[:] v, floating[:] out, floating radius,
             else:
                 l = (s - radius) / rho
             for i in range(m):
-                out[i] = sign(v[i]) * positive(fabs(v[i]) - l) / (1 + l * gamma)
+                out[i * out_stride] = sign(v[i * v_stride]) * positive(
+                    fabs(v[i * v_stride]) - l) / (1 + l * gamma)
     return
 
 
+cdef floating _enet_norm(floating* v, int stride, unsigned int n,
+                         floating l1_ratio) nogil:
+    cdef floating res = 0
+    cdef floating v_abs
+    cdef unsigned int i
+    for i in range(n):
+        v_abs = fabs(v[i * stride])
+        res += v_abs * (l1_ratio + (1 - l1_ratio) * v_abs)
+    return res
+
+
+cdef void _enet_scale(floating* X, int stride, unsigned int n,
+                      floating l1_ratio, floating radius) nogil:
+    cdef floating l1_norm = 0
+    cdef floating l2_norm = 0
+    cdef floating S = 0
+    cdef unsigned int j
+
+    for j in range(n):
+        l1_norm += fabs(X[j * stride])
+        l2_norm += X[j * stride] ** 2
+    l1_norm *= l1_ratio
+    l2_norm *= (1 - l1_ratio)
+    if l2_norm != 0:
+        S = (- l1_norm + sqrt(l1_norm ** 2
+                              + 4 * radius * l2_norm)) / (2 * l2_norm)
+    elif l1_norm != 0:
+        S = radius / l1_norm
+    for j in range(n):
+        X[j * stride] *= S
+
+
+cpdef void enet_projection(floating[:] v, floating[:] out, floating radius,
+                             floating l1_ratio) nogil:
+    cdef unsigned int m = v.shape[0]
+    if m == 0:
+        return
+    _enet_projection(&v[0], v.strides[0] / sizeof(floating),
+                     &out[0], out.strides[0] / sizeof(floating),
+                     m, radius, l1_ratio)
+
+
 cpdef floating enet_norm(floating[:] v, floating l1_ratio) nogil:
     """Returns the elastic net norm of a vector
 
@@ -139,31 +193,148 @@ cpdef floating enet_norm(floating[:] v, floating l1_ratio) nogil:
     norm: float,
         Elastic-net norm
     """
-    cdef int n = v.shape[0]
-    cdef floating res = 0
-    cdef floating v_abs
-    cdef unsigned int i
-    for i in range(n):
-        v_abs = fabs(v[i])
-        res += v_abs * (l1_ratio + (1 - l1_ratio) * v_abs)
-    return res
+    cdef unsigned int n = v.shape[0]
+    if n == 0:
+        return 0
+    return _enet_norm(&v[0], v.strides[0] / sizeof(floating), n, l1_ratio)
+
 
 cpdef void enet_scale(floating[:] X,
                            floating l1_ratio, floating radius=1) nogil:
-    cdef int n_features = X.shape[0]
-    cdef floating l1_norm = 0
-    cdef floating l2_norm = 0
-    cdef floating S = 0
+    cdef unsigned int n_features = X.shape[0]
+    if n_features == 0:
+        return
+    _enet_scale(&X[0], X.strides[0] / sizeof(floating), n_features,
+                l1_ratio, radius)
 
-    for j in range(n_features):
-        l1_norm += fabs(X[j])
-        l2_norm += X[j] ** 2
-    l1_norm *= l1_ratio
-    l2_norm *= (1 - l1_ratio)
-    if l2_norm != 0:
-        S = (- l1_norm + sqrt(l1_norm ** 2
-                              + 4 * radius * l2_norm)) / (2 * l2_norm)
-    elif l1_norm != 0:
-        S = radius / l1_norm
-    for j in range(n_features):
-        X[j] *= S
\ No newline at end of file
+
+cpdef void enet_projection_rows(floating[:, :] V, floating[:, :] out,
+                                floating[:] radius, floating l1_ratio,
+                                int n_threads=1):
+    """Project each row of V onto the elastic-net ball of radius radius[i].
+
+    Rows are processed in parallel. out may be V itself (inplace
+    projection): a scratch row per thread is used as workspace.
+
+    Parameters
+    ----------
+    V: floating 2D memory-view, shape (n_rows, n_features)
+        Vectors to project, in any memory layout
+
+    out: floating 2D memory-view, shape (n_rows, n_features)
+        Projected vectors
+
+    radius: floating memory-view, shape (n_rows)
+        Radius of the ball onto which each row is projected
+
+    l1_ratio: float,
+        Ratio of l1 norm (between 0 and 1)
+
+    n_threads: int,
+        Number of threads to use
+    """
+    cdef int n_rows = V.shape[0]
+    cdef unsigned int n_features = V.shape[1]
+    cdef int i, tid
+    cdef unsigned int j
+    cdef int v_row_stride = V.strides[0] / sizeof(floating)
+    cdef int v_stride = V.strides[1] / sizeof(floating)
+    cdef int out_row_stride = out.strides[0] / sizeof(floating)
+    cdef int out_stride = out.strides[1] / sizeof(floating)
+    cdef floating* V_ptr
+    cdef floating* out_ptr
+    cdef floating* scratch_ptr
+    cdef floating* this_scratch
+    cdef floating[:, ::1] scratch
+
+    if n_rows == 0 or n_features == 0:
+        return
+    if n_threads < 1:
+        n_threads = 1
+    scratch = view.array((n_threads, n_features), sizeof(floating),
+                         format='f' if floating is float else 'd',
+                         mode='c')
+    V_ptr = &V[0, 0]
+    out_ptr = &out[0, 0]
+    scratch_ptr = &scratch[0, 0]
+    for i in prange(n_rows, nogil=True, schedule='static',
+                    num_threads=n_threads):
+        tid = threadid()
+        this_scratch = scratch_ptr + tid * n_features
+        _enet_projection(V_ptr + i * v_row_stride, v_stride,
+                         this_scratch, 1,
+                         n_features, radius[i], l1_ratio)
+        for j in range(n_features):
+            out_ptr[i * out_row_stride + j * out_stride] = this_scratch[j]
+
+
+cpdef void enet_norm_rows(floating[:, :] V, floating[:] out,
+                          floating l1_ratio, int n_threads=1):
+    """Compute the elastic-net norm of each row of V into out.
+
+    Parameters
+    ----------
+    V: floating 2D memory-view, shape (n_rows, n_features)
+
+    out: floating memory-view, shape (n_rows)
+
+    l1_ratio: float,
+        Ratio of l1 norm (between 0 and 1)
+
+    n_threads: int,
+        Number of threads to use
+    """
+    cdef int n_rows = V.shape[0]
+    cdef unsigned int n_features = V.shape[1]
+    cdef int i
+    cdef int row_stride = V.strides[0] / sizeof(floating)
+    cdef int stride = V.strides[1] / sizeof(floating)
+    cdef floating* V_ptr
+
+    if n_rows == 0:
+        return
+    if n_features == 0:
+        out[:] = 0
+        return
+    if n_threads < 1:
+        n_threads = 1
+    V_ptr = &V[0, 0]
+    for i in prange(n_rows, nogil=True, schedule='static',
+                    num_threads=n_threads):
+        out[i] = _enet_norm(V_ptr + i * row_stride, stride, n_features,
+                            l1_ratio)
+
+
+cpdef void enet_scale_rows(floating[:, :] X, floating l1_ratio,
+                           floating[:] radius, int n_threads=1):
+    """Scale inplace each row of X so that its elastic-net norm is
+    radius[i].
+
+    Parameters
+    ----------
+    X: floating 2D memory-view, shape (n_rows, n_features)
+
+    l1_ratio: float,
+        Ratio of l1 norm (between 0 and 1)
+
+    radius: floating memory-view, shape (n_rows)
+
+    n_threads: int,
+        Number of threads to use
+    """
+    cdef int n_rows = X.shape[0]
+    cdef unsigned int n_features = X.shape[1]
+    cdef int i
+    cdef int row_stride = X.strides[0] / sizeof(floating)
+    cdef int stride = X.strides[1] / sizeof(floating)
+    cdef floating* X_ptr
+
+    if n_rows == 0 or n_features == 0:
+        return
+    if n_threads < 1:
+        n_threads = 1
+    X_ptr = &X[0, 0]
+    for i in prange(n_rows, nogil=True, schedule='static',
+                    num_threads=n_threads):
+        _enet_scale(X_ptr + i * row_stride, stride, n_features,
+                    l1_ratio, radius[i])
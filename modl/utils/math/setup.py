@@ -1,16 +1,57 @@
+import os
+import shutil
+import tempfile
 from distutils.extension import Extension
 
 import numpy
 
+OPENMP_TEST = """#include <omp.h>
+int main(void) {
+    return omp_get_max_threads() < 1;
+}
+"""
+
+
+def get_openmp_flags():
+    """Flags enabling OpenMP, if the C compiler supports it. prange loops
+    run serially otherwise (e.g. with Apple clang)."""
+    from distutils.ccompiler import new_compiler
+    from distutils.errors import CompileError, LinkError
+    from distutils.sysconfig import customize_compiler
+
+    compiler = new_compiler()
+    customize_compiler(compiler)
+    flags = ['-fopenmp']
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(tmp_dir, 'test_openmp.c')
+        with open(source, 'w') as f:
+            f.write(OPENMP_TEST)
+        objects = compiler.compile([source], output_dir=tmp_dir,
+                                   extra_postargs=flags)
+        compiler.link_executable(objects,
+                                 os.path.join(tmp_dir, 'test_openmp'),
+                                 extra_postargs=flags)
+    except (CompileError, LinkError):
+        print('OpenMP is not supported by the C compiler: '
+              'building modl.utils.math.enet without parallelism.')
+        flags = []
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return flags
+
 
 def configuration(parent_package='', top_path=None):
     from numpy.distutils.misc_util import Configuration
 
     config = Configuration('math', parent_package, top_path)
 
+    openmp_flags = get_openmp_flags()
     extensions = [Extension('modl.utils.math.enet',
                             sources=['modl/utils/math/enet.pyx'],
                             include_dirs=[numpy.get_include()],
+                            extra_compile_args=openmp_flags,
+                            extra_link_args=openmp_flags,
                             ),
                   ]
     config.ext_modules += extensions
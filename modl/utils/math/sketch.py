@@ -0,0 +1,88 @@
+"""
+Single-pass randomized estimation of the principal axes of a data stream.
+
+References
+----------
+'Fixed-Rank Approximation of a Positive-Semidefinite Matrix from Streaming
+Data', J. A. Tropp, A. Yurtsever, M. Udell, V. Cevher, NIPS '17
+"""
+import numpy as np
+from scipy import linalg
+from sklearn.utils import check_random_state
+
+
+class NystromSketch(object):
+    """
+    Streaming Nystrom sketch of the covariance X^T X of samples X, from
+    which its leading eigenvectors (the right singular vectors of X) are
+    estimated after a single pass over the samples.
+
+    The sketch holds Y = X^T X Omega, where Omega is a random
+    (n_features, rank + oversampling) matrix with orthonormal columns,
+    updated with each batch of samples at the cost of two matrix products.
+
+    Parameters
+    ----------
+    n_features: int
+
+    rank: int
+        Number of principal axes to estimate
+
+    oversampling: int
+        Number of additional random directions, improving the accuracy of
+        the leading axes
+
+    random_state: int or RandomState
+
+    Attributes
+    ----------
+    n_samples_: int
+        Number of samples seen
+    """
+
+    def __init__(self, n_features, rank, oversampling=10,
+                 random_state=None):
+        self.n_features = n_features
+        self.rank = rank
+        self.oversampling = oversampling
+        random_state = check_random_state(random_state)
+        size = min(rank + oversampling, n_features)
+        test_matrix = random_state.randn(n_features, size)
+        self.test_matrix_, _ = linalg.qr(test_matrix, mode='economic')
+        self.sketch_ = np.zeros((n_features, size))
+        self.n_samples_ = 0
+
+    def partial_fit(self, X):
+        """Update the sketch with samples X, shape (n_samples, n_features)"""
+        test_matrix = self.test_matrix_.astype(X.dtype, copy=False)
+        self.sketch_ += X.T.dot(X.dot(test_matrix))
+        self.n_samples_ += X.shape[0]
+        return self
+
+    def components(self, n_components=None):
+        """
+        Leading principal axes of the samples seen.
+
+        Returns
+        -------
+        components: ndarray, shape (n_components, n_features)
+            Orthonormal axes, by decreasing variance
+
+        explained_variance: ndarray, shape (n_components)
+            Eigenvalues of X^T X along components
+        """
+        if n_components is None:
+            n_components = self.rank
+        sketch, test_matrix = self.sketch_, self.test_matrix_
+        # Shift ensuring that the core matrix is positive definite
+        shift = np.finfo(np.float64).eps * max(linalg.norm(sketch), 1e-300)
+        sketch = sketch + shift * test_matrix
+        core = test_matrix.T.dot(sketch)
+        core = (core + core.T) / 2
+        eigvals, eigvecs = linalg.eigh(core)
+        keep = eigvals > eigvals.max() * np.finfo(np.float64).eps
+        # X^T X ~ E E^T, with E = sketch core^{-1/2}
+        E = sketch.dot(eigvecs[:, keep] / np.sqrt(eigvals[keep]))
+        U, S, _ = linalg.svd(E, full_matrices=False)
+        explained_variance = np.maximum(S[:n_components] ** 2 - shift, 0)
+        return U[:, :n_components].T, explained_variance
@@ -6,7 +6,8 @@ from numpy import sqrt
 from numpy.testing import assert_array_almost_equal, assert_almost_equal
 from sklearn.utils import check_random_state
 
-from modl.utils.math.enet import enet_norm, enet_projection, enet_scale
+from modl.utils.math.enet import enet_norm, enet_projection, enet_scale, \
+    enet_norm_rows, enet_projection_rows, enet_scale_rows
 
 
 def _enet_norm_for_projection(v, gamma):
@@ -154,3 +155,31 @@ def test_enet_scale():
             enet_scale(a, l1_ratio, r)
             norm = enet_norm(a, l1_ratio)
         assert_almost_equal(norm, r)
+
+
+def test_enet_rows():
+    random_state = check_random_state(0)
+    n_rows, n_features = 50, 100
+    for l1_ratio in [0., 0.5, 1.]:
+        V = random_state.randn(n_rows, n_features)
+        radius = random_state.uniform(0.5, 2, size=n_rows)
+        ref = np.empty_like(V)
+        for i in range(n_rows):
+            enet_projection(V[i], ref[i], radius[i], l1_ratio)
+        out = np.empty_like(V)
+        enet_projection_rows(V, out, radius, l1_ratio, 2)
+        assert_array_almost_equal(out, ref)
+        # Inplace, Fortran-ordered
+        V = np.asfortranarray(V)
+        enet_projection_rows(V, V, radius, l1_ratio, 2)
+        assert_array_almost_equal(V, ref)
+
+        norms = np.empty(n_rows)
+        enet_norm_rows(ref, norms, l1_ratio, 2)
+        assert_array_almost_equal(norms, [enet_norm(v, l1_ratio)
+                                          for v in ref])
+
+        V = random_state.randn(n_rows, n_features)
+        enet_scale_rows(V, l1_ratio, radius, 2)
+        enet_norm_rows(V, norms, l1_ratio)
+        assert_array_almost_equal(norms, radius)
@@ -0,0 +1,25 @@
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+from sklearn.utils import check_random_state
+
+from modl.utils.math.sketch import NystromSketch
+
+
+def test_nystrom_sketch():
+    rng = check_random_state(0)
+    n_samples, n_features, rank = 500, 100, 5
+    axes, _ = np.linalg.qr(rng.randn(n_features, rank))
+    X = (rng.randn(n_samples, rank) * np.arange(10, 5, -1)).dot(axes.T)
+    X += 0.01 * rng.randn(n_samples, n_features)
+    sketch = NystromSketch(n_features, rank, random_state=0)
+    for start in range(0, n_samples, 100):
+        sketch.partial_fit(X[start:start + 100])
+    assert sketch.n_samples_ == n_samples
+    components, explained_variance = sketch.components()
+    assert components.shape == (rank, n_features)
+    assert_array_almost_equal(components.dot(components.T), np.eye(rank))
+    _, S, V = np.linalg.svd(X, full_matrices=False)
+    assert_array_almost_equal(np.abs(np.sum(components * V[:rank], axis=1)),
+                              np.ones(rank), decimal=3)
+    assert_array_almost_equal(explained_variance / S[:rank] ** 2,
+                              np.ones(rank), decimal=2)
@@ -0,0 +1,88 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def prefetch(func, items, n_prefetch=1, max_bytes=None, nbytes=None,
+             n_threads=1):
+    """
+    Lazily map func over items, computing the results of the next
+    items in background threads while the current one is consumed.
+
+    Results are yielded in the order of items. Loading functions
+    (file reading, decompression, masking) release the GIL most of the time,
+    so that I/O overlaps with the computation done by the consumer.
+
+    Parameters
+    ----------
+    func: callable
+        Function to apply on each item
+
+    items: iterable
+
+    n_prefetch: int,
+        Maximum number of results computed ahead of the consumer. 0 disables
+        prefetching: func is called in the main thread when the next result
+        is requested.
+
+    max_bytes: int or None,
+        Bound on the memory used by prefetched results, including the
+        one being loaded for the consumer. At least one item is always
+        loaded.
+
+    nbytes: callable or None,
+        Function returning the estimated size in bytes of func(item), used
+        to enforce max_bytes. By default, the size of the last result is
+        used as an estimate.
+
+    n_threads: int,
+        Number of threads computing results
+
+    Yields
+    ------
+    (item, result): tuple
+    """
+    items = iter(items)
+    if n_prefetch <= 0:
+        for item in items:
+            yield item, func(item)
+        return
+
+    pending = deque()
+    last_nbytes = [0]
+
+    def estimate(item):
+        if nbytes is not None:
+            return nbytes(item)
+        return last_nbytes[0]
+
+    pool = ThreadPoolExecutor(n_threads)
+    pending_bytes = 0
+    # Item drawn from items but not submitted yet, wrapped in a tuple
+    held = None
+    try:
+        while True:
+            while len(pending) < n_prefetch + 1:
+                if held is None:
+                    try:
+                        held = (next(items),)
+                    except StopIteration:
+                        break
+                item, = held
+                size = estimate(item)
+                if (max_bytes is not None and pending
+                        and pending_bytes + size > max_bytes):
+                    break
+                pending.append((item, size, pool.submit(func, item)))
+                pending_bytes += size
+                held = None
+            if not pending:
+                break
+            item, size, future = pending.popleft()
+            pending_bytes -= size
+            result = future.result()
+            last_nbytes[0] = getattr(result, 'nbytes', 0)
+            yield item, result
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
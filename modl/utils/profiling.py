@@ -0,0 +1,105 @@
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+
+
+class PhaseProfiler(object):
+    """Accumulate wall time, number of calls and optionally allocated bytes
+    of named phases of an algorithm.
+
+    Phases are timed using the profiler as a context manager:
+
+        with profiler('coding'):
+            ...
+
+    Parameters
+    ----------
+    phases: list of str
+        Name of the phases to profile
+
+    memory: boolean
+        Also record the peak number of bytes allocated within each phase,
+        using tracemalloc (which is started if needed). This slows down
+        every allocation and should be reserved to diagnostic runs.
+        Allocations are attributed to phases approximately when phases run
+        concurrently in several threads.
+
+    Attributes
+    ----------
+    stats: OrderedDict
+        For each phase, a dict with keys 'time', 'calls' (cumulated over
+        the profiler lifetime) and 'bytes' (if memory)
+    last: OrderedDict
+        Same as stats, accumulated since the last call to `new_batch`
+    """
+
+    def __init__(self, phases, memory=False):
+        self.phases = list(phases)
+        self.memory = memory
+        self._lock = threading.Lock()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.stats = self._empty_stats()
+        self.last = self._empty_stats()
+
+    def _empty_stats(self):
+        stats = OrderedDict()
+        for phase in self.phases:
+            stats[phase] = {'time': 0., 'calls': 0}
+            if self.memory:
+                stats[phase]['bytes'] = 0
+        return stats
+
+    def new_batch(self):
+        """Reset per-batch statistics and return the previous ones"""
+        last = self.last
+        self.last = self._empty_stats()
+        return last
+
+    def __call__(self, phase):
+        return _Phase(self, phase)
+
+    def _record(self, phase, elapsed, n_bytes):
+        with self._lock:
+            for stats in (self.stats[phase], self.last[phase]):
+                stats['time'] += elapsed
+                stats['calls'] += 1
+                if self.memory:
+                    stats['bytes'] += n_bytes
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_lock', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__ = state
+        self._lock = threading.Lock()
+
+
+class _Phase(object):
+    __slots__ = ('profiler', 'phase', 't0', 'mem0')
+
+    def __init__(self, profiler, phase):
+        self.profiler = profiler
+        self.phase = phase
+
+    def __enter__(self):
+        if self.profiler.memory:
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self.mem0 = tracemalloc.get_traced_memory()[0]
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.t0
+        if self.profiler.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if not hasattr(tracemalloc, 'reset_peak'):
+                peak = current
+            n_bytes = max(peak - self.mem0, 0)
+        else:
+            n_bytes = 0
+        self.profiler._record(self.phase, elapsed, n_bytes)
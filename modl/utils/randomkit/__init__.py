@@ -1,2 +1,3 @@
 from .random_fast import RandomState
+from .philox_fast import Philox
 from .sampler import Sampler
\ No newline at end of file
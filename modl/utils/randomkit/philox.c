@@ -0,0 +1,344 @@
+/* Philox4x32-10 counter-based random number generator.
+ *
+ * Salmon, Moraes, Dror, Shaw, 2011: Parallel random numbers: as easy as
+ * 1, 2, 3 (http://www.thesalmons.org/john/random123/papers/random123sc11.pdf)
+ *
+ * Binomial samplers are adapted from distributions.c
+ * (Copyright 2005 Robert Kern), without the cached setup so that the state
+ * stays a plain counter.
+ */
+
+#include <math.h>
+#include <stdlib.h>
+
+#include "philox.h"
+
+#define PHILOX_M0 0xD2511F53U
+#define PHILOX_M1 0xCD9E8D57U
+#define PHILOX_W0 0x9E3779B9U
+#define PHILOX_W1 0xBB67AE85U
+#define PHILOX_ROUNDS 10
+
+static inline uint32_t mulhilo(uint32_t a, uint32_t b, uint32_t *hi)
+{
+    uint64_t product = (uint64_t)a * (uint64_t)b;
+    *hi = (uint32_t)(product >> 32);
+    return (uint32_t)product;
+}
+
+static void philox_block(const uint32_t *counter, const uint32_t *key,
+                         uint32_t *out)
+{
+    uint32_t c0 = counter[0], c1 = counter[1];
+    uint32_t c2 = counter[2], c3 = counter[3];
+    uint32_t k0 = key[0], k1 = key[1];
+    uint32_t hi0, hi1, lo0, lo1;
+    int i;
+
+    for (i = 0; i < PHILOX_ROUNDS; i++)
+    {
+        lo0 = mulhilo(PHILOX_M0, c0, &hi0);
+        lo1 = mulhilo(PHILOX_M1, c2, &hi1);
+        c0 = hi1 ^ c1 ^ k0;
+        c1 = lo1;
+        c2 = hi0 ^ c3 ^ k1;
+        c3 = lo0;
+        k0 += PHILOX_W0;
+        k1 += PHILOX_W1;
+    }
+    out[0] = c0;
+    out[1] = c1;
+    out[2] = c2;
+    out[3] = c3;
+}
+
+void philox_seed(philox_state *state, uint64_t key, uint64_t stream)
+{
+    state->key[0] = (uint32_t)key;
+    state->key[1] = (uint32_t)(key >> 32);
+    state->counter[0] = 0;
+    state->counter[1] = 0;
+    state->counter[2] = (uint32_t)stream;
+    state->counter[3] = (uint32_t)(stream >> 32);
+    state->buffer_pos = 4;
+}
+
+uint32_t philox_random(philox_state *state)
+{
+    if (state->buffer_pos == 4)
+    {
+        philox_block(state->counter, state->key, state->buffer);
+        /* Increment the low 64 bits of the counter */
+        if (++state->counter[0] == 0)
+        {
+            ++state->counter[1];
+        }
+        state->buffer_pos = 0;
+    }
+    return state->buffer[state->buffer_pos++];
+}
+
+uint64_t philox_random64(philox_state *state)
+{
+    uint64_t hi = philox_random(state);
+    return (hi << 32) | philox_random(state);
+}
+
+double philox_double(philox_state *state)
+{
+    /* shifts : 67108864 = 0x4000000, 9007199254740992 = 0x20000000000000 */
+    long a = philox_random(state) >> 5, b = philox_random(state) >> 6;
+    return (a * 67108864.0 + b) / 9007199254740992.0;
+}
+
+uint64_t philox_interval(uint64_t max, philox_state *state)
+{
+    uint64_t mask = max, value;
+
+    if (max == 0)
+    {
+        return 0;
+    }
+    /* Smallest bit mask >= max */
+    mask |= mask >> 1;
+    mask |= mask >> 2;
+    mask |= mask >> 4;
+    mask |= mask >> 8;
+    mask |= mask >> 16;
+    mask |= mask >> 32;
+
+    /* Search a random value in [0..mask] <= max */
+    if (max <= 0xffffffffUL)
+    {
+        while ((value = (philox_random(state) & mask)) > max);
+    }
+    else
+    {
+        while ((value = (philox_random64(state) & mask)) > max);
+    }
+    return value;
+}
+
+static long philox_binomial_inversion(philox_state *state, long n, double p)
+{
+    double q, qn, np, px, U;
+    long X, bound;
+
+    q = 1.0 - p;
+    qn = exp(n * log(q));
+    np = n * p;
+    bound = (long)fmin(n, np + 10.0 * sqrt(np * q + 1));
+
+    X = 0;
+    px = qn;
+    U = philox_double(state);
+    while (U > px)
+    {
+        X++;
+        if (X > bound)
+        {
+            X = 0;
+            px = qn;
+            U = philox_double(state);
+        } else
+        {
+            U -= px;
+            px = ((n - X + 1) * p * px) / (X * q);
+        }
+    }
+    return X;
+}
+
+static long philox_binomial_btpe(philox_state *state, long n, double p)
+{
+    double r, q, fm, p1, xm, xl, xr, c, laml, lamr, p2, p3, p4;
+    double a, u, v, s, F, rho, t, A, nrq, x1, x2, f1, f2, z, z2, w, w2, x;
+    long m, y, k, i;
+
+    r = fmin(p, 1.0 - p);
+    q = 1.0 - r;
+    fm = n * r + r;
+    m = (long)floor(fm);
+    p1 = floor(2.195 * sqrt(n * r * q) - 4.6 * q) + 0.5;
+    xm = m + 0.5;
+    xl = xm - p1;
+    xr = xm + p1;
+    c = 0.134 + 20.5 / (15.3 + m);
+    a = (fm - xl) / (fm - xl * r);
+    laml = a * (1.0 + a / 2.0);
+    a = (xr - fm) / (xr * q);
+    lamr = a * (1.0 + a / 2.0);
+    p2 = p1 * (1.0 + 2.0 * c);
+    p3 = p2 + c / laml;
+    p4 = p3 + c / lamr;
+
+  Step10:
+    nrq = n * r * q;
+    u = philox_double(state) * p4;
+    v = philox_double(state);
+    if (u > p1) goto Step20;
+    y = (long)floor(xm - p1 * v + u);
+    goto Step60;
+
+  Step20:
+    if (u > p2) goto Step30;
+    x = xl + (u - p1) / c;
+    v = v * c + 1.0 - fabs(m - x + 0.5) / p1;
+    if (v > 1.0) goto Step10;
+    y = (long)floor(x);
+    goto Step50;
+
+  Step30:
+    if (u > p3) goto Step40;
+    y = (long)floor(xl + log(v) / laml);
+    if (y < 0) goto Step10;
+    v = v * (u - p2) * laml;
+    goto Step50;
+
+  Step40:
+    y = (long)floor(xr - log(v) / lamr);
+    if (y > n) goto Step10;
+    v = v * (u - p3) * lamr;
+
+  Step50:
+    k = labs(y - m);
+    if ((k > 20) && (k < ((nrq) / 2.0 - 1))) goto Step52;
+
+    s = r / q;
+    a = s * (n + 1);
+    F = 1.0;
+    if (m < y)
+    {
+        for (i = m + 1; i <= y; i++)
+        {
+            F *= (a / i - s);
+        }
+    }
+    else if (m > y)
+    {
+        for (i = y + 1; i <= m; i++)
+        {
+            F /= (a / i - s);
+        }
+    }
+    if (v > F) goto Step10;
+    goto Step60;
+
+  Step52:
+    rho = (k / (nrq)) * ((k * (k / 3.0 + 0.625) + 0.16666666666666666) / nrq
+                         + 0.5);
+    t = -k * k / (2 * nrq);
+    A = log(v);
+    if (A < (t - rho)) goto Step60;
+    if (A > (t + rho)) goto Step10;
+
+    x1 = y + 1;
+    f1 = m + 1;
+    z = n + 1 - m;
+    w = n - y + 1;
+    x2 = x1 * x1;
+    f2 = f1 * f1;
+    z2 = z * z;
+    w2 = w * w;
+    if (A > (xm * log(f1 / x1)
+             + (n - m + 0.5) * log(z / w)
+             + (y - m) * log(w * r / (x1 * q))
+             + (13680. - (462. - (132. - (99. - 140. / f2) / f2) / f2) / f2)
+               / f1 / 166320.
+             + (13680. - (462. - (132. - (99. - 140. / z2) / z2) / z2) / z2)
+               / z / 166320.
+             + (13680. - (462. - (132. - (99. - 140. / x2) / x2) / x2) / x2)
+               / x1 / 166320.
+             + (13680. - (462. - (132. - (99. - 140. / w2) / w2) / w2) / w2)
+               / w / 166320.))
+    {
+        goto Step10;
+    }
+
+  Step60:
+    if (p > 0.5)
+    {
+        y = n - y;
+    }
+
+    return y;
+}
+
+long philox_binomial(philox_state *state, long n, double p)
+{
+    double q;
+
+    if (n <= 0 || p <= 0)
+    {
+        return 0;
+    }
+    if (p >= 1)
+    {
+        return n;
+    }
+    if (p <= 0.5)
+    {
+        if (p * n <= 30.0)
+        {
+            return philox_binomial_inversion(state, n, p);
+        }
+        else
+        {
+            return philox_binomial_btpe(state, n, p);
+        }
+    }
+    else
+    {
+        q = 1.0 - p;
+        if (q * n <= 30.0)
+        {
+            return n - philox_binomial_inversion(state, n, q);
+        }
+        else
+        {
+            return n - philox_binomial_btpe(state, n, q);
+        }
+    }
+}
+
+void philox_permutation(philox_state *state, long *out, long n)
+{
+    long i;
+
+    for (i = 0; i < n; i++)
+    {
+        out[i] = i;
+    }
+    philox_sample(state, out, n, n);
+}
+
+void philox_shuffle_swaps(philox_state *state, long *swap, long n)
+{
+    long i;
+
+    if (n > 0)
+    {
+        swap[0] = 0;
+    }
+    for (i = n - 1; i > 0; i--)
+    {
+        swap[i] = (long)philox_interval(i, state);
+    }
+}
+
+void philox_sample(philox_state *state, long *box, long n, long k)
+{
+    long i, j, tmp;
+
+    if (k > n)
+    {
+        k = n;
+    }
+    for (i = 0; i < k && i < n - 1; i++)
+    {
+        j = i + (long)philox_interval(n - 1 - i, state);
+        tmp = box[i];
+        box[i] = box[j];
+        box[j] = tmp;
+    }
+}
@@ -0,0 +1,74 @@
+/* Philox4x32-10 counter-based random number generator.
+ *
+ * Salmon, Moraes, Dror, Shaw, 2011: Parallel random numbers: as easy as
+ * 1, 2, 3 (http://www.thesalmons.org/john/random123/papers/random123sc11.pdf)
+ *
+ * The output of the generator is a pure function of a 64-bit key and a
+ * 128-bit counter. The high 64 bits of the counter hold a stream index, the
+ * low 64 bits the position in the stream. Independent streams are therefore
+ * obtained for free by setting the stream index (e.g. to a loop index within
+ * a parallel loop), and a state can be copied and advanced without locks.
+ *
+ * Typical use:
+ *
+ * {
+ *  philox_state state;
+ *
+ *  philox_seed(&state, key, stream); // Initialize the RNG
+ *  ...
+ *  random_value = philox_random(&state); // Generate 32-bit random values
+ * }
+ */
+
+#ifndef _MODL_PHILOX_
+#define _MODL_PHILOX_
+
+#include <stdint.h>
+
+typedef struct philox_state_
+{
+    uint32_t key[2];
+    uint32_t counter[4];
+    uint32_t buffer[4];
+    int buffer_pos;
+} philox_state;
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+/* Initialize state with a 64-bit key and a 64-bit stream index */
+extern void philox_seed(philox_state *state, uint64_t key, uint64_t stream);
+
+/* Return a random 32-bit integer */
+extern uint32_t philox_random(philox_state *state);
+
+/* Return a random 64-bit integer */
+extern uint64_t philox_random64(philox_state *state);
+
+/* Return a random double in [0, 1), with 53 bits of randomness */
+extern double philox_double(philox_state *state);
+
+/* Return a random integer in [0, max] */
+extern uint64_t philox_interval(uint64_t max, philox_state *state);
+
+/* Return a binomial variate, using inversion for small mean and BTPE
+ * otherwise (same algorithms as randomkit distributions) */
+extern long philox_binomial(philox_state *state, long n, double p);
+
+/* Fill out with a random permutation of [0, n) */
+extern void philox_permutation(philox_state *state, long *out, long n);
+
+/* Fill swap with the swap indices of a Fisher-Yates shuffle of size n:
+ * swap[i] is drawn in [0, i] for i in [1, n) */
+extern void philox_shuffle_swaps(philox_state *state, long *swap, long n);
+
+/* Partial Fisher-Yates shuffle: move k elements uniformly sampled without
+ * replacement from box[0:n] to box[0:k] */
+extern void philox_sample(philox_state *state, long *box, long n, long k);
+
+#ifdef __cplusplus
+}
+#endif
+
+#endif /* _MODL_PHILOX_ */
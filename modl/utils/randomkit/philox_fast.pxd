@@ -0,0 +1,30 @@
+from libc.stdint cimport uint32_t, uint64_t
+
+cdef extern from "philox.h":
+
+    ctypedef struct philox_state:
+        uint32_t key[2]
+        uint32_t counter[4]
+        uint32_t buffer[4]
+        int buffer_pos
+
+    void philox_seed(philox_state *state, uint64_t key, uint64_t stream) nogil
+    uint32_t philox_random(philox_state *state) nogil
+    uint64_t philox_random64(philox_state *state) nogil
+    double philox_double(philox_state *state) nogil
+    uint64_t philox_interval(uint64_t max, philox_state *state) nogil
+    long philox_binomial(philox_state *state, long n, double p) nogil
+    void philox_permutation(philox_state *state, long *out, long n) nogil
+    void philox_shuffle_swaps(philox_state *state, long *swap, long n) nogil
+    void philox_sample(philox_state *state, long *box, long n, long k) nogil
+
+cdef class Philox:
+
+    cdef philox_state state
+    cdef public object initial_seed
+    cdef public uint64_t key
+    cdef public uint64_t stream
+    cpdef long randint(self, unsigned long high)
+    cpdef long binomial(self, long n, double p)
+    cpdef long[:] permutation(self, long size)
+    cdef void _substream(self, uint64_t stream, philox_state *state) nogil
@@ -0,0 +1,205 @@
+# encoding: utf-8
+# cython: linetrace=True
+# cython: cdivision=True
+# cython: boundscheck=False
+# cython: wraparound=False
+"""Counter-based random number generation (Philox4x32-10).
+
+Unlike RandomState, which wraps a Mersenne Twister state, the output of
+Philox is a pure function of a key and a counter. Streams are cheap to
+create and independent, so that randomness can be drawn within prange loops
+without locks, and results do not depend on the number of threads: use
+one sub-stream per loop item (see Philox._substream), rather than one per
+thread.
+"""
+import os
+
+import numpy as np
+
+from cython cimport view
+from libc.stdint cimport uint32_t, uint64_t
+
+MAX_KEY = np.iinfo(np.uint64).max
+
+
+cdef class Philox:
+    """Counter-based pseudo-random generator, with a numpy-like interface
+    similar to RandomState.
+
+    Parameters
+    ----------
+    seed: int or None
+        64-bit key of the generator. If None, a key is drawn from the
+        operating system.
+
+    stream: int
+        Index of the stream to draw values from. Generators with the same
+        seed and different streams are independent.
+    """
+    def __init__(self, seed=None, stream=0):
+        self.initial_seed = seed
+        self.seed(seed, stream)
+
+    def seed(self, seed=None, stream=0):
+        if seed is None:
+            seed = int.from_bytes(os.urandom(8), 'little')
+        elif isinstance(seed, (int, np.integer)):
+            seed = int(seed)
+            if seed < 0:
+                raise ValueError("Wrong seed")
+        else:
+            raise ValueError("Wrong seed")
+        self.key = <uint64_t> (seed & MAX_KEY)
+        self.stream = <uint64_t> stream
+        philox_seed(&self.state, self.key, self.stream)
+
+    def __reduce__(self):
+        # The key, rather than initial_seed, which is None for keys drawn
+        # from the operating system
+        return (Philox, (self.key, self.stream), self.get_state())
+
+    def get_state(self):
+        """Full state of the generator, as a tuple of ints"""
+        return (tuple(self.state.key), tuple(self.state.counter),
+                tuple(self.state.buffer), self.state.buffer_pos)
+
+    def set_state(self, state):
+        key, counter, buffer, buffer_pos = state
+        for i in range(2):
+            self.state.key[i] = key[i]
+        for i in range(4):
+            self.state.counter[i] = counter[i]
+            self.state.buffer[i] = buffer[i]
+        self.state.buffer_pos = buffer_pos
+
+    def __setstate__(self, state):
+        self.set_state(state)
+
+    cdef void _substream(self, uint64_t stream, philox_state *state) nogil:
+        """Initialize state with the sub-stream `stream` of this generator.
+
+        Sub-streams are derived from the key only: they can be created
+        concurrently from within a prange loop, one per loop item."""
+        philox_seed(state, self.key, stream)
+
+    def spawn(self, long n_children):
+        """Return n_children independent generators, whose keys are drawn
+        from this generator.
+
+        Parameters
+        ----------
+        n_children: int
+
+        Returns
+        -------
+        children: list of Philox
+        """
+        cdef long i
+        return [Philox(seed=philox_random64(&self.state))
+                for i in range(n_children)]
+
+    cpdef long randint(self, unsigned long high):
+        """Random integer in [0, high)"""
+        if high == 0:
+            raise ValueError("high should be positive")
+        return <long> philox_interval(high - 1, &self.state)
+
+    def random_sample(self, size=None):
+        """Random floats in [0, 1)"""
+        cdef long i
+        cdef double[::1] res
+        if size is None:
+            return philox_double(&self.state)
+        res = view.array((size, ), sizeof(double), format='d')
+        with nogil:
+            for i in range(res.shape[0]):
+                res[i] = philox_double(&self.state)
+        return np.asarray(res)
+
+    cpdef long binomial(self, long n, double p):
+        return philox_binomial(&self.state, n, p)
+
+    cpdef long[:] permutation(self, long size):
+        cdef long[:] res = view.array((size, ), sizeof(long), format='l')
+        if size > 0:
+            with nogil:
+                philox_permutation(&self.state, &res[0], size)
+        return res
+
+    def sample(self, long n, long k):
+        """Draw k distinct integers uniformly in [0, n)
+
+        Parameters
+        ----------
+        n: int
+        k: int, <= n
+
+        Returns
+        -------
+        subset: ndarray, shape (k, )
+        """
+        cdef long i
+        cdef long[:] box
+        if k > n:
+            raise ValueError("k should be lower than n")
+        box = view.array((n, ), sizeof(long), format='l')
+        if n > 0:
+            with nogil:
+                for i in range(n):
+                    box[i] = i
+                philox_sample(&self.state, &box[0], n, k)
+        return np.array(box[:k])
+
+    def shuffle(self, object x, long[:] swap=None):
+        cdef long n = len(x)
+        if swap is None:
+            swap = view.array((max(n, 1), ), sizeof(long), format='l')
+            if n > 0:
+                philox_shuffle_swaps(&self.state, &swap[0], n)
+        _apply_swaps(x, swap)
+
+    def shuffle_with_trace(self, object list):
+        cdef long i, j
+        cdef long n = len(list[0])
+        cdef long[:] trace = view.array((max(n, 1), ), sizeof(long),
+                                        format='l')
+        cdef long[:] swap = view.array((max(n, 1), ), sizeof(long),
+                                       format='l')
+        if n > 0:
+            philox_shuffle_swaps(&self.state, &swap[0], n)
+        for i in range(n):
+            trace[i] = i
+        i = n - 1
+        while i > 0:
+            j = swap[i]
+            trace[i], trace[j] = trace[j], trace[i]
+            i = i - 1
+        for x in list:
+            _apply_swaps(x, swap)
+        return np.asarray(trace[:n])
+
+
+def _apply_swaps(object x, long[:] swap):
+    """Fisher-Yates shuffle of x inplace, given swap indices"""
+    cdef long i = len(x) - 1
+    cdef long j
+    try:
+        j = len(x[0])
+    except:
+        j = 0
+
+    if j == 0:
+        while i > 0:
+            j = swap[i]
+            x[i], x[j] = x[j], x[i]
+            i = i - 1
+    elif hasattr(x[0], 'copy'):
+        while i > 0:
+            j = swap[i]
+            x[i], x[j] = x[j].copy(), x[i].copy()
+            i = i - 1
+    else:
+        while i > 0:
+            j = swap[i]
+            x[i], x[j] = x[j][:], x[i][:]
+            i = i - 1
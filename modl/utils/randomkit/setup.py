@@ -21,6 +21,13 @@ def configuration(parent_package='', top_path=None):
                             include_dirs=[numpy.get_include(),
                                           'modl/utils/randomkit'],
                             ),
+                  Extension('modl.utils.randomkit.philox_fast',
+                            sources=['modl/utils/randomkit/philox_fast.pyx',
+                                     'modl/utils/randomkit/philox.c',
+                                     ],
+                            include_dirs=[numpy.get_include(),
+                                          'modl/utils/randomkit'],
+                            ),
                   Extension('modl.utils.randomkit.sampler',
                             sources=['modl/utils/randomkit/sampler.pyx'],
                             language="c++",
@@ -0,0 +1,91 @@
+import pickle
+
+import numpy as np
+from numpy.testing import (assert_almost_equal, assert_array_equal,
+                           assert_equal)
+
+from modl.utils.randomkit import Philox
+
+
+def _block(key, stream, counter):
+    rs = Philox(seed=key, stream=stream)
+    state = rs.get_state()
+    rs.set_state((state[0], counter, state[2], 4))
+    return [rs.randint(2 ** 32) for _ in range(4)]
+
+
+def test_known_answers():
+    # Random123 known-answer vectors for philox4x32-10
+    assert_array_equal(_block(0, 0, (0, 0, 0, 0)),
+                       [0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8])
+    assert_array_equal(_block(2 ** 64 - 1, 0, (0xffffffff,) * 4),
+                       [0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd])
+    assert_array_equal(_block(0x299f31d0a4093822, 0,
+                              (0x243f6a88, 0x85a308d3,
+                               0x13198a2e, 0x03707344)),
+                       [0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1])
+
+
+def test_random():
+    rs = Philox(seed=0)
+    vals = [rs.randint(10) for t in range(10000)]
+    assert_equal(np.max(vals), 9)
+    assert_almost_equal(np.mean(vals), 4.5, 1)
+    vals = [rs.binomial(1000, 0.8) for t in range(10000)]
+    assert_almost_equal(np.mean(vals) / 1000, 0.8, 3)
+    vals = [rs.binomial(100, 0.05) for t in range(10000)]
+    assert_almost_equal(np.mean(vals) / 100, 0.05, 2)
+    vals = rs.random_sample(10000)
+    assert (np.all(vals >= 0) and np.all(vals < 1))
+    assert_almost_equal(np.mean(vals), 0.5, 2)
+
+
+def test_streams():
+    rs1 = Philox(seed=0, stream=0)
+    rs2 = Philox(seed=0, stream=0)
+    rs3 = Philox(seed=0, stream=1)
+    a = rs1.random_sample(10)
+    assert_array_equal(a, rs2.random_sample(10))
+    assert (np.all(a != rs3.random_sample(10)))
+    children = [rs.randint(1000) for rs in Philox(seed=0).spawn(3)]
+    assert_array_equal(children,
+                       [rs.randint(1000) for rs in Philox(seed=0).spawn(3)])
+    assert_equal(len(set(children)), 3)
+
+
+def test_permutation_sample():
+    rs = Philox(seed=0)
+    perm = np.asarray(rs.permutation(100))
+    assert_array_equal(np.sort(perm), np.arange(100))
+    subset = rs.sample(100, 10)
+    assert_equal(subset.shape[0], 10)
+    assert_equal(np.unique(subset).shape[0], 10)
+    assert (np.all(subset >= 0) and np.all(subset < 100))
+
+
+def test_shuffle_with_trace():
+    ind = np.arange(10)
+    ind2 = np.arange(9, -1, -1)
+    rs = Philox(seed=0)
+    perm = rs.shuffle_with_trace([ind, ind2])
+    assert_array_equal(ind, perm)
+    assert_array_equal(ind2, 9 - perm)
+
+    ind = np.arange(10)
+    Philox(seed=0).shuffle(ind)
+    assert_array_equal(ind, perm)
+
+
+def test_philox_pickle():
+    rs = Philox(seed=0)
+    rs.randint(5)
+    pickle_rs = pickle.loads(pickle.dumps(rs))
+    assert_array_equal(rs.random_sample(5), pickle_rs.random_sample(5))
+    # Keys drawn from the operating system are kept
+    rs = Philox(stream=3)
+    pickle_rs = pickle.loads(pickle.dumps(rs))
+    assert pickle_rs.key == rs.key
+    assert pickle_rs.stream == rs.stream
+    assert_array_equal(rs.random_sample(5), pickle_rs.random_sample(5))
+    assert_array_equal(rs.spawn(2)[1].random_sample(3),
+                       pickle_rs.spawn(2)[1].random_sample(3))
@@ -0,0 +1,209 @@
+"""
+Resource-aware scheduling of the runs of parameter sweeps.
+
+Each run is executed in a fresh process, started when enough cores of the
+budget are free. The number of threads of BLAS and OpenMP libraries is set
+through environment variables, read by these libraries when they are
+loaded (i.e. when numpy is first imported by the process), and processes
+may be pinned to their cores. It defaults to the number of cores of the
+run, and should be set to 1 for runs that start one thread per core of
+their own, each calling BLAS. Runs therefore never use more threads than
+the budget, however many they are.
+"""
+import os
+import threading
+import time
+import traceback
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+# Environment variables controlling the thread pools of BLAS / OpenMP
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                   'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                   'NUMEXPR_NUM_THREADS']
+
+# Serializes changes of os.environ around process startup
+_environ_lock = threading.Lock()
+
+
+def available_cores():
+    """Ids of the cores this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def thread_env(n_threads):
+    """Environment variables limiting BLAS / OpenMP to n_threads threads"""
+    return {var: str(n_threads) for var in THREAD_ENV_VARS}
+
+
+class JobError(Exception):
+    """Exception raised by a job, with the traceback of the job process"""
+
+
+def _run_job(conn, func, args, kwargs, cores):
+    if cores is not None:
+        os.sched_setaffinity(0, cores)
+    try:
+        result = ('result', func(*args, **kwargs))
+    except BaseException as e:
+        result = ('error', '%s: %s\n%s' % (type(e).__name__, e,
+                                           traceback.format_exc()))
+    conn.send(result)
+    conn.close()
+
+
+class Scheduler(object):
+    """
+    Queue of jobs, run in processes within a budget of cores.
+
+    Jobs are started in submission order, as soon as enough cores are
+    free. Cores that a job waits for may meanwhile run smaller jobs
+    submitted after it.
+
+    Parameters
+    ----------
+    n_cores: int or None
+        Core budget. Defaults to the number of cores available to this
+        process.
+
+    pin: boolean
+        Pin each job to its cores (on platforms with os.sched_setaffinity)
+
+    verbose: int
+        Print the start and end of jobs
+
+    Attributes
+    ----------
+    cores: list of int
+        Ids of the cores of the budget
+    """
+
+    def __init__(self, n_cores=None, pin=False, verbose=0):
+        cores = available_cores()
+        if n_cores is None:
+            n_cores = len(cores)
+        if n_cores < 1:
+            raise ValueError('n_cores should be positive, got %r' % n_cores)
+        self.n_cores = n_cores
+        # Budgets larger than the available cores share them
+        self.cores = (cores * (n_cores // len(cores) + 1))[:n_cores]
+        self.pin = pin and hasattr(os, 'sched_setaffinity')
+        self.verbose = verbose
+        self.queue = deque()
+        self.n_jobs = 0
+
+    def submit(self, func, *args, n_cores=1, blas_threads=None, **kwargs):
+        """
+        Queue the call func(*args, **kwargs), using n_cores cores.
+
+        func and its arguments should be picklable: jobs are run in spawned
+        processes, in which BLAS and OpenMP use blas_threads threads.
+
+        Parameters
+        ----------
+        n_cores: int
+            Number of cores reserved for the job
+
+        blas_threads: int or None
+            Number of threads of BLAS and OpenMP in the job, at most
+            n_cores. Defaults to n_cores, for jobs running in a single
+            thread. Jobs running n_cores threads of their own (e.g.
+            estimators with n_threads=n_cores) should use 1, as each of
+            their threads calls BLAS.
+
+        Returns
+        -------
+        job: int
+            Index of the job in the results of run
+        """
+        if not 1 <= n_cores <= self.n_cores:
+            raise ValueError('Jobs should use between 1 and %i cores, '
+                             'got %r' % (self.n_cores, n_cores))
+        if blas_threads is None:
+            blas_threads = n_cores
+        if not 1 <= blas_threads <= n_cores:
+            raise ValueError('Jobs should use between 1 and n_cores=%i BLAS '
+                             'threads, got %r' % (n_cores, blas_threads))
+        job = self.n_jobs
+        self.queue.append((job, func, args, kwargs, n_cores, blas_threads))
+        self.n_jobs += 1
+        return job
+
+    def _start(self, context, job, func, args, kwargs, cores,
+               blas_threads):
+        conn, child_conn = context.Pipe(duplex=False)
+        process = context.Process(
+            target=_run_job,
+            args=(child_conn, func, args, kwargs,
+                  cores if self.pin else None))
+        # Spawned processes inherit the environment at startup
+        with _environ_lock:
+            env = thread_env(blas_threads)
+            previous = {var: os.environ.get(var) for var in env}
+            os.environ.update(env)
+            try:
+                process.start()
+            finally:
+                for var, value in previous.items():
+                    if value is None:
+                        del os.environ[var]
+                    else:
+                        os.environ[var] = value
+        child_conn.close()
+        if self.verbose:
+            print('[Scheduler] Started job %i on %i cores' % (job,
+                                                              len(cores)))
+        return process, conn
+
+    def run(self):
+        """
+        Run queued jobs and wait for their completion.
+
+        Returns
+        -------
+        results: list
+            Return values of jobs, in submission order. Jobs that raised an
+            exception (or died) have a JobError instead.
+        """
+        context = multiprocessing.get_context('spawn')
+        results = {}
+        free = list(self.cores)
+        running = {}
+        queue = self.queue
+        self.queue = deque()
+        t0 = time.perf_counter()
+        try:
+            while queue or running:
+                # Start jobs in order, later ones filling free cores
+                for item in list(queue):
+                    job, func, args, kwargs, n_cores, blas_threads = item
+                    if n_cores <= len(free):
+                        cores, free = free[:n_cores], free[n_cores:]
+                        process, conn = self._start(context, job, func, args,
+                                                    kwargs, cores,
+                                                    blas_threads)
+                        running[conn] = (job, process, cores)
+                        queue.remove(item)
+                for conn in wait(list(running)):
+                    job, process, cores = running.pop(conn)
+                    try:
+                        status, result = conn.recv()
+                    except EOFError:
+                        status, result = 'error', 'Job process died'
+                    conn.close()
+                    process.join()
+                    if status == 'error':
+                        result = JobError(result)
+                    results[job] = result
+                    free += cores
+                    if self.verbose:
+                        print('[Scheduler] Job %i %s, %.1fs elapsed'
+                              % (job, 'failed' if status == 'error'
+                                 else 'done', time.perf_counter() - t0))
+        finally:
+            for _, process, _ in running.values():
+                process.terminate()
+        return [results[job] for job in sorted(results)]
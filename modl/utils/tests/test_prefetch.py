@@ -0,0 +1,55 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from modl.utils.prefetch import prefetch
+
+
+@pytest.mark.parametrize("n_prefetch", [0, 1, 3])
+def test_prefetch(n_prefetch):
+    items = list(range(10))
+    res = list(prefetch(lambda i: np.full(i, i), items,
+                        n_prefetch=n_prefetch))
+    assert [item for item, _ in res] == items
+    for item, result in res:
+        assert np.all(result == item)
+
+
+def test_prefetch_bounds():
+    loading = []
+    lock = threading.Lock()
+
+    def load(i):
+        with lock:
+            loading.append(i)
+        time.sleep(0.01)
+        return np.zeros(100)
+
+    # One item ahead at most, with a memory cap of two results
+    for item, result in prefetch(load, range(10), n_prefetch=3,
+                                 max_bytes=1600, nbytes=lambda i: 800,
+                                 n_threads=3):
+        time.sleep(0.02)
+        with lock:
+            assert max(loading) <= item + 1
+
+    loading = []
+    for item, result in prefetch(load, range(10), n_prefetch=2):
+        time.sleep(0.02)
+        with lock:
+            assert max(loading) <= item + 2
+
+
+def test_prefetch_error():
+    def load(i):
+        if i == 3:
+            raise ValueError
+        return i
+
+    res = []
+    with pytest.raises(ValueError):
+        for item, result in prefetch(load, range(10), n_prefetch=2):
+            res.append(result)
+    assert res == [0, 1, 2]
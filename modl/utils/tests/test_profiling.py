@@ -0,0 +1,27 @@
+import pickle
+
+import numpy as np
+
+from modl.utils.profiling import PhaseProfiler
+
+
+def test_phase_profiler():
+    profiler = PhaseProfiler(['a', 'b'], memory=True)
+    with profiler('a'):
+        x = np.ones(100000)
+    with profiler('a'):
+        pass
+    last = profiler.new_batch()
+    assert last['a']['calls'] == 2
+    assert last['a']['bytes'] >= x.nbytes
+    assert last['b']['calls'] == 0
+    with profiler('b'):
+        pass
+    assert profiler.last['a']['calls'] == 0
+    assert profiler.stats['a']['calls'] == 2
+    assert profiler.stats['b']['calls'] == 1
+
+    profiler = pickle.loads(pickle.dumps(profiler))
+    with profiler('b'):
+        pass
+    assert profiler.stats['b']['calls'] == 2
@@ -0,0 +1,72 @@
+import os
+import time
+
+import pytest
+
+from modl.utils.scheduler import Scheduler, JobError, available_cores
+
+
+def _job(i, duration=0.):
+    start = time.time()
+    time.sleep(duration)
+    affinity = (sorted(os.sched_getaffinity(0))
+                if hasattr(os, 'sched_getaffinity') else None)
+    return (i, os.environ['OMP_NUM_THREADS'],
+            os.environ['OPENBLAS_NUM_THREADS'], affinity, start, time.time())
+
+
+def _failing_job():
+    raise ValueError('failing job')
+
+
+def test_scheduler():
+    environ = dict(os.environ)
+    scheduler = Scheduler(n_cores=2)
+    for i in range(4):
+        scheduler.submit(_job, i, duration=0.2, n_cores=1 + i % 2)
+    results = scheduler.run()
+    assert [result[0] for result in results] == list(range(4))
+    for i, (_, omp, openblas, _, _, _) in enumerate(results):
+        assert omp == openblas == str(1 + i % 2)
+    # Core budget is respected at any time
+    n_cores = [1 + i % 2 for i in range(4)]
+    for _, _, _, _, start, _ in results:
+        used = sum(this_n_cores for this_n_cores, (_, _, _, _, this_start,
+                                                   this_stop)
+                   in zip(n_cores, results)
+                   if this_start <= start < this_stop)
+        assert used <= 2
+    assert os.environ == environ
+
+
+def test_scheduler_blas_threads():
+    scheduler = Scheduler(n_cores=2)
+    scheduler.submit(_job, 0, n_cores=2, blas_threads=1)
+    scheduler.submit(_job, 1, n_cores=2)
+    (_, omp, openblas, _, _, _), (_, default_omp, _, _, _, _) = \
+        scheduler.run()
+    assert omp == openblas == '1'
+    assert default_omp == '2'
+
+
+@pytest.mark.skipif(not hasattr(os, 'sched_setaffinity'),
+                    reason='Requires os.sched_setaffinity')
+def test_scheduler_pin():
+    scheduler = Scheduler(n_cores=1, pin=True)
+    scheduler.submit(_job, 0)
+    (_, _, _, affinity, _, _), = scheduler.run()
+    assert affinity == available_cores()[:1]
+
+
+def test_scheduler_errors():
+    scheduler = Scheduler(n_cores=1)
+    with pytest.raises(ValueError):
+        scheduler.submit(_job, 0, n_cores=2)
+    with pytest.raises(ValueError):
+        scheduler.submit(_job, 0, n_cores=1, blas_threads=2)
+    scheduler.submit(_failing_job)
+    scheduler.submit(_job, 1)
+    error, result = scheduler.run()
+    assert isinstance(error, JobError)
+    assert 'failing job' in str(error)
+    assert result[0] == 1